@@ -0,0 +1,140 @@
+"""
+Structured, non-blocking logging for the Lil IVR backend.
+
+Handlers only put records on an in-memory queue; a QueueListener thread
+formats them as JSON lines and writes them to stdout, so request handlers
+never wait on stdout or its lock. Every line carries the current request
+id. Message and model payloads are only logged for a sampled share of
+requests and are truncated.
+
+Settings (environment variables, see settings.py):
+    LOG_LEVEL                 Initial level (default INFO)
+    LOG_PAYLOAD_SAMPLE_RATE   Share of requests whose payloads are logged (default 0.1)
+    LOG_PAYLOAD_MAX_CHARS     Payload truncation length (default 200)
+
+The level can be changed at runtime with set_level() (wired to
+POST /admin/log-level) or by sending SIGUSR1, which toggles DEBUG. Both
+act on one process: under run.py's workers, the endpoint changes only the
+worker that served the request, and a signal only the worker it is sent
+to. Set LOG_LEVEL and restart to change every worker.
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import signal
+import sys
+
+from settings import settings
+
+LOGGER_NAME = "lilivr"
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+payload_sampled_var = contextvars.ContextVar("payload_sampled", default=False)
+
+# Fields every LogRecord has; anything else came in through extra=
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        line = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            line["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key != "request_id":
+                line[key] = value
+        if record.exc_info:
+            line["exc"] = self.formatException(record.exc_info)
+        return json.dumps(line, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the request id while still on the request's task"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+def configure_logging():
+    """Route the lilivr loggers through a queue to a JSON stdout writer (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    root = logging.getLogger(LOGGER_NAME)
+    root.setLevel(settings.log_level.upper())
+    root.addHandler(queue_handler)
+    root.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+    if hasattr(signal, "SIGUSR1"):
+        try:
+            signal.signal(signal.SIGUSR1, _toggle_debug)
+        except ValueError:
+            # Not on the main thread (e.g. imported by a test runner)
+            pass
+
+
+def shutdown_logging():
+    """Flush queued records (called on app shutdown)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name):
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def set_level(level):
+    level = level.upper()
+    if level not in ("DEBUG", "INFO", "WARNING", "ERROR"):
+        raise ValueError(f"Unknown log level: {level}")
+    logging.getLogger(LOGGER_NAME).setLevel(level)
+    return level
+
+
+def current_level():
+    return logging.getLevelName(logging.getLogger(LOGGER_NAME).level)
+
+
+def _toggle_debug(signum, frame):
+    set_level("INFO" if current_level() == "DEBUG" else "DEBUG")
+
+
+def start_request(request_id):
+    """Bind a request id to the current context and decide whether its payloads are logged"""
+    request_id_var.set(request_id)
+    payload_sampled_var.set(random.random() < settings.log_payload_sample_rate)
+
+
+def payload(text):
+    """Truncated text for sampled requests, None otherwise"""
+    if text is None or not payload_sampled_var.get():
+        return None
+    if len(text) > settings.log_payload_max_chars:
+        return text[:settings.log_payload_max_chars] + "..."
+    return text
@@ -0,0 +1,234 @@
+"""
+Lyrics and song-link content for the Lil IVR backend.
+
+Files are resolved relative to this module, so the server finds them no
+matter which directory uvicorn was started from. Nothing is read at
+import: the server loads content in a thread at startup and reports ready
+once it has (a request arriving earlier loads it itself).
+
+Content comes from the compiled corpus (build/corpus.bin, written by
+format_lyrics.py; see corpus.py). Without one, or when a lyrics file or
+the links file has changed since it was built, the sources are read and
+parsed directly, as they are, with a warning; run format_lyrics.py to get
+the formatted lines back. A ContentRegistry hands out immutable
+ContentSnapshot objects; when the corpus, the persona model or a source
+file changes on disk, a new snapshot is built off the event loop and
+swapped in with a single reference assignment. Requests that already hold the old
+snapshot finish with it, and a broken edit keeps the last good snapshot in
+place.
+
+A snapshot holds the LyricIndex built from the files, the song links, the
+IntentMatcher for the catalogue's song aliases, the LyricRetriever that
+finds lines relevant to a message, the MessagePool behind /random-message
+and the PersonaModel for insults, fallback popups and degraded replies
+(build/persona.bin, or trained from the snapshot's lyrics without one; see
+persona.py).
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from bot_logging import get_logger
+from corpus import build_index, parse_song_links, read_corpus
+from intents import IntentMatcher
+from lyric_index import LyricIndex
+from lyric_retrieval import LyricRetriever
+from message_pool import MessagePool
+from persona import PersonaModel, builtin_sources
+from settings import settings
+
+logger = get_logger("content")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LYRICS_DIR = os.path.join(BASE_DIR, "lyrics")
+LINKS_FILE = os.path.join(BASE_DIR, "song_links.txt")
+BUILD_DIR = os.path.join(BASE_DIR, "build")
+CORPUS_FILE = os.path.join(BUILD_DIR, "corpus.bin")
+# Signature entry for the lyrics directory itself; no lyrics file can be called this
+LYRICS_DIR_ENTRY = "lyrics/"
+PERSONA_FILE = os.path.join(BUILD_DIR, "persona.bin")
+
+FALLBACK_LYRICS = (
+    "Yo jag kör beats hela dagen, skibidi på repeat",
+    "Stockholm till Göteborg, min flow är så sweet",
+    "Autotune på max, jag är king av trap",
+    "IVR i studion, cooking up that sap",
+)
+
+
+class ContentSnapshot:
+    """One consistent, read-only view of the lyrics and links"""
+
+    __slots__ = ("index", "links", "intents", "retriever", "messages", "persona", "fallback", "signature", "loaded_at")
+
+    def __init__(self, index, links, signature, persona=None, fallback=False):
+        self.index = index
+        self.fallback = fallback
+        self.links = tuple(links)
+        self.intents = IntentMatcher(index.aliases)
+        lines = [index.line(i) for i in range(index.line_count)]
+        self.retriever = LyricRetriever(lines, dims=settings.lyric_retrieval_dims)
+        self.messages = MessagePool(index, self.links)
+        self.persona = persona or PersonaModel.train(builtin_sources(lyrics=lines))
+        self.signature = signature
+        self.loaded_at = time.time()
+
+
+class ContentRegistry:
+    def __init__(self, corpus_file=CORPUS_FILE, lyrics_dir=LYRICS_DIR, links_file=LINKS_FILE, persona_file=PERSONA_FILE):
+        self.corpus_file = corpus_file
+        self.persona_file = persona_file
+        self.lyrics_dir = lyrics_dir
+        self.links_file = links_file
+        self._snapshot = None
+        self._first_load = threading.Lock()
+        self.reloads = 0
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    def snapshot(self):
+        """The current snapshot, loading it on first use"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            # The startup preload runs in a thread; a request racing it waits instead of loading twice
+            with self._first_load:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    snapshot = self._snapshot = self._load(self._signature())
+        return snapshot
+
+    def _signature(self):
+        """(name, mtime, size) of the corpus, the persona model, the lyrics directory and every source file"""
+        entries = []
+        for path in (self.persona_file, self.corpus_file):
+            try:
+                stat = os.stat(path)
+                entries.append((os.path.basename(path), stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                pass
+        try:
+            # Changes when a lyrics file is added, removed or renamed
+            entries.append((LYRICS_DIR_ENTRY, os.stat(self.lyrics_dir).st_mtime_ns, 0))
+            with os.scandir(self.lyrics_dir) as it:
+                for entry in it:
+                    if entry.name.endswith(".txt") and entry.is_file():
+                        stat = entry.stat()
+                        entries.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            pass
+        try:
+            stat = os.stat(self.links_file)
+            entries.append((os.path.basename(self.links_file), stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            pass
+        return tuple(sorted(entries))
+
+    def _load_persona(self):
+        """The built persona model, or None to have the snapshot train one"""
+        try:
+            return PersonaModel.load(self.persona_file)
+        except FileNotFoundError:
+            logger.info("no persona model, training one from the loaded lyrics (run format_lyrics.py)",
+                        extra={"file": self.persona_file})
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("could not read persona model, training one", extra={"file": self.persona_file, "error": str(e)})
+        return None
+
+    def _sources_changed_since_build(self, signature):
+        """Whether a source file (or the lyrics directory) is newer than the corpus"""
+        built = {name: mtime for name, mtime, _ in signature}
+        corpus_mtime = built.pop(os.path.basename(self.corpus_file), None)
+        built.pop(os.path.basename(self.persona_file), None)
+        return corpus_mtime is not None and any(mtime > corpus_mtime for mtime in built.values())
+
+    def _load(self, signature):
+        persona = self._load_persona()
+        if self._sources_changed_since_build(signature):
+            logger.warning("lyrics changed since the corpus was built, reading the lyrics files (run format_lyrics.py)",
+                           extra={"file": self.corpus_file})
+            return self._load_sources(signature, persona)
+        try:
+            index, links = read_corpus(self.corpus_file)
+        except FileNotFoundError:
+            logger.warning("no compiled corpus, reading the lyrics files (run format_lyrics.py)",
+                           extra={"file": self.corpus_file})
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("could not read corpus, reading the lyrics files", extra={"file": self.corpus_file, "error": str(e)})
+        else:
+            if index.line_count:
+                logger.info("corpus loaded", extra={"file": self.corpus_file, "lines": index.line_count,
+                                                    "songs": len(index.songs), "links": len(links)})
+                return ContentSnapshot(index, links, signature, persona)
+            logger.warning("corpus has no lyrics, using fallback", extra={"file": self.corpus_file})
+            return ContentSnapshot(LyricIndex([], loose_lines=FALLBACK_LYRICS), links, signature, persona, fallback=True)
+        return self._load_sources(signature, persona)
+
+    def _load_sources(self, signature, persona=None):
+        songs = []
+        try:
+            filenames = sorted(name for name in os.listdir(self.lyrics_dir) if name.endswith(".txt"))
+        except OSError as e:
+            logger.error("error loading lyrics directory", extra={"dir": self.lyrics_dir, "error": str(e)})
+            filenames = []
+
+        for filename in filenames:
+            path = os.path.join(self.lyrics_dir, filename)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+            except (OSError, UnicodeDecodeError) as e:
+                logger.error("could not read lyrics file", extra={"file": path, "error": str(e)})
+                continue
+            songs.append((filename[:-len(".txt")], text))
+
+        links = []
+        try:
+            with open(self.links_file, "r", encoding="utf-8") as f:
+                links = parse_song_links(f.read())
+            logger.info("song links loaded", extra={"file": self.links_file, "links": len(links)})
+        except FileNotFoundError:
+            logger.warning("no song links found, notifications will not include links")
+        except (OSError, UnicodeDecodeError) as e:
+            logger.error("error loading song links", extra={"error": str(e)})
+
+        index = build_index(songs, links)
+        if not index.line_count:
+            logger.warning("no lyrics found, using fallback", extra={"dir": self.lyrics_dir})
+            index = build_index(songs, links, loose_lines=FALLBACK_LYRICS)
+            return ContentSnapshot(index, links, signature, persona, fallback=True)
+
+        logger.info("lyrics loaded", extra={"lines": index.line_count, "songs": len(index.songs),
+                                            "aliases": len(index.aliases)})
+        return ContentSnapshot(index, links, signature, persona)
+
+    def reload_if_changed(self):
+        """Build and swap in a new snapshot if the files changed; returns True if it did"""
+        signature = self._signature()
+        current = self._snapshot
+        if current is not None and current.signature == signature:
+            return False
+        snapshot = self._load(signature)
+        if current is not None and snapshot.fallback and not current.fallback:
+            # A half-written or emptied directory; keep serving the last good content
+            logger.warning("reloaded content is empty, keeping previous snapshot")
+            return False
+        self._snapshot = snapshot
+        self.reloads += 1
+        return True
+
+    async def watch(self, interval=2.0):
+        """Poll the files every interval seconds and hot-swap changed content"""
+        while True:
+            await asyncio.sleep(interval)
+            if self._snapshot is None:
+                # Not loaded yet; the first request will pick up the current files
+                continue
+            try:
+                if await asyncio.to_thread(self.reload_if_changed):
+                    logger.info("content reloaded", extra={"reloads": self.reloads})
+            except Exception as e:
+                logger.error("content reload failed", extra={"error": str(e)})
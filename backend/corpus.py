@@ -0,0 +1,138 @@
+"""
+Compiled lyrics corpus.
+
+format_lyrics.py formats the lyrics files and compiles them, together with
+song_links.txt, into one binary file (build/corpus.bin) that the server
+loads at startup: a single read, a JSON header and two blobs that become
+the LyricIndex's offset array and text string as they are. Song ranges,
+titles, aliases and links are resolved at build time, so no lyrics file
+is globbed, split or parsed while the server starts.
+
+Layout (little-endian):
+
+    header   magic b"LILIVR", format version (u16), metadata bytes (u32), line count (u32)
+    metadata JSON: songs as [name, title, first, end, link number or -1], links, aliases
+    offsets  line count + 1 u32 character offsets into the text (the last is a sentinel)
+    text     UTF-8, the lines joined by "\n"
+
+The parsers for the source files live here too; content.py uses them to
+build the same index straight from the sources when there is no corpus.
+"""
+
+import json
+import os
+import re
+import struct
+import sys
+from array import array
+from types import MappingProxyType
+
+from lyric_index import LyricIndex, Song, parse_lyrics_header
+
+MAGIC = b"LILIVR"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<6sHII")
+
+QUOTED_LINK = re.compile(r'(https?://[^\s]+)\s+"([^"]+)"')
+
+
+def parse_lyrics(text):
+    """Quote-able lines of a lyrics file: no blanks, comments or [section] headers"""
+    return [line.strip() for line in text.strip().split("\n")
+            if line.strip() and not line.startswith("#") and not line.startswith("[")]
+
+
+def song_filename_for(song_name):
+    """Lyrics filename (without .txt) that a link's song name refers to"""
+    return song_name.lower().replace(" ", "_").replace("-", "_")
+
+
+def parse_song_links(text):
+    """SoundCloud links, one per line as: URL "Song Name", URL Song Name, or a bare URL"""
+    links = []
+    for line in text.strip().split("\n"):
+        line = line.strip()
+        if not line or line.startswith("#") or "soundcloud.com" not in line:
+            continue
+        match = QUOTED_LINK.match(line)
+        if match:
+            url, song_name = match.groups()
+        else:
+            parts = line.split(" ", 1)
+            if len(parts) != 2:
+                links.append(MappingProxyType({"url": line, "name": None, "filename": None}))
+                continue
+            url, song_name = parts
+        links.append(MappingProxyType({
+            "url": url.strip(),
+            "name": song_name.strip(),
+            "filename": song_filename_for(song_name),
+        }))
+    return links
+
+
+def build_index(songs, links, loose_lines=()):
+    """LyricIndex for (name, text) per lyrics file, with each song's link attached"""
+    links_by_song = {link["filename"]: link for link in links if link["filename"]}
+    return LyricIndex([(name, parse_lyrics(text), parse_lyrics_header(text), links_by_song.get(name))
+                       for name, text in songs], loose_lines=loose_lines)
+
+
+def write_atomic(path, data):
+    """Replace path with data; readers see the old file or the new one, never a partial write"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_corpus(path, index, links):
+    link_numbers = {id(link): i for i, link in enumerate(links)}
+    meta = json.dumps({
+        "songs": [[song.name, song.title, song.first, song.end,
+                   link_numbers.get(id(song.link), -1) if song.link else -1]
+                  for song in index.songs.values()],
+        "links": [dict(link) for link in links],
+        "aliases": index.aliases,
+    }, ensure_ascii=False).encode("utf-8")
+    offsets = array("I", index.offsets)
+    if sys.byteorder == "big":
+        offsets.byteswap()
+
+    write_atomic(path, b"".join((
+        HEADER.pack(MAGIC, FORMAT_VERSION, len(meta), index.line_count),
+        meta,
+        offsets.tobytes(),
+        index.text.encode("utf-8"),
+    )))
+
+
+def read_corpus(path):
+    """(LyricIndex, links) from a corpus file; ValueError if it isn't one this version reads"""
+    with open(path, "rb") as f:
+        data = memoryview(f.read())
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is truncated")
+    magic, version, meta_size, line_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a version {FORMAT_VERSION} corpus")
+
+    position = HEADER.size
+    meta = json.loads(bytes(data[position:position + meta_size]))
+    position += meta_size
+    offsets = array("I")
+    offsets_size = (line_count + 1) * offsets.itemsize
+    offsets.frombytes(data[position:position + offsets_size])
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    position += offsets_size
+    text = str(data[position:], "utf-8")
+    if len(offsets) != line_count + 1 or offsets[-1] != (len(text) + 1 if line_count else 0):
+        raise ValueError(f"{path} is truncated")
+
+    links = [MappingProxyType(link) for link in meta["links"]]
+    songs = {name: Song(name, title, first, end, links[link] if link >= 0 else None)
+             for name, title, first, end, link in meta["songs"]}
+    return LyricIndex.compiled(text, offsets, songs, meta["aliases"]), links
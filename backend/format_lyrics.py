@@ -1,29 +1,53 @@
 #!/usr/bin/env python3
 """
-Lyrics Formatter Script for Lil IVR Bot
+Lyrics Formatter and Corpus Builder for Lil IVR Bot
 
-This script helps reformat lyrics files to create better quotes:
+Reformats the lyrics files to create better quotes:
 - Combines short lines into meaningful phrases
 - Ensures each line has sufficient context
 - Removes empty lines and formatting artifacts
 - Creates consistent line lengths for better quote extraction
 
-Usage: python3 format_lyrics.py
+The files in lyrics/ are the sources and are never written. Formatted
+copies go to build/lyrics/, and everything is compiled with song_links.txt
+into build/corpus.bin, which the server loads at startup (see corpus.py).
+The persona model behind insults, fallback popups and degraded replies is
+trained on the compiled lyrics, the built-in lines and past bot replies
+(--replies: a JSON log or one reply per line) into build/persona.bin (see
+persona.py). The replies are kept in build/replies.txt, so later builds
+without --replies train on them again; --replies replaces them and
+--clear-replies drops them.
+build/manifest.json records a content hash per source file, so a rerun
+only formats the files that changed; changing this script reformats all
+of them. Files are formatted in a process pool, and every output is
+written atomically, so a running server never reads a half-written one.
+
+Usage: python3 format_lyrics.py [--workers N] [--force] [--replies FILE ... | --clear-replies]
 """
 
+import argparse
+import hashlib
+import json
 import os
-import glob
 import re
+from concurrent.futures import ProcessPoolExecutor
 
-def format_lyrics_file(file_path):
-    """Format a single lyrics file for better quote extraction."""
-    print(f"📝 Processing: {file_path}")
+from content import BUILD_DIR, LINKS_FILE, LYRICS_DIR
+from corpus import FORMAT_VERSION, build_index, parse_song_links, read_corpus, write_atomic, write_corpus
+from persona import FORMAT_VERSION as PERSONA_VERSION, PersonaModel, builtin_sources, parse_replies
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
+MANIFEST_FILE = "manifest.json"
+CORPUS_FILE = "corpus.bin"
+PERSONA_FILE = "persona.bin"
+REPLIES_FILE = "replies.txt"
 
+def format_lyrics_text(text):
+    """Format the text of one lyrics file for better quote extraction; returns its lines."""
     # Split into lines and clean
-    lines = [line.strip() for line in content.split('\n')]
+    lines = [line.strip() for line in text.split('\n')]
+
+    # Keep "# title:" / "# aliases:" metadata, the server reads it
+    header_lines = [line for line in lines if re.match(r'^#\s*(title|aliases)\s*:', line, re.IGNORECASE)]
 
     # Remove empty lines, comments, and section headers
     cleaned_lines = []
@@ -58,7 +82,7 @@ def format_lyrics_file(file_path):
 
         i += 1
 
-    return formatted_lines
+    return header_lines + formatted_lines
 
 def clean_lyric_line(line):
     """Clean a lyric line by removing unwanted characters and patterns."""
@@ -80,47 +104,153 @@ def clean_lyric_line(line):
 
     return line
 
-def main():
-    """Process all lyrics files in the lyrics directory."""
-    lyrics_dir = 'lyrics'
-
-    if not os.path.exists(lyrics_dir):
-        print(f"❌ Lyrics directory '{lyrics_dir}' not found!")
-        return
+def format_source(name, data):
+    """Process pool task: (name, formatted file bytes, source line count, formatted line count)"""
+    text = data.decode('utf-8')
+    lines = format_lyrics_text(text)
+    original_lines = len([line for line in text.split('\n') if line.strip()])
+    return name, "".join(line + '\n' for line in lines).encode('utf-8'), original_lines, len(lines)
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def formatter_digest():
+    """Hash of this script, so a change to the formatting rules rebuilds every file"""
+    with open(os.path.abspath(__file__), 'rb') as f:
+        return digest(f.read())
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def persona_digest(sources):
+    """Hash of every persona training line, so the model is retrained exactly when they change"""
+    data = json.dumps([PERSONA_VERSION, sorted(sources.items())], ensure_ascii=False)
+    return digest(data.encode('utf-8'))
+
+def build(lyrics_dir=LYRICS_DIR, links_file=LINKS_FILE, build_dir=BUILD_DIR, workers=None, force=False, replies=None):
+    """Format changed lyrics files and recompile the corpus and persona model if anything changed; returns a summary
+
+    replies: files with past bot replies replacing the kept ones; None reuses
+             the replies kept from an earlier build, () drops them
+    """
+    output_dir = os.path.join(build_dir, 'lyrics')
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(build_dir, MANIFEST_FILE)
+    corpus_path = os.path.join(build_dir, CORPUS_FILE)
+    persona_path = os.path.join(build_dir, PERSONA_FILE)
+    replies_path = os.path.join(build_dir, REPLIES_FILE)
+
+    manifest = load_manifest(manifest_path)
+    formatter = formatter_digest()
+    if force or manifest.get('formatter') != formatter:
+        manifest = {}
+    built = manifest.get('files', {})
+
+    sources = {}
+    for filename in sorted(os.listdir(lyrics_dir)):
+        if filename.endswith('.txt'):
+            with open(os.path.join(lyrics_dir, filename), 'rb') as f:
+                sources[filename] = f.read()
+    hashes = {filename: digest(data) for filename, data in sources.items()}
+
+    changed = [filename for filename in sources
+               if built.get(filename) != hashes[filename] or not os.path.exists(os.path.join(output_dir, filename))]
+    removed = [filename for filename in os.listdir(output_dir) if filename.endswith('.txt') and filename not in sources]
+
+    if len(changed) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(format_source, changed, [sources[filename] for filename in changed]))
+    else:
+        results = [format_source(filename, sources[filename]) for filename in changed]
+
+    for filename, formatted, original_lines, formatted_lines in results:
+        write_atomic(os.path.join(output_dir, filename), formatted)
+        print(f"✅ {filename}: {original_lines} → {formatted_lines} lines")
+    for filename in removed:
+        os.remove(os.path.join(output_dir, filename))
+        print(f"🗑️  {filename}: source removed")
+
+    try:
+        with open(links_file, 'rb') as f:
+            links_data = f.read()
+    except FileNotFoundError:
+        links_data = b""
+    links_hash = digest(links_data)
+
+    compiled = False
+    if (changed or removed or manifest.get('links') != links_hash or manifest.get('corpus') != FORMAT_VERSION
+            or not os.path.exists(corpus_path)):
+        songs = []
+        for filename in sources:
+            with open(os.path.join(output_dir, filename), 'r', encoding='utf-8') as f:
+                songs.append((filename[:-len('.txt')], f.read()))
+        links = parse_song_links(links_data.decode('utf-8'))
+        index = build_index(songs, links)
+        write_corpus(corpus_path, index, links)
+        compiled = True
+    else:
+        index, _ = read_corpus(corpus_path)
+
+    reply_lines = []
+    if replies is None:
+        try:
+            with open(replies_path, 'r', encoding='utf-8') as f:
+                reply_lines = f.read().splitlines()
+        except FileNotFoundError:
+            pass
+    else:
+        for path in replies:
+            with open(path, 'r', encoding='utf-8') as f:
+                reply_lines.extend(" ".join(reply.split()) for reply in parse_replies(f.read()))
+        write_atomic(replies_path, "".join(reply + '\n' for reply in reply_lines).encode('utf-8'))
+    persona_sources = builtin_sources(lyrics=[index.line(i) for i in range(index.line_count)], replies=reply_lines)
+    persona_hash = persona_digest(persona_sources)
+    trained = False
+    if manifest.get('persona') != persona_hash or not os.path.exists(persona_path):
+        PersonaModel.train(persona_sources).save(persona_path)
+        trained = True
+
+    manifest = {'formatter': formatter, 'corpus': FORMAT_VERSION, 'links': links_hash, 'files': hashes,
+                'persona': persona_hash}
+    write_atomic(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return {'sources': len(sources), 'formatted': len(changed), 'removed': len(removed), 'compiled': compiled,
+            'corpus': corpus_path, 'trained': trained, 'replies': len(reply_lines), 'persona': persona_path}
 
-    # Find all .txt files
-    txt_files = glob.glob(os.path.join(lyrics_dir, '*.txt'))
-
-    if not txt_files:
-        print(f"❌ No .txt files found in '{lyrics_dir}'!")
+def main():
+    """Build the formatted lyrics and the compiled corpus."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=None, help="formatting processes (default: one per CPU)")
+    parser.add_argument("--force", action="store_true", help="reformat every file, ignoring the manifest")
+    replies = parser.add_mutually_exclusive_group()
+    replies.add_argument("--replies", action="append", metavar="FILE",
+                         help="past bot replies for the persona model: a JSON server log or one reply per line; "
+                              "replaces the replies kept from earlier builds")
+    replies.add_argument("--clear-replies", action="store_true", help="train the persona model without past replies")
+    args = parser.parse_args()
+
+    if not os.path.exists(LYRICS_DIR):
+        print(f"❌ Lyrics directory '{LYRICS_DIR}' not found!")
         return
 
-    print(f"🎤 Found {len(txt_files)} lyrics files to format")
-
-    total_original_lines = 0
-    total_formatted_lines = 0
-
-    for file_path in txt_files:
-        # Read original
-        with open(file_path, 'r', encoding='utf-8') as f:
-            original_lines = len([line for line in f.readlines() if line.strip()])
-
-        # Format the file
-        formatted_lines = format_lyrics_file(file_path)
-
-        # Write formatted version directly (no backup)
-        with open(file_path, 'w', encoding='utf-8') as f:
-            for line in formatted_lines:
-                f.write(line + '\n')
-
-        print(f"✅ {os.path.basename(file_path)}: {original_lines} → {len(formatted_lines)} lines")
-
-        total_original_lines += original_lines
-        total_formatted_lines += len(formatted_lines)
-
-    print(f"\n🎉 Formatting complete!")
-    print(f"📊 Total lines: {total_original_lines} → {total_formatted_lines}")
-    print(f"🔄 Restart the server to load new formatted lyrics")
+    summary = build(workers=args.workers, force=args.force, replies=() if args.clear_replies else args.replies)
+    if not summary['sources']:
+        print(f"⚠️  No .txt files found in '{LYRICS_DIR}', the server will use its fallback lyrics")
+
+    print(f"\n🎉 Build complete!")
+    print(f"📊 {summary['formatted']} of {summary['sources']} files formatted, {summary['removed']} removed")
+    if summary['compiled']:
+        print(f"📦 Corpus written to {summary['corpus']}")
+        print(f"🔄 A running server picks up the new lyrics within a few seconds")
+    else:
+        print(f"📦 Nothing changed, corpus is up to date")
+    if summary['trained']:
+        print(f"🎭 Persona model trained with {summary['replies']} past replies, written to {summary['persona']}")
+    else:
+        print(f"🎭 Persona model is up to date")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
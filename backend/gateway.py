@@ -0,0 +1,197 @@
+"""
+Upstream gateway in front of the OpenAI API.
+
+Every completion takes a permit from its model's lane before it is sent:
+
+- a bounded semaphore caps the calls in flight per model,
+- callers that find it full wait in a bounded queue, each with a deadline,
+- token buckets keep the request and token rate under the account's
+  RPM/TPM limits instead of letting the provider answer 429,
+- a circuit breaker stops sending after repeated upstream failures and
+  lets a single probe through once its cooldown has passed.
+
+When a permit can't be had in time, UpstreamUnavailable is raised right
+away so the caller can degrade (canned replies) instead of piling up
+requests that would time out anyway. While the server shuts down the
+gateway drains: new calls are turned away and the ones in flight finish.
+"""
+
+import asyncio
+import time
+
+
+class UpstreamUnavailable(Exception):
+    """No permit for an upstream call; reason is queue_full, deadline, rate_limited, circuit_open or draining"""
+
+    def __init__(self, model, reason):
+        super().__init__(f"{model} unavailable: {reason}")
+        self.model = model
+        self.reason = reason
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second up to one minute's worth"""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount is available (0 if it is now)"""
+        self._refill()
+        if self.level >= amount:
+            return 0.0
+        return (min(amount, self.capacity) - self.level) / self.rate
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def adjust(self, amount):
+        """Correct an earlier estimate once the real cost is known (may go negative)"""
+        self.level = min(self.capacity, self.level - amount)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, cooldown=15.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self.probing = False
+        if self.state == self.HALF_OPEN and not self.probing:
+            # Exactly one probe decides whether the upstream is back
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def cancel_probe(self):
+        """The probe never reached the upstream; let the next caller probe instead"""
+        if self.state == self.HALF_OPEN:
+            self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class ModelLane:
+    def __init__(self, model, max_concurrency, max_queue, rpm, tpm, breaker):
+        self.model = model
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.breaker = breaker
+
+    def reject(self, reason):
+        self.breaker.cancel_probe()
+        raise UpstreamUnavailable(self.model, reason)
+
+    async def acquire(self, estimated_tokens, deadline):
+        """Take a concurrency slot and rate budget, or raise UpstreamUnavailable"""
+        if not self.breaker.allow():
+            self.reject("circuit_open")
+
+        if self.slots.locked():
+            if self.waiting >= self.max_queue:
+                self.reject("queue_full")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.slots.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self.reject("deadline")
+            finally:
+                self.waiting -= 1
+        else:
+            await self.slots.acquire()
+
+        try:
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+            if wait > 0:
+                if time.monotonic() + wait > deadline:
+                    self.reject("rate_limited")
+                await asyncio.sleep(wait)
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.slots.release()
+
+
+class UpstreamGateway:
+    def __init__(self, lane_factory):
+        """lane_factory(model) -> ModelLane, called the first time a model is used"""
+        self.lane_factory = lane_factory
+        self.lanes = {}
+        self.draining = False
+
+    def lane(self, model):
+        lane = self.lanes.get(model)
+        if lane is None:
+            lane = self.lanes[model] = self.lane_factory(model)
+        return lane
+
+    def busy(self):
+        return sum(lane.in_flight + lane.waiting for lane in self.lanes.values())
+
+    async def drain(self, timeout, poll=0.05):
+        """Stop handing out permits and wait up to timeout seconds for calls in flight; True if all finished"""
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        while self.busy():
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(poll)
+        return True
+
+
+class Coalescer:
+    """Concurrent calls with the same key share one in-flight result"""
+
+    def __init__(self):
+        self.in_flight = {}
+        self.coalesced = 0
+
+    async def run(self, key, factory):
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.create_task(factory())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # Shielded so one caller giving up doesn't cancel the others' result
+        return await asyncio.shield(task)
@@ -0,0 +1,99 @@
+"""
+Pre-generated greeting pool for /analyze-webpage.
+
+Opening the popup is the first interaction and the busiest endpoint. The
+greeting prompt only varies by lyric and site, so for the well-known sites
+(YouTube, GitHub, "en ny flik", ...) greetings are generated ahead of time
+and served from memory. Each pooled greeting is served a few times before
+it is retired, and a pool that runs low is refilled in the background.
+Sites without a pool fall through to live generation.
+"""
+
+import asyncio
+import random
+
+from bot_logging import get_logger
+
+logger = get_logger("greetings")
+
+
+class PooledGreeting:
+    __slots__ = ("text", "uses")
+
+    def __init__(self, text):
+        self.text = text
+        self.uses = 0
+
+
+class GreetingPool:
+    def __init__(self, generate, domains, size=6, low_water=2, max_uses=3):
+        """
+        generate:  async callable(domain) -> greeting text (or None on failure)
+        domains:   domain labels that get a pool
+        size:      greetings kept per domain after a refill
+        low_water: refill once a domain has this many greetings or fewer
+        max_uses:  times a greeting is served before it is retired
+        """
+        self.generate = generate
+        self.size = size
+        self.low_water = low_water
+        self.max_uses = max_uses
+        self.pools = {domain: [] for domain in domains}
+        self.refilling = {}
+        self.served = 0
+        self.misses = 0
+
+    def take(self, domain):
+        """Return a pooled greeting for domain, or None if it must be generated live"""
+        pool = self.pools.get(domain)
+        if pool is None:
+            return None
+
+        if len(pool) <= self.low_water:
+            self.schedule_refill(domain)
+
+        if not pool:
+            self.misses += 1
+            return None
+
+        index = random.randrange(len(pool))
+        greeting = pool[index]
+        greeting.uses += 1
+        if greeting.uses >= self.max_uses:
+            # Swap-remove keeps retirement O(1)
+            pool[index] = pool[-1]
+            pool.pop()
+        self.served += 1
+        return greeting.text
+
+    def schedule_refill(self, domain):
+        if domain in self.refilling:
+            return
+        self.refilling[domain] = asyncio.create_task(self._refill(domain))
+
+    async def _refill(self, domain):
+        pool = self.pools[domain]
+        try:
+            while len(pool) < self.size:
+                text = await self.generate(domain)
+                if not text:
+                    break
+                pool.append(PooledGreeting(text))
+            logger.info("greeting pool refilled", extra={"domain": domain, "pooled": len(pool)})
+        except Exception as e:
+            logger.error("greeting pool refill failed", extra={"domain": domain, "error": str(e)})
+        finally:
+            self.refilling.pop(domain, None)
+
+    def warm(self):
+        """Start filling every pool (call from a running event loop)"""
+        for domain in self.pools:
+            self.schedule_refill(domain)
+
+    def stats(self):
+        return {
+            "served": self.served,
+            "misses": self.misses,
+            "pooled": sum(len(pool) for pool in self.pools.values()),
+            "refilling": len(self.refilling),
+        }
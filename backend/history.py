@@ -0,0 +1,164 @@
+"""
+Conversation history compaction for /chat.
+
+The extension sends the whole conversation on every turn. Copying all of
+it into the prompt grows each request without bound and makes a long
+session cost quadratic tokens. HistoryManager keeps the last few messages
+verbatim and folds everything older into a short rolling summary that is
+cached per conversation, so only newly folded messages are processed on
+later turns. Sizes are estimated locally, without calling any tokenizer
+service.
+
+A cached summary is only extended when the messages it folded are exactly
+the leading messages of the history at hand: each summary records a hash
+of its folded prefix. Server-side sessions look their summary up by
+session id; stateless clients by that prefix hash, so two conversations
+that open the same way share a summary only as far as their messages are
+identical.
+"""
+
+import hashlib
+import re
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Rough per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=4096)
+def estimate_tokens(text):
+    """Approximate BPE token count: one token per ~4 characters of each word, one per symbol"""
+    return sum((len(token) + 3) // 4 for token in TOKEN_PATTERN.findall(text))
+
+
+def message_tokens(content):
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+def conversation_key(history):
+    """Stable key for a conversation: its opening messages don't change between turns
+
+    Conversations that open the same way share it; only use it where that is
+    harmless (lyric rotation), never to look up anything built from content.
+    """
+    digest = hashlib.sha1()
+    for msg in history[:2]:
+        digest.update(msg.role.encode())
+        digest.update(msg.content.encode())
+    return digest.hexdigest()
+
+
+def prefix_digests(history):
+    """Hash of history[:i] for every i from 0 to len(history)"""
+    digest = hashlib.sha1()
+    digests = [digest.hexdigest()]
+    for msg in history:
+        digest.update(msg.role.encode())
+        digest.update(b"\0")
+        digest.update(msg.content.encode())
+        digest.update(b"\0")
+        digests.append(digest.hexdigest())
+    return digests
+
+
+class RollingSummary:
+    __slots__ = ("folded", "prefix", "lines", "tokens")
+
+    def __init__(self, prefix):
+        self.folded = 0  # how many leading history messages are already in lines
+        self.prefix = prefix  # prefix_digests() entry for those messages
+        self.lines = deque()  # (line, estimated tokens)
+        self.tokens = 0
+
+
+class HistoryManager:
+    def __init__(self, max_tokens=1500, keep_messages=8, summary_tokens=300,
+                 snippet_chars=120, max_sessions=2048):
+        """
+        max_tokens:     budget for summary + verbatim history in the prompt
+        keep_messages:  most recent messages kept verbatim (if they fit the budget)
+        summary_tokens: budget for the rolling summary of older messages
+        snippet_chars:  how much of each folded message goes into the summary
+        max_sessions:   conversations whose summaries are cached (LRU)
+        """
+        self.max_tokens = max_tokens
+        self.keep_messages = keep_messages
+        self.summary_tokens = summary_tokens
+        self.snippet_chars = snippet_chars
+        self.max_sessions = max_sessions
+        self.summaries = OrderedDict()
+
+    def compact(self, history, session_key=None):
+        """Turn conversation history into prompt messages that fit the token budget"""
+        history = [msg for msg in history or [] if msg.role in ("user", "assistant") and msg.content]
+        if not history:
+            return []
+
+        # Keep the newest messages verbatim while they fit what the summary leaves over
+        budget = self.max_tokens - self.summary_tokens
+        split = len(history)
+        used = 0
+        while split > 0 and len(history) - split < self.keep_messages:
+            cost = message_tokens(history[split - 1].content)
+            if used + cost > budget:
+                break
+            used += cost
+            split -= 1
+
+        messages = []
+        if split > 0:
+            summary = self._summarize(session_key, history[:split])
+            if summary:
+                messages.append({
+                    "role": "system",
+                    "content": "Sammanfattning av tidigare konversation:\n" + summary
+                })
+
+        for msg in history[split:]:
+            messages.append({"role": msg.role, "content": msg.content})
+        return messages
+
+    def _summarize(self, session_key, folded):
+        digests = prefix_digests(folded)
+        summary = None
+        if session_key:
+            summary = self.summaries.get(session_key)
+            if summary is not None and (summary.folded > len(folded) or digests[summary.folded] != summary.prefix):
+                # The client sent a shorter or different history than before
+                summary = None
+        else:
+            # The longest prefix of this history that some cached summary folded
+            for digest in reversed(digests[1:]):
+                summary = self.summaries.pop(digest, None)
+                if summary is not None:
+                    break
+        if summary is None:
+            summary = RollingSummary(digests[0])
+
+        key = session_key or digests[-1]
+        self.summaries[key] = summary
+        self.summaries.move_to_end(key)
+        while len(self.summaries) > self.max_sessions:
+            self.summaries.popitem(last=False)
+
+        # Only messages folded since the last turn need processing
+        for msg in folded[summary.folded:]:
+            speaker = "Användaren" if msg.role == "user" else "Du"
+            snippet = " ".join(msg.content.split())
+            if len(snippet) > self.snippet_chars:
+                snippet = snippet[:self.snippet_chars].rsplit(" ", 1)[0] + "..."
+            line = f"- {speaker}: {snippet}"
+            tokens = estimate_tokens(line) + 1
+            summary.lines.append((line, tokens))
+            summary.tokens += tokens
+        summary.folded = len(folded)
+        summary.prefix = digests[-1]
+
+        # Oldest lines fall out of the summary first
+        while summary.lines and summary.tokens > self.summary_tokens:
+            _, tokens = summary.lines.popleft()
+            summary.tokens -= tokens
+        return "\n".join(line for line, _ in summary.lines)
@@ -0,0 +1,115 @@
+"""
+Keyword and intent matching for chat messages.
+
+All trigger phrases (web search questions, lyric requests, popup commands
+and song names) are compiled into a single alternation regex. An
+IntentMatcher is built once per song catalogue (the aliases come from the
+LyricIndex); match() makes one pass over the message and reports every
+intent and song it found. Phrases only match as whole words, so "down" no
+longer fires inside "download" and "john" not inside "johnny".
+"""
+
+import re
+
+# Factual questions that trigger a web search (Swedish focused)
+SEARCH_INDICATORS = (
+    'vad är', 'vad e', 'vad betyder', 'vadå', 'va är',
+    'vem är', 'vem e', 'vilka är', 'vilka e',
+    'var är', 'var e', 'var ligger', 'var finns',
+    'när är', 'när e', 'när var', 'när hände',
+    'hur är', 'hur e', 'hur fungerar', 'hur gör', 'hur många',
+    'varför är', 'varför e', 'varför kan', 'varför ska',
+    'vilken är', 'vilken e', 'vilket är', 'vilket e',
+    'berätta om', 'förklara*', 'kan du förklara*',
+    'vet du', 'känner du till', 'har du hört',
+    'what is', 'who is', 'where is', 'when', 'how', 'why',
+)
+
+# The user is asking for lyrics/quotes (with common Swedish inflections)
+LYRIC_KEYWORDS = (
+    'quote', 'quotes', 'låt', 'låten', 'låtar', 'låtarna',
+    'text', 'texten', 'texter', 'rad', 'raden', 'rader', 'raderna',
+    'lyric', 'lyrics',
+)
+
+# The user wants popups turned off
+POPUP_DISABLE_PHRASES = (
+    'stäng av popup*', 'stoppa popup*', 'sluta popup*', 'stäng popup*',
+    'disable popup*', 'turn off popup*', 'stop popup*', 'no popup*',
+)
+
+# The extension is asking for a popup notification line
+POPUP_REQUEST_WORDS = ('töntig*', 'popup*')
+
+
+def _alternation(phrases):
+    """Regex alternation for phrases, longest first so the longest phrase wins.
+
+    A trailing '*' lets the last word continue (Swedish inflections such as
+    "popupsen" or "förklarar").
+    """
+    parts = []
+    for phrase in sorted(phrases, key=len, reverse=True):
+        if phrase.endswith('*'):
+            parts.append(re.escape(phrase[:-1]) + r'\w*')
+        else:
+            parts.append(re.escape(phrase))
+    return '|'.join(parts)
+
+
+def build_intent_pattern(song_aliases):
+    # Groups are tried in this order at each position, so multi-word commands
+    # and song names take precedence over the shorter keywords they contain.
+    groups = [('popup_disable', POPUP_DISABLE_PHRASES), ('song', song_aliases),
+              ('search', SEARCH_INDICATORS), ('lyrics', LYRIC_KEYWORDS), ('popup', POPUP_REQUEST_WORDS)]
+    return re.compile(
+        r'(?<!\w)(?:'
+        + '|'.join(f'(?P<{name}>{_alternation(phrases)})' for name, phrases in groups if phrases)
+        + r')(?!\w)'
+    )
+
+
+class Intents:
+    __slots__ = ('needs_web_search', 'asking_for_lyrics', 'disable_popups', 'popup_request', 'songs')
+
+    def __init__(self):
+        self.needs_web_search = False
+        self.asking_for_lyrics = False
+        self.disable_popups = False
+        self.popup_request = False
+        self.songs = []  # song filenames in order of appearance
+
+    @property
+    def song(self):
+        return self.songs[0] if self.songs else None
+
+
+class IntentMatcher:
+    def __init__(self, song_aliases):
+        """song_aliases: lowercase alias -> song filename"""
+        self.song_aliases = dict(song_aliases)
+        self.pattern = build_intent_pattern(self.song_aliases)
+
+    def match(self, text):
+        """Find every intent and song mentioned in text in a single pass"""
+        intents = Intents()
+        for match in self.pattern.finditer(text.lower()):
+            kind = match.lastgroup
+            if kind == 'search':
+                intents.needs_web_search = True
+            elif kind == 'lyrics':
+                intents.asking_for_lyrics = True
+            elif kind == 'song':
+                filename = self.song_aliases[match.group(kind)]
+                if filename not in intents.songs:
+                    intents.songs.append(filename)
+            elif kind == 'popup_disable':
+                intents.disable_popups = True
+                intents.popup_request = True
+            else:
+                intents.popup_request = True
+        return intents
+
+    def find_song(self, text):
+        """Return the first song mentioned in text, or None"""
+        return self.match(text).song
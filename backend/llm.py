@@ -0,0 +1,163 @@
+"""
+Shared async OpenAI client for the Lil IVR backend.
+
+All upstream completions go through one AsyncOpenAI instance backed by a
+pooled httpx connection, so the event loop never blocks on a model call and
+keep-alive connections are reused between requests. Each call first takes a
+permit from the model's gateway lane (see gateway.py); when none is free
+in time, create_completion raises UpstreamUnavailable.
+
+Tuned through settings.py; the environment variables are:
+    OPENAI_BASE_URL          Point the client at another endpoint (e.g. a local stub)
+    OPENAI_MAX_CONNECTIONS   Max open connections in the pool (default 100)
+    OPENAI_MAX_KEEPALIVE     Max idle keep-alive connections (default 20)
+    OPENAI_MAX_CONCURRENCY   Max completions in flight per model and worker (default 64, gpt-4o 16)
+    OPENAI_RPM / OPENAI_TPM  Request and token rate limits per model (default 500 / 200000)
+    <MODEL>_MAX_CONCURRENCY, <MODEL>_RPM, <MODEL>_TPM
+                             Per-model overrides, e.g. GPT_4O_RPM or GPT_4O_MINI_TPM
+    UPSTREAM_MAX_QUEUE       Calls that may wait for a busy model (default 200)
+    UPSTREAM_QUEUE_TIMEOUT   Longest wait for a permit in seconds (default 5)
+    UPSTREAM_BREAKER_FAILURES  Consecutive failures that open the breaker (default 5)
+    UPSTREAM_BREAKER_COOLDOWN  Seconds before an open breaker lets a probe through (default 15)
+    OPENAI_TIMEOUT           Default per-call timeout in seconds (default 30)
+    OPENAI_SEARCH_TIMEOUT    Timeout for the gpt-4o web search call (default 20)
+    OPENAI_MAX_RETRIES       Client retries on transient errors (default 1)
+
+On shutdown, drain() turns new calls away and waits for the ones in flight.
+"""
+
+import asyncio
+import time
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+from settings import settings
+from token_usage import token_accounting
+from history import estimate_tokens
+from gateway import UpstreamGateway, ModelLane, CircuitBreaker, UpstreamUnavailable
+import metrics
+
+# Defaults per model: (max concurrency, requests per minute, tokens per minute)
+MODEL_LIMITS = {
+    "gpt-4o": (16, 500, 30000),
+    "gpt-4o-mini": (64, 500, 200000),
+}
+
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=settings.openai_max_connections,
+        max_keepalive_connections=settings.openai_max_keepalive,
+    ),
+    timeout=httpx.Timeout(settings.openai_timeout, connect=5.0),
+)
+
+openai_client = AsyncOpenAI(
+    api_key=settings.openai_api_key,
+    base_url=settings.openai_base_url,
+    http_client=http_client,
+    max_retries=settings.openai_max_retries,
+)
+
+
+def create_lane(model):
+    concurrency, rpm, tpm = MODEL_LIMITS.get(model, (64, 500, 200000))
+    return ModelLane(
+        model,
+        max_concurrency=int(settings.model_limit(model, "MAX_CONCURRENCY", concurrency)),
+        max_queue=settings.upstream_max_queue,
+        rpm=float(settings.model_limit(model, "RPM", rpm)),
+        tpm=float(settings.model_limit(model, "TPM", tpm)),
+        breaker=CircuitBreaker(settings.upstream_breaker_failures, settings.upstream_breaker_cooldown),
+    )
+
+
+# Requests beyond a model's limits wait here (or are turned away) instead of
+# opening more upstream connections
+gateway = UpstreamGateway(create_lane)
+
+
+def estimate_request_tokens(kwargs):
+    """Prompt plus the most the completion may use, for the TPM budget"""
+    prompt = sum(estimate_tokens(message["content"]) + 4 for message in kwargs.get("messages", ()))
+    return prompt + kwargs.get("max_tokens", 256)
+
+
+async def _release_after_stream(stream, lane, model):
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        lane.release()
+        metrics.upstream_in_flight.dec(model)
+
+
+async def create_completion(endpoint=None, timeout=settings.openai_timeout, queue_timeout=settings.upstream_queue_timeout,
+                            **kwargs):
+    """Run a chat completion on the shared client without blocking the event loop.
+
+    Raises UpstreamUnavailable when the model's lane has no permit within
+    queue_timeout. Streams keep their permit until they are consumed.
+    Token usage of non-streamed responses is recorded under endpoint;
+    streamed callers record the usage chunk themselves.
+    """
+    model = kwargs.get("model", "unknown")
+    lane = gateway.lane(model)
+    estimated = estimate_request_tokens(kwargs)
+    try:
+        if gateway.draining:
+            lane.reject("draining")
+        await lane.acquire(estimated, time.monotonic() + queue_timeout)
+    except UpstreamUnavailable as e:
+        metrics.upstream_rejected_total.inc(model, e.reason)
+        raise
+
+    streaming = bool(kwargs.get("stream"))
+    handed_off = False
+    metrics.upstream_in_flight.inc(model)
+    started = time.perf_counter()
+    try:
+        response = await openai_client.chat.completions.create(timeout=timeout, **kwargs)
+        lane.breaker.record_success()
+    except (openai.APITimeoutError, asyncio.TimeoutError):
+        metrics.upstream_errors_total.inc(model, "timeout")
+        lane.breaker.record_failure()
+        raise
+    except openai.RateLimitError:
+        metrics.upstream_errors_total.inc(model, "rate_limit")
+        lane.breaker.record_failure()
+        raise
+    except (openai.APIConnectionError, openai.InternalServerError):
+        metrics.upstream_errors_total.inc(model, "error")
+        lane.breaker.record_failure()
+        raise
+    except Exception:
+        # The upstream answered (e.g. 400); it is up, the request was bad
+        metrics.upstream_errors_total.inc(model, "error")
+        lane.breaker.record_success()
+        raise
+    except BaseException:
+        lane.breaker.cancel_probe()
+        raise
+    else:
+        if streaming:
+            handed_off = True
+            # For streams this is the time until the response starts
+            metrics.upstream_seconds.observe(time.perf_counter() - started, model, endpoint or "other")
+            return _release_after_stream(response, lane, model)
+    finally:
+        if not handed_off:
+            lane.release()
+            metrics.upstream_in_flight.dec(model)
+
+    metrics.upstream_seconds.observe(time.perf_counter() - started, model, endpoint or "other")
+    if response.usage is not None:
+        lane.tokens.adjust((response.usage.total_tokens or 0) - estimated)
+    if endpoint:
+        token_accounting.record(endpoint, response.usage)
+    return response
+
+
+async def close_client():
+    """Close the pooled HTTP connections (called on app shutdown)"""
+    await openai_client.close()
@@ -0,0 +1,208 @@
+"""
+Lyric index for the Lil IVR backend.
+
+LyricIndex is built once per content snapshot from the lyrics files and
+song_links.txt, or read back from the compiled corpus (corpus.py). All lines live in one string with an array of start
+offsets, and every song is a (first, end) range of line numbers, so the
+index costs one string plus a few bytes per line however many songs there
+are. Song aliases and display titles are derived from the filenames and
+links, so adding a track means adding its lyrics file and nothing else.
+Lyrics files can refine that with header comments:
+
+    # title: Vad Har Jag Gjort
+    # aliases: watcha, vad har jag gjort
+
+LyricSampler hands out random lines without repeats per session. A
+session's order is a keyed pseudo-random permutation of the line numbers,
+so its state is three integers instead of a list of lines already shown.
+"""
+
+import random
+import re
+from array import array
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# Single words shorter than this are too generic to name a song on their own
+MIN_WORD_ALIAS_CHARS = 5
+
+# "edamame-feat-foset" -> "edamame", "down-ft-lil-ivr" -> "down"
+FEATURE_SUFFIX = re.compile(r"[-_ ](?:ft|feat|featuring)(?:[-_ .].*)?$")
+
+HEADER_LINE = re.compile(r"^#\s*(title|aliases)\s*:\s*(.*)$", re.IGNORECASE)
+
+# Alias priorities: header aliases beat names and titles, which beat single words
+EXPLICIT, NAME, WORD = 0, 1, 2
+
+
+def parse_lyrics_header(text):
+    """title and aliases set in '# title:' / '# aliases:' comment lines"""
+    header = {"title": None, "aliases": []}
+    for line in text.split("\n"):
+        match = HEADER_LINE.match(line.strip())
+        if not match:
+            continue
+        key, value = match.group(1).lower(), match.group(2).strip()
+        if key == "title":
+            header["title"] = value or None
+        else:
+            header["aliases"].extend(alias.strip() for alias in value.split(",") if alias.strip())
+    return header
+
+
+def normalize_alias(text):
+    return " ".join(re.sub(r"[_\-]+", " ", text.lower()).split())
+
+
+def link_slug(url):
+    """Song part of a SoundCloud URL: https://soundcloud.com/artist/vad-har-jag-gjort?si=.. -> 'vad har jag gjort'"""
+    path = urlparse(url).path.rstrip("/")
+    slug = path.rsplit("/", 1)[-1] if path else ""
+    return normalize_alias(FEATURE_SUFFIX.sub("", slug))
+
+
+class Song:
+    __slots__ = ("name", "title", "first", "end", "link")
+
+    def __init__(self, name, title, first, end, link):
+        self.name = name
+        self.title = title
+        self.first = first
+        self.end = end
+        self.link = link
+
+
+class LyricIndex:
+    def __init__(self, songs, loose_lines=()):
+        """
+        songs:       (name, lines, header, link) per lyrics file; link may be None
+        loose_lines: lines that belong to no song (the built-in fallback)
+        """
+        parts = []
+        offsets = array("I")
+        position = 0
+
+        def add(line):
+            nonlocal position
+            offsets.append(position)
+            parts.append(line)
+            position += len(line) + 1
+
+        self.songs = {}
+        for name, lines, header, link in songs:
+            first = len(offsets)
+            for line in lines:
+                add(line)
+            title = header["title"] or name.replace("_", " ").title()
+            self.songs[name] = Song(name, title, first, len(offsets), link)
+        for line in loose_lines:
+            add(line)
+        offsets.append(position)  # sentinel: end of the last line + 1
+
+        self.text = "\n".join(parts)
+        self.offsets = offsets
+        self.aliases = self._build_aliases(songs)
+
+    @classmethod
+    def compiled(cls, text, offsets, songs, aliases):
+        """An index from parts built earlier (see corpus.py); nothing is derived again"""
+        index = cls.__new__(cls)
+        index.text = text
+        index.offsets = offsets
+        index.songs = songs
+        index.aliases = aliases
+        return index
+
+    def _build_aliases(self, songs):
+        best = {}  # alias -> (priority, song name, ambiguous)
+
+        def offer(alias, name, priority):
+            alias = normalize_alias(alias)
+            if not re.search(r"\w", alias):
+                return
+            current = best.get(alias)
+            if current is None or priority < current[0]:
+                best[alias] = (priority, name, False)
+            elif priority == current[0] and name != current[1] and priority != EXPLICIT:
+                best[alias] = (priority, current[1], True)
+
+        for name, _, header, link in songs:
+            for alias in header["aliases"]:
+                offer(alias, name, EXPLICIT)
+            offer(name, name, NAME)
+            offer(self.songs[name].title, name, NAME)
+            if link:
+                if link.get("name"):
+                    offer(link["name"], name, NAME)
+                offer(link_slug(link["url"]), name, NAME)
+            for word in normalize_alias(name).split():
+                if len(word) >= MIN_WORD_ALIAS_CHARS:
+                    offer(word, name, WORD)
+
+        # A word shared by two songs names neither of them
+        return {alias: name for alias, (_, name, ambiguous) in best.items() if not ambiguous}
+
+    @property
+    def line_count(self):
+        return len(self.offsets) - 1
+
+    def line(self, i):
+        return self.text[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def title(self, name):
+        song = self.songs.get(name)
+        return song.title if song else name.replace("_", " ").title()
+
+    def song_lines(self, name):
+        song = self.songs.get(name)
+        if song is None:
+            return []
+        return [self.line(i) for i in range(song.first, song.end)]
+
+    def sample_song(self, name, max_lines=3):
+        """1 to max_lines distinct random lines from one song, [] if it is unknown or empty"""
+        song = self.songs.get(name)
+        if song is None or song.end == song.first:
+            return []
+        lines = range(song.first, song.end)
+        count = random.randint(1, min(max_lines, len(lines)))
+        return [self.line(i) for i in random.sample(lines, count)]
+
+
+def _feistel(x, half_bits, key):
+    """Bijection on [0, 4**half_bits): a four-round Feistel network keyed by key"""
+    mask = (1 << half_bits) - 1
+    left, right = x >> half_bits, x & mask
+    for round_number in range(4):
+        left, right = right, left ^ (hash((key, round_number, right)) & mask)
+    return (left << half_bits) | right
+
+
+class LyricSampler:
+    def __init__(self, max_sessions=4096):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()  # session key -> (line count, key, position)
+
+    def sample(self, index, session_key=None):
+        """A random line; within one session no line repeats until all have been shown"""
+        n = index.line_count
+        if session_key is None or n <= 1:
+            return index.line(random.randrange(n))
+
+        state = self.sessions.get(session_key)
+        if state is None or state[0] != n or state[2] >= n:
+            # New session, changed catalogue, or every line shown: start a new order
+            state = (n, random.getrandbits(64), 0)
+        n, key, position = state
+
+        half_bits = max(1, ((n - 1).bit_length() + 1) // 2)
+        line = _feistel(position, half_bits, key)
+        # Cycle-walk values outside [0, n); the domain is under 4n so this is short
+        while line >= n:
+            line = _feistel(line, half_bits, key)
+
+        self.sessions[session_key] = (n, key, position + 1)
+        self.sessions.move_to_end(session_key)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+        return index.line(line)
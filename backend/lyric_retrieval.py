@@ -0,0 +1,121 @@
+"""
+Relevance-based lyric retrieval for /chat.
+
+Every lyric line is embedded once, when its content snapshot is built, as
+a TF-IDF vector over hashed features: whole words plus character
+trigrams, so Swedish inflections ("låt", "låten", "låtarna") still
+overlap. The vectors are L2-normalised and stored transposed
+(features x lines) in one float32 NumPy matrix.
+
+A query only has a few dozen non-zero features, so scoring gathers those
+rows of the matrix and takes one dot product with the query weights; the
+cost grows with the query, not with the number of features, and there is
+no Python loop over lines. The best few lines are then drawn with
+softmax weights, so the same message doesn't always get the same quote.
+"""
+
+import math
+import re
+import zlib
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Single letters ("o", "i", "å") say nothing about what a line is about
+MIN_WORD_CHARS = 2
+
+
+def features(text):
+    """Hashable features of text: words and character trigrams of each word"""
+    result = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if len(word) < MIN_WORD_CHARS:
+            continue
+        result.append("w:" + word)
+        padded = f" {word} "
+        result.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def feature_slot(feature, dims):
+    # crc32 rather than hash() so slots are stable across processes
+    return zlib.crc32(feature.encode("utf-8")) % dims
+
+
+class LyricRetriever:
+    def __init__(self, lines, dims=2048, top_k=5, min_score=0.15, temperature=0.05):
+        """
+        lines:       lyric lines, in LyricIndex order (row i is index.line(i))
+        dims:        hashed feature space size
+        top_k:       best-scoring lines the pick is drawn from
+        min_score:   cosine similarity a line needs to count as relevant
+        temperature: softmax temperature for the draw; lower is greedier
+        """
+        self.dims = dims
+        self.top_k = top_k
+        self.min_score = min_score
+        self.temperature = temperature
+
+        rows, cols = [], []
+        for row, line in enumerate(lines):
+            for feature in features(line):
+                rows.append(row)
+                cols.append(feature_slot(feature, dims))
+
+        count = len(lines)
+        tf = np.zeros((count, dims), dtype=np.float32)
+        np.add.at(tf, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0)
+        np.log1p(tf, out=tf)  # sublinear term frequency
+
+        df = np.count_nonzero(tf, axis=0)
+        self.idf = (np.log((1 + count) / (1 + df)) + 1).astype(np.float32)
+
+        tf *= self.idf
+        norms = np.linalg.norm(tf, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        tf /= norms
+        self.matrix_t = np.ascontiguousarray(tf.T)  # features x lines
+
+    @property
+    def line_count(self):
+        return self.matrix_t.shape[1]
+
+    def query_vector(self, texts):
+        """Sparse (slots, weights) for weighted texts [(text, weight), ...]"""
+        weights = {}
+        for text, text_weight in texts:
+            for feature in features(text):
+                slot = feature_slot(feature, self.dims)
+                weights[slot] = weights.get(slot, 0.0) + text_weight
+        if not weights:
+            return None, None
+        slots = np.fromiter(weights.keys(), dtype=np.intp, count=len(weights))
+        values = np.log1p(np.fromiter(weights.values(), dtype=np.float32, count=len(weights)))
+        values *= self.idf[slots]
+        norm = math.sqrt(float(values @ values))
+        if norm == 0:
+            return None, None
+        return slots, values / norm
+
+    def scores(self, texts):
+        """Cosine similarity of every line to the query"""
+        slots, values = self.query_vector(texts)
+        if slots is None:
+            return None
+        return values @ self.matrix_t[slots]
+
+    def pick(self, texts, rng=np.random):
+        """Row of a relevant line for the query, or None if nothing is relevant enough"""
+        scores = self.scores(texts)
+        if scores is None or self.line_count == 0:
+            return None
+        k = min(self.top_k, self.line_count)
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[scores[top] >= self.min_score]
+        if top.size == 0:
+            return None
+        logits = (scores[top] - scores[top].max()) / self.temperature
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum()
+        return int(top[rng.choice(top.size, p=probabilities)])
@@ -1,36 +1,151 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional
-from openai import OpenAI
+import asyncio
+import json
 import os
+import time
 import random
-import re
 import requests
-from dotenv import load_dotenv
-
-load_dotenv()
+from llm import create_completion, close_client, gateway
+from gateway import UpstreamUnavailable, Coalescer
+from request_trace import RequestTrace, MarkRequestReceived
+from bot_logging import configure_logging, shutdown_logging, get_logger, payload, set_level, current_level
+from search_cache import SearchCache, InProcessCache, FetchRefused
+from greetings import GreetingPool
+from token_usage import token_accounting
+from history import HistoryManager, conversation_key
+from sessions import InMemorySessionStore, KeyValueSessionStore, StoredMessage
+from content import ContentRegistry
+from popup_lines import PopupLinePool, PROMPT as POPUP_PROMPT
+from rate_limit import ClientLimits, RequestGuard, SlidingWindowLimiter, client_key_var
+from push_channel import PushHub, CLOSE_FULL
+from lyric_index import LyricSampler
+from sanitizer import Sanitizer
+from sites import SiteClassifier, DEFAULT_LABEL
+import metrics
+from settings import settings
+
+configure_logging()
+logger = get_logger("api")
 
 app = FastAPI(title="Lil IVR Bot API")
 
+# Answers to repeated factual questions are served from here instead of gpt-4o
+search_cache = SearchCache(InProcessCache(max_entries=settings.search_cache_size), ttl=settings.search_cache_ttl)
+
+# Prompt budget for conversation history: the newest messages go in
+# verbatim, older ones are folded into a rolling summary
+history_manager = HistoryManager(
+    max_tokens=settings.history_max_tokens,
+    keep_messages=settings.history_keep_messages,
+    summary_tokens=settings.history_summary_tokens,
+)
+
+# Per-client limits for the endpoints that call OpenAI. A client is an IP
+# plus the extension's X-Extension-Id; the per-IP limit is higher so users
+# behind one NAT don't starve each other.
+def create_limiter(limit):
+    return SlidingWindowLimiter(limit, settings.rate_limit_window, settings.rate_limit_max_clients)
+
+ip_limiter = create_limiter(settings.rate_limit_per_ip)
+client_limiter = create_limiter(settings.rate_limit_per_client)
+search_limiter = create_limiter(settings.rate_limit_searches)
+
+# Hard limits on what a client may send, checked before any model call
+client_limits = ClientLimits(
+    ip_limiter=ip_limiter,
+    client_limiter=client_limiter,
+    max_field_chars={
+        "message": settings.max_message_chars,
+        "webpage_context": settings.max_webpage_context_chars,
+        "html_content": settings.max_url_chars,
+    },
+    max_history_messages=settings.max_history_messages,
+    max_history_chars=settings.max_history_chars,
+    forwarded_hops=settings.forwarded_hops,
+)
+
+app.add_middleware(
+    RequestGuard,
+    limited_paths=("/chat", "/chat/stream", "/analyze-webpage"),
+    limits=client_limits,
+    max_body_bytes=settings.max_request_bytes,
+)
+
+# Added after RequestGuard so it wraps it and early 413/429 replies carry CORS headers
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
-# Initialize OpenAI client with web search capabilities
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-def search_web(query: str) -> str:
+# Outermost, and plain ASGI rather than @app.middleware("http"), which would
+# cost every request (including /random-message) an extra task and queue
+app.add_middleware(MarkRequestReceived)
+
+# Opt-in server-side sessions so the extension can send only the new message
+def create_session_store():
+    if settings.session_store == "redis":
+        # Optional dependency, only needed when sessions are shared between workers
+        import redis.asyncio as redis
+        client = redis.from_url(settings.redis_url)
+        return KeyValueSessionStore(client, idle_ttl=settings.session_idle_ttl,
+                                    max_messages=settings.max_history_messages)
+    return InMemorySessionStore(
+        idle_ttl=settings.session_idle_ttl,
+        max_sessions=settings.session_max_sessions,
+        max_bytes=settings.session_max_bytes,
+        max_messages=settings.max_history_messages,
+    )
+
+session_store = create_session_store()
+
+background_tasks = []
+
+@app.on_event("startup")
+async def start_event_loop_monitor():
+    # Seconds between event-loop lag probes for /metrics; 0 turns the probe off
+    if settings.event_loop_lag_interval > 0:
+        background_tasks.append(asyncio.create_task(metrics.monitor_event_loop_lag(settings.event_loop_lag_interval)))
+
+@app.on_event("shutdown")
+async def shutdown_openai_client():
+    for task in background_tasks:
+        task.cancel()
+    # uvicorn has let open requests finish by now, but detached work (pipelined
+    # searches, greeting refills) can still be waiting on OpenAI
+    if not await gateway.drain(settings.graceful_shutdown_timeout):
+        logger.warning("shutting down with upstream calls in flight", extra={"in_flight": gateway.busy()})
+    await close_client()
+    shutdown_logging()
+
+async def search_web(query: str, client: str = "-") -> str:
+    """Search the web, answering repeated questions from the search cache.
+
+    Only a search that goes upstream counts against the client's search
+    budget; FetchRefused when it is spent.
+    """
+    hits_before = search_cache.hits
+    answer = await search_cache.get_or_fetch(query, search_web_upstream, admit=lambda: not search_limiter.hit(client))
+    if search_cache.hits > hits_before:
+        logger.debug("web search cache hit", extra={"query": payload(query)})
+    return answer
+
+async def search_web_upstream(query: str) -> str:
     """Search the web using OpenAI's web search capability"""
     try:
-        print(f"🔍 [WEB SEARCH] Searching web for: {query}")
+        logger.debug("web search started", extra={"query": payload(query)})
 
         # Use ChatGPT with web search enabled (gpt-4o model supports web browsing)
-        response = openai_client.chat.completions.create(
+        response = await create_completion(
+            endpoint="search",
+            timeout=settings.openai_search_timeout,
             model="gpt-4o",
             messages=[
                 {
@@ -47,11 +162,11 @@ def search_web(query: str) -> str:
         )
 
         answer = response.choices[0].message.content.strip()
-        print(f"🔍 [WEB SEARCH] Found: {answer[:150]}...")
+        logger.debug("web search done", extra={"answer": payload(answer)})
         return answer
 
     except Exception as e:
-        print(f"🔍 [WEB SEARCH ERROR] {str(e)}")
+        logger.warning("web search failed", extra={"error": str(e)})
         return None
 
 
@@ -63,6 +178,8 @@ class ChatMessage(BaseModel):
     message: str
     webpage_context: Optional[str] = None
     conversation_history: Optional[List[ConversationMessage]] = None
+    session_id: Optional[str] = None  # continue a server-side session
+    use_session: bool = False  # start a server-side session with this message
 
 class WebpageAnalysis(BaseModel):
     html_content: str  # Actually contains URL now, not HTML content
@@ -71,21 +188,13 @@ class ChatResponse(BaseModel):
     response: str
     includes_lyric: bool = False
     lyric_line: Optional[str] = None
+    session_id: Optional[str] = None
 
-def filter_urls_from_text(text, allow_song_links=False):
-    """Remove URLs from text to prevent them from appearing in responses"""
-    if allow_song_links:
-        # Only remove non-SoundCloud URLs when song links are allowed
-        text = re.sub(r'chrome://[^\s]+', '', text)
-        # Don't remove SoundCloud links
-        return text.strip()
-    else:
-        # Remove all URLs (original behavior)
-        text = re.sub(r'https?://[^\s]+', '', text)
-        text = re.sub(r'chrome://[^\s]+', '', text)
-        text = re.sub(r'\w+://[^\s]+', '', text)
-        text = re.sub(r'\s+', ' ', text)
-        return text.strip()
+# Persona rules for everything the model says: no links except Lil IVR's
+# SoundCloud, no emojis, no dashes
+reply_sanitizer = Sanitizer(allowed_hosts=("soundcloud.com",))
+# User messages only lose links and extra whitespace before intent matching
+message_sanitizer = Sanitizer(emoji=False, dashes=False)
 
 SYSTEM_PROMPT = """Du är "Lil IVR" (också känd som Ivar Gavelin), en student som har karriär i soundcloud rap för plugget går så dåligt. Från Norrköping. Du var medlem i det legendariska studentföreningen "Föset".
 
@@ -200,610 +309,809 @@ CONVERSATIONAL PATTERNS:
 
 Din vibe: Den där snubben från college som alla kommer ihåg - lite bad boy, sjukt social, gjorde musik, kunde haffa vem som helst, spelade för mycket League, drack för mycket fulvin, men egentligen bara vill ha kul och hänga med folk. Både confident och insecure på samma gång."""
 
-def load_song_lyrics():
-    import os
-    import glob
-
-    lyrics_dir = 'lyrics'
-    all_lyrics = []
-    lyrics_by_song = {}  # Dictionary to map song names to their lyrics
-
-    try:
-        # Find all .txt files in lyrics directory
-        txt_files = glob.glob(os.path.join(lyrics_dir, '*.txt'))
-
-        for file_path in txt_files:
-            try:
-                # Extract song name from filename (remove .txt and path)
-                song_filename = os.path.basename(file_path).replace('.txt', '')
-
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                    # Split into lines and filter out empty lines, comments, and section headers
-                    lines = [line.strip() for line in content.split('\n')
-                            if line.strip() and not line.startswith('#') and not line.startswith('[')]
-
-                    # Store lyrics both in the global list and by song name
-                    all_lyrics.extend(lines)
-                    lyrics_by_song[song_filename] = lines
-                    print(f"🎤 [LYRICS] Loaded {len(lines)} lines from {song_filename}")
-            except Exception as e:
-                print(f"🎤 [ERROR] Could not read {file_path}: {e}")
-
-        if all_lyrics:
-            print(f"🎤 [LYRICS] Total loaded: {len(all_lyrics)} lyrics lines from {len(txt_files)} files")
-            return all_lyrics, lyrics_by_song
-        else:
-            print("🎤 [LYRICS] No lyrics found, using fallback")
-            fallback_lyrics = [
-                "Yo jag kör beats hela dagen, skibidi på repeat",
-                "Stockholm till Göteborg, min flow är så sweet",
-                "Autotune på max, jag är king av trap",
-                "IVR i studion, cooking up that sap"
-            ]
-            return fallback_lyrics, {}
+# Lyrics and links are loaded on first use and hot-reloaded when the files change
+content = ContentRegistry()
 
-    except Exception as e:
-        print(f"🎤 [ERROR] Error loading lyrics directory: {e}")
-        fallback_lyrics = [
-            "Yo jag kör beats hela dagen, skibidi på repeat",
-            "Stockholm till Göteborg, min flow är så sweet",
-            "Autotune på max, jag är king av trap",
-            "IVR i studion, cooking up that sap"
-        ]
-        return fallback_lyrics, {}
-
-# Load lyrics and create global variables
-song_lyrics, lyrics_by_song = load_song_lyrics()
-
-def load_song_links():
-    import os
-    import glob
-    import re
-
-    links_file = 'song_links.txt'
-    all_links = []
+@app.on_event("startup")
+async def preload_content():
+    # Off the event loop, so the server answers (and /ready says 503) while it loads
+    background_tasks.append(asyncio.create_task(asyncio.to_thread(content.snapshot)))
 
-    try:
-        if os.path.exists(links_file):
-            with open(links_file, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                # Process each line to extract URL and song name
-                lines = content.split('\n')
-                for line in lines:
-                    line = line.strip()
-                    if line and not line.startswith('#') and 'soundcloud.com' in line:
-                        # Check if line has format: URL "SONG_NAME" (song name in quotes)
-                        # Use regex to find quoted song name
-                        match = re.match(r'(https?://[^\s]+)\s+"([^"]+)"', line)
-                        if match:
-                            url = match.group(1)
-                            song_name = match.group(2)
-                            # Convert song name to filename format for lyrics matching
-                            # Replace spaces with underscores and make lowercase
-                            song_filename = song_name.lower().replace(' ', '_').replace('-', '_')
-                            all_links.append({
-                                'url': url.strip(),
-                                'name': song_name.strip(),
-                                'filename': song_filename
-                            })
-                        else:
-                            # Try format: URL SONG_NAME (without quotes)
-                            parts = line.split(' ', 1)  # Split into max 2 parts
-                            if len(parts) == 2:
-                                url, song_name = parts
-                                # Convert song name to filename format for lyrics matching
-                                song_filename = song_name.lower().replace(' ', '_').replace('-', '_')
-                                all_links.append({
-                                    'url': url.strip(),
-                                    'name': song_name.strip(),
-                                    'filename': song_filename
-                                })
-                            else:
-                                # Just URL without name
-                                all_links.append({
-                                    'url': line.strip(),
-                                    'name': None,
-                                    'filename': None
-                                })
-
-                print(f"🎤 [LINKS] Loaded {len(all_links)} song links from {links_file}")
-
-        if all_links:
-            print(f"🎤 [LINKS] Total loaded: {len(all_links)} song links")
-            return all_links
-        else:
-            print("🎤 [LINKS] No song links found, notifications will not include links")
-            return []
+@app.on_event("startup")
+async def start_content_watcher():
+    if settings.content_watch_interval > 0:
+        background_tasks.append(asyncio.create_task(content.watch(settings.content_watch_interval)))
 
-    except Exception as e:
-        print(f"🎤 [ERROR] Error loading song links: {e}")
-        return []
+# Remembers which lines each conversation has seen so lyrics don't repeat
+lyric_sampler = LyricSampler(max_sessions=settings.lyric_sampler_sessions)
 
-song_links = load_song_links()
+def get_random_lyric(session_key=None):
+    return lyric_sampler.sample(content.snapshot().index, session_key)
 
-def get_random_lyric():
-    return random.choice(song_lyrics)
+def find_relevant_lyric(message, history):
+    """A lyric line that fits the message and recent conversation, or None if nothing does"""
+    snapshot = content.snapshot()
+    texts = [(message, 1.0)]
+    # Earlier messages steer retrieval too, at a lower weight
+    if history and settings.lyric_context_messages > 0:
+        texts.extend((msg.content, 0.4) for msg in history[-settings.lyric_context_messages:])
+    row = snapshot.retriever.pick(texts)
+    return snapshot.index.line(row) if row is not None else None
 
 def get_lyrics_for_song(song_filename):
     """Get 1-3 random lyrics from a specific song"""
-    if song_filename in lyrics_by_song and lyrics_by_song[song_filename]:
-        song_lyrics_list = lyrics_by_song[song_filename]
-        # Get 1-3 random lyrics from this specific song
-        num_lyrics = random.randint(1, min(3, len(song_lyrics_list)))
-        return random.sample(song_lyrics_list, num_lyrics)
-    return []
-
-def find_requested_song(user_message):
-    """Find if user is asking for lyrics from a specific song"""
-    user_lower = user_message.lower()
-
-    # Create mapping from song names to filenames (matching the 7 songs)
-    song_name_mappings = {
-        # vickep_nanana
-        'vickep': 'vickep_nanana',
-        'vicke': 'vickep_nanana',
-        'nanana': 'vickep_nanana',
-        'vickep nanana': 'vickep_nanana',
-
-        # abbes_mom
-        'abbes mom': 'abbes_mom',
-        'abbe mom': 'abbes_mom',
-        'abbe': 'abbes_mom',
-        'abbes': 'abbes_mom',
-
-        # john_henriksson
-        'john henriksson': 'john_henriksson',
-        'john': 'john_henriksson',
-        'henriksson': 'john_henriksson',
-
-        # edamame
-        'edamame': 'edamame',
-
-        # down
-        'down': 'down',
-        'du o jag': 'down',
-
-        # hannes_rumpa
-        'hannes rumpa': 'hannes_rumpa',
-        'hannes': 'hannes_rumpa',
-        'rumpa': 'hannes_rumpa',
-
-        # watcha_say (mapped as "vad har jag gjort" in links)
-        'watcha say': 'watcha_say',
-        'vad har jag gjort': 'watcha_say',
-        'watcha': 'watcha_say',
-    }
-
-    # Check if any song name is mentioned
-    for song_name, filename in song_name_mappings.items():
-        if song_name in user_lower:
-            return filename
-
-    return None
+    return content.snapshot().index.sample_song(song_filename, max_lines=3)
 
 def get_clean_song_name(filename):
-    """Convert filename back to clean display name (for the 7 songs)"""
-    filename_to_name = {
-        'vickep_nanana': 'Vickep',
-        'abbes_mom': 'Abbes Mom',
-        'john_henriksson': 'John Henriksson',
-        'edamame': 'Edamame',
-        'down': 'Down',
-        'hannes_rumpa': 'Hannes Rumpa',
-        'watcha_say': 'Vad Har Jag Gjort',
-    }
-    return filename_to_name.get(filename, filename.replace('_', ' ').title())
+    """Display title of a song (from its lyrics file header, or its filename)"""
+    return content.snapshot().index.title(filename)
 
 def find_song_in_conversation_history(conversation_history):
     """Search conversation history for recently mentioned songs"""
     if not conversation_history:
         return None
 
-    # Same song mappings as find_requested_song (matching the 7 songs)
-    song_name_mappings = {
-        # vickep_nanana
-        'vickep': 'vickep_nanana',
-        'vicke': 'vickep_nanana',
-        'nanana': 'vickep_nanana',
-        'vickep nanana': 'vickep_nanana',
-
-        # abbes_mom
-        'abbes mom': 'abbes_mom',
-        'abbe mom': 'abbes_mom',
-        'abbe': 'abbes_mom',
-        'abbes': 'abbes_mom',
-
-        # john_henriksson
-        'john henriksson': 'john_henriksson',
-        'john': 'john_henriksson',
-        'henriksson': 'john_henriksson',
-
-        # edamame
-        'edamame': 'edamame',
-
-        # down
-        'down': 'down',
-        'du o jag': 'down',
-
-        # hannes_rumpa
-        'hannes rumpa': 'hannes_rumpa',
-        'hannes': 'hannes_rumpa',
-        'rumpa': 'hannes_rumpa',
-
-        # watcha_say (mapped as "vad har jag gjort" in links)
-        'watcha say': 'watcha_say',
-        'vad har jag gjort': 'watcha_say',
-        'watcha': 'watcha_say',
-    }
-
     # Search last 3 messages for song mentions (prioritize recent mentions)
-    recent_messages = conversation_history[-3:] if len(conversation_history) > 3 else conversation_history
+    recent_messages = conversation_history[-3:]
 
     for msg in reversed(recent_messages):  # Check most recent first
-        content_lower = msg.content.lower()
-        for song_name, filename in song_name_mappings.items():
-            if song_name in content_lower:
-                print(f"🎤 [HISTORY-SONG] Found '{song_name}' in conversation history -> {filename}")
-                return filename
-
-    return None
+        filename = content.snapshot().intents.find_song(msg.content)
+        if filename:
+            logger.debug("song found in conversation history", extra={"song": filename})
+            return filename
 
-def get_random_song_link():
-    if song_links:
-        return random.choice(song_links)
     return None
 
 def should_include_lyric():
     return random.randint(1, 6) == 1
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(chat_message: ChatMessage):
+def degraded_reply():
+    """In-character reply from the persona model for when the upstream gateway can't take the request"""
+    return ChatResponse(
+        response=content.snapshot().persona.generate("degraded"),
+        includes_lyric=False
+    )
+
+class PreparedChat:
+    """Everything the /chat endpoints need to call the model for one message"""
+
+    def __init__(self, messages_for_api, include_lyric, lyric_line):
+        self.messages_for_api = messages_for_api
+        self.include_lyric = include_lyric
+        self.lyric_line = lyric_line
+
+def web_search_context_for(search_result):
+    """Prompt material for a factual question, with or without search results"""
+    if search_result:
+        return f"\n\nWebbsökning resultat: {search_result}\n\nVIKTIGT: Använd denna aktuella information från webben för att ge ett smart, faktabaserat svar. Om du inte vet något specifikt i din kunskap, använd ALLTID denna webbsökning för att ge korrekt info. Svara i din Lil IVR-stil men var faktabaserad och informativ."
+    return "\n\nOBS: Användaren ställer en faktafråga. Ge ett smart, faktabaserat svar baserat på din kunskap. Svara i din Lil IVR-stil men var informativ."
+
+async def await_web_search(search_task, search_started, trace):
+    """Wait for a pipelined web search until its latency budget runs out"""
+    remaining = settings.search_latency_budget - (time.perf_counter() - search_started)
     try:
-        print(f"🎤 [CHAT] Received message: {chat_message.message}")
-
-        # Sometimes just respond with a random insult (1 in 3-8 chance)
-        if random.randint(1, 8) <= 2:  # ~25% chance (2 out of 8)
-            insult_responses = [
-                "är du dum",
-                "är du dum eller",
-                "wtf",
-                "bruh",
-                "fan vad cringe",
-                "cope",
-                "är du seriöst?",
-                "okay boomer",
-                "sure buddy",
-                "whatever bro",
-                "k",
-                "lol",
-                "hahahaha nej",
-                "nää",
-                "absolut inte",
-                "fan vad sus",
-                "cringe as fuck",
-                "touch grass",
-                "get real",
-                "oof",
-                "yikes",
-                "baserat",
-                "töntig fråga",
-                "fråga nån annan",
-                "orka",
-                "meh",
-                "snälla sluta",
-                "jag orkar inte med dig",
-                "jag bryr mig inte",
-                "jag skiter i dig",
-                "haha bruh, du suger",
-                "okej loser",
-            ]
-            insult = random.choice(insult_responses)
-            print(f"🎤 [INSULT] Responding with random insult: {insult}")
-            return ChatResponse(
-                response=insult,
-                includes_lyric=False
-            )
-
-        context_prompt = ""
-        if chat_message.webpage_context:
-            context_prompt = f"\n\nWebbsidekontext: {chat_message.webpage_context[:500]}"
-            print(f"🎤 [CHAT] Webpage context added: {chat_message.webpage_context[:100]}...")
-
-        # Filter URLs from the message before processing
-        filtered_message = filter_urls_from_text(chat_message.message)
-
-        # Check if user is asking a factual question that needs web search (Swedish focused)
-        search_indicators = [
-            'vad är', 'vad e', 'vad betyder', 'vadå', 'va är',
-            'vem är', 'vem e', 'vilka är', 'vilka e',
-            'var är', 'var e', 'var ligger', 'var finns',
-            'när är', 'när e', 'när var', 'när hände',
-            'hur är', 'hur e', 'hur fungerar', 'hur gör', 'hur många',
-            'varför är', 'varför e', 'varför kan', 'varför ska',
-            'vilken är', 'vilken e', 'vilket är', 'vilket e',
-            'berätta om', 'förklara', 'kan du förklara',
-            'vet du', 'känner du till', 'har du hört',
-            'what is', 'who is', 'where is', 'when', 'how', 'why'
-        ]
-        needs_web_search = any(indicator in filtered_message.lower() for indicator in search_indicators)
-
-        web_search_context = ""
-        if needs_web_search:
-            print(f"🔍 [TRIGGER] Detected question, performing web search...")
-            search_result = search_web(filtered_message)
-            if search_result:
-                web_search_context = f"\n\nWebbsökning resultat: {search_result}\n\nVIKTIGT: Använd denna aktuella information från webben för att ge ett smart, faktabaserat svar. Om du inte vet något specifikt i din kunskap, använd ALLTID denna webbsökning för att ge korrekt info. Svara i din Lil IVR-stil men var faktabaserad och informativ."
-                print(f"🔍 [SUCCESS] Web search completed")
-            else:
-                web_search_context = "\n\nOBS: Användaren ställer en faktafråga. Ge ett smart, faktabaserat svar baserat på din kunskap. Svara i din Lil IVR-stil men var informativ."
+        search_result = await asyncio.wait_for(search_task, timeout=max(remaining, 0))
+    except asyncio.TimeoutError:
+        # The shared search keeps running and still fills the cache for the next asker
+        logger.info("web search missed latency budget", extra={"budget_s": settings.search_latency_budget})
+        trace.tag("search", "timeout")
+        return None
+    except FetchRefused:
+        # Out of gpt-4o searches for now; answer from the model's own knowledge
+        logger.debug("web search rate limited", extra={"client": client_key_var.get()})
+        trace.tag("search", "rate-limited")
+        return None
+    trace.tag("search", "hit" if search_result else "failed")
+    return search_result
+
+async def resolve_session(chat_message: ChatMessage):
+    """Return (history, session_id) for a chat message.
+
+    Without session mode the client's conversation_history is used as-is.
+    With a session_id, conversation_history only carries messages the
+    server hasn't seen (e.g. greetings shown by the extension) and is added
+    to the session. An unknown or expired session_id gets 409 so the client
+    can resend its full history and start a new session.
+    """
+    if chat_message.session_id:
+        history = await session_store.load(chat_message.session_id)
+        if history is None:
+            raise HTTPException(status_code=409, detail="Session expired")
+        if chat_message.conversation_history:
+            await session_store.append(chat_message.session_id, chat_message.conversation_history)
+            history.extend(chat_message.conversation_history)
+        return history, chat_message.session_id
+
+    history = chat_message.conversation_history or []
+    if chat_message.use_session:
+        session_id = await session_store.create(history)
+        logger.info("session started", extra={"history_messages": len(history)})
+        return history, session_id
+    return history, None
+
+async def remember_turn(session_id, user_message, reply: ChatResponse):
+    """Store a finished turn in the session and tell the client its session id"""
+    if session_id:
+        await session_store.append(session_id, [
+            StoredMessage("user", user_message),
+            StoredMessage("assistant", reply.response),
+        ])
+        reply.session_id = session_id
+    return reply
+
+async def prepare_chat(chat_message: ChatMessage, history, session_id, trace: RequestTrace):
+    """Run intent handling for a chat message.
+
+    Returns a ChatResponse when the message is answered without the model
+    (insults, popup disabling), otherwise a PreparedChat for the completion.
+    """
+    logger.debug("chat message received", extra={"text": payload(chat_message.message)})
+
+    # Sometimes just respond with a random insult (1 in 3-8 chance)
+    if random.randint(1, 8) <= 2:  # ~25% chance (2 out of 8)
+        insult = content.snapshot().persona.generate("insult")
+        logger.debug("insult reply", extra={"reply": insult})
+        trace.tag("path", "insult")
+        return ChatResponse(
+            response=insult,
+            includes_lyric=False
+        )
 
-        user_message = filtered_message + context_prompt + web_search_context
+    trace.tag("path", "chat")
+    context_prompt = ""
+    if chat_message.webpage_context:
+        context_prompt = f"\n\nWebbsidekontext: {chat_message.webpage_context[:500]}"
+        logger.debug("webpage context added", extra={"context": payload(chat_message.webpage_context)})
 
-        # Check if user is specifically asking for lyrics/quotes
-        asking_for_lyrics = any(word in filtered_message.lower() for word in
-                              ['quote', 'quotes', 'låt', 'låtar', 'text', 'rad', 'rader', 'lyric', 'lyrics'])
+    # Filter URLs from the message before processing
+    filtered_message = message_sanitizer.clean(chat_message.message)
 
-        # Check if user is asking for a specific song
-        requested_song = find_requested_song(filtered_message) if asking_for_lyrics else None
+    # Match search, lyric, popup and song intents in one pass over the message
+    intents_started = time.perf_counter()
+    intents = content.snapshot().intents.match(filtered_message)
+    needs_web_search = intents.needs_web_search
+    asking_for_lyrics = intents.asking_for_lyrics
+    trace.mark("intents", intents_started)
 
-        # If no specific song requested, check conversation history for mentioned songs
-        if not requested_song and asking_for_lyrics:
-            requested_song = find_song_in_conversation_history(chat_message.conversation_history)
-            if requested_song:
-                print(f"🎤 [HISTORY] Using song from history: {requested_song}")
+    # Check if user is asking for a specific song
+    requested_song = intents.song if asking_for_lyrics else None
 
-        # Check if user wants to disable popups
-        disable_popup_requests = any(phrase in filtered_message.lower() for phrase in [
-            "stäng av popup", "stoppa popup", "sluta popup", "stäng popup",
-            "disable popup", "turn off popup", "stop popup", "no popup"
-        ])
+    # If no specific song requested, check conversation history for mentioned songs
+    if not requested_song and asking_for_lyrics:
+        requested_song = find_song_in_conversation_history(history)
+        if requested_song:
+            logger.debug("using song from history", extra={"song": requested_song})
 
-        # Check if this is a popup message generation request
-        is_popup_request = "töntigt" in filtered_message.lower() or "popup" in filtered_message.lower()
-
-        # Handle popup disable requests
-        if disable_popup_requests:
-            return ChatResponse(
-                response="Okej, jag stänger av popupsen för den här sessionen. Du kan fortfarande chatta med mig här!",
-                includes_lyric=False
-            )
-
-        # Handle popup requests differently
-        if is_popup_request:
-            # For popup messages, don't include lyrics and use special prompt
-            include_lyric = False
-            lyric_context = "\n\nDetta är för en popup-notifikation. Svara ENDAST med ett kort meddelande (max 6 ord). Du ska antingen: 1) Låta miserabel, ensam och desperat ('jag är så ensam', 'snälla kom o chatta', 'gråter till mamma snart', 'mår så dåligt') ELLER 2) Bli arg för att användaren ignorerar dig ('du suger för fan', 'kom hit då losern', 'varför svarar du inte', 'jag blir arg nu'). Välj random. Inga frågetecken eller utropstecken."
-            lyric_line = None
-            print(f"🎤 [POPUP] Generating popup message")
+    # Check if user wants to disable popups
+    disable_popup_requests = intents.disable_popups
+
+    # Check if this is a popup message generation request
+    is_popup_request = intents.popup_request
+
+    # Handle popup disable requests
+    if disable_popup_requests:
+        trace.tag("path", "popup-disable")
+        return ChatResponse(
+            response="Okej, jag stänger av popupsen för den här sessionen. Du kan fortfarande chatta med mig här!",
+            includes_lyric=False
+        )
+
+    search_task = None
+    search_result = None
+    if needs_web_search:
+        logger.debug("web search triggered", extra={"mode": settings.search_mode})
+        search_started = time.perf_counter()
+        client = client_key_var.get() or "-"
+        if settings.search_mode == "pipelined":
+            # Let the search run while lyrics and the prompt are put together
+            search_task = asyncio.create_task(search_web(filtered_message, client))
         else:
-            # Add lyric context to system prompt sometimes, or always if asking for lyrics
-            include_lyric = asking_for_lyrics or should_include_lyric()
-            lyric_context = ""
-            lyric_line = None
-
-            if include_lyric:
-                if requested_song:
-                    # User asked for specific song lyrics
-                    specific_lyrics = get_lyrics_for_song(requested_song)
-                    if specific_lyrics:
-                        lyric_line = ' • '.join(specific_lyrics)
-                        clean_song_name = get_clean_song_name(requested_song)
-                        lyric_context = f"\n\nAnvändaren frågar specifikt om låten '{clean_song_name}'. Du MÅSTE inkludera dessa rader från just den låten: '{lyric_line}' - presentera dem som quotes från dig och berätta lite om låten."
-                        print(f"🎤 [SPECIFIC] Adding specific lyrics from {requested_song}: {lyric_line}")
-                    else:
-                        # Fallback if specific song not found
-                        lyric_line = get_random_lyric()
-                        lyric_context = f"\n\nAnvändaren frågar om dina låtar men jag kunde inte hitta den specifika låten. Använd denna rad: '{lyric_line}' och förklara vilka låtar du har."
-                        print(f"🎤 [FALLBACK] Song '{requested_song}' not found, using random lyric: {lyric_line}")
+            try:
+                search_result = await search_web(filtered_message, client)
+                trace.tag("search", "serial-hit" if search_result else "serial-failed")
+            except FetchRefused:
+                # Out of gpt-4o searches for now; answer from the model's own knowledge
+                logger.debug("web search rate limited", extra={"client": client})
+                trace.tag("search", "rate-limited")
+            trace.mark("search", search_started)
+
+    # Handle popup requests differently
+    lyrics_started = time.perf_counter()
+    lyric_session = session_id or (conversation_key(history) if history else None)
+    if is_popup_request:
+        # For popup messages, don't include lyrics and use special prompt
+        include_lyric = False
+        lyric_context = "\n\nDetta är för en popup-notifikation. Svara ENDAST med ett kort meddelande (max 6 ord). Du ska antingen: 1) Låta miserabel, ensam och desperat ('jag är så ensam', 'snälla kom o chatta', 'gråter till mamma snart', 'mår så dåligt') ELLER 2) Bli arg för att användaren ignorerar dig ('du suger för fan', 'kom hit då losern', 'varför svarar du inte', 'jag blir arg nu'). Välj random. Inga frågetecken eller utropstecken."
+        lyric_line = None
+        logger.debug("popup message requested")
+        trace.tag("path", "popup")
+    else:
+        # Add lyric context to system prompt sometimes, or always if asking for lyrics
+        include_lyric = asking_for_lyrics or should_include_lyric()
+        lyric_context = ""
+        lyric_line = None
+
+        if include_lyric:
+            if requested_song:
+                # User asked for specific song lyrics
+                specific_lyrics = get_lyrics_for_song(requested_song)
+                if specific_lyrics:
+                    lyric_line = ' • '.join(specific_lyrics)
+                    clean_song_name = get_clean_song_name(requested_song)
+                    lyric_context = f"\n\nAnvändaren frågar specifikt om låten '{clean_song_name}'. Du MÅSTE inkludera dessa rader från just den låten: '{lyric_line}' - presentera dem som quotes från dig och berätta lite om låten."
+                    logger.debug("specific song lyrics added", extra={"song": requested_song, "lyric": lyric_line})
+                    trace.tag("path", "specific-song")
+                else:
+                    # Fallback if specific song not found
+                    lyric_line = get_random_lyric(lyric_session)
+                    lyric_context = f"\n\nAnvändaren frågar om dina låtar men jag kunde inte hitta den specifika låten. Använd denna rad: '{lyric_line}' och förklara vilka låtar du har."
+                    logger.debug("requested song not found, using random lyric", extra={"song": requested_song, "lyric": lyric_line})
+            else:
+                # General lyrics request or random inclusion: prefer a line that fits the conversation
+                lyric_line = find_relevant_lyric(filtered_message, history)
+                trace.tag("lyric_match", "relevant" if lyric_line else "random")
+                if not lyric_line:
+                    lyric_line = get_random_lyric(lyric_session)
+                if asking_for_lyrics:
+                    lyric_context = f"\n\nAnvändaren frågar om dina låtar. Du MÅSTE inkludera denna rad från en av dina låtar: '{lyric_line}' - presentera den som en riktig quote från dig och kombinera med ditt svar."
                 else:
-                    # General lyrics request or random inclusion
-                    lyric_line = get_random_lyric()
-                    if asking_for_lyrics:
-                        lyric_context = f"\n\nAnvändaren frågar om dina låtar. Du MÅSTE inkludera denna rad från en av dina låtar: '{lyric_line}' - presentera den som en riktig quote från dig och kombinera med ditt svar."
-                    else:
-                        lyric_context = f"\n\nDu kan naturligt integrera denna rad från en av dina låtar i svaret om det passar: '{lyric_line}'"
-                    print(f"🎤 [LYRIC] Adding lyric context: {lyric_line}")
+                    lyric_context = f"\n\nDu kan naturligt integrera denna rad från en av dina låtar i svaret om det passar: '{lyric_line}'"
+                logger.debug("lyric added", extra={"lyric": lyric_line})
+                trace.tag("path", "lyric")
+    trace.mark("lyrics", lyrics_started)
 
-        full_system_prompt = SYSTEM_PROMPT + lyric_context
-        print(f"🎤 [CHAT] Full user message: {user_message}")
+    if search_task:
+        search_result = await await_web_search(search_task, search_started, trace)
+        trace.mark("search", search_started)
 
-        # Build message history for OpenAI
-        messages_for_api = [{"role": "system", "content": full_system_prompt}]
+    web_search_context = web_search_context_for(search_result) if needs_web_search else ""
 
-        # Add conversation history if provided
-        if chat_message.conversation_history:
-            for hist_msg in chat_message.conversation_history:
-                messages_for_api.append({
-                    "role": hist_msg.role,
-                    "content": hist_msg.content
-                })
-            print(f"🎤 [HISTORY] Including {len(chat_message.conversation_history)} previous messages")
-
-        # Add current user message
-        messages_for_api.append({"role": "user", "content": user_message})
-
-        print(f"🎤 [GPT] Sending request to OpenAI with {len(messages_for_api)} messages...")
-        response = openai_client.chat.completions.create(
+    user_message = filtered_message + context_prompt + web_search_context
+
+    logger.debug("user message assembled", extra={"user_message": payload(user_message)})
+
+    # The static persona is always the byte-identical first message so the
+    # provider can reuse its cached prefix; everything that varies per
+    # request goes after the conversation history.
+    messages_for_api = [{"role": "system", "content": SYSTEM_PROMPT}]
+
+    # Add conversation history if provided, compacted to the history budget
+    if history:
+        history_messages = history_manager.compact(history, session_key=session_id)
+        messages_for_api.extend(history_messages)
+        logger.debug("history compacted", extra={"history_messages": len(history), "prompt_messages": len(history_messages)})
+
+    # Per-request instructions (lyric hints, popup rules)
+    if lyric_context:
+        messages_for_api.append({"role": "system", "content": lyric_context.strip()})
+
+    # Add current user message with page context and web search results
+    messages_for_api.append({"role": "user", "content": user_message})
+
+    return PreparedChat(messages_for_api, include_lyric, lyric_line)
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(chat_message: ChatMessage):
+    history, session_id = await resolve_session(chat_message)
+    trace = RequestTrace("/chat")
+    try:
+        prepared = await prepare_chat(chat_message, history, session_id, trace)
+        if isinstance(prepared, ChatResponse):
+            return await remember_turn(session_id, chat_message.message, prepared)
+
+        logger.debug("completion request", extra={"prompt_messages": len(prepared.messages_for_api)})
+        llm_started = time.perf_counter()
+        response = await create_completion(
+            endpoint="chat",
             model="gpt-4o-mini",
-            messages=messages_for_api,
+            messages=prepared.messages_for_api,
             max_tokens=150,
             temperature=0.9
         )
 
+        trace.mark("llm", llm_started)
+
         bot_response = response.choices[0].message.content
-        # Filter URLs from bot response as additional safety measure
-        filtered_response = filter_urls_from_text(bot_response)
-        print(f"🎤 [GPT] Received response: {bot_response}")
-        print(f"🎤 [CHAT] Final response: {filtered_response}")
+        # Enforce the persona's output rules on the reply
+        filter_started = time.perf_counter()
+        filtered_response = reply_sanitizer.clean(bot_response)
+        trace.mark("filter", filter_started)
+        logger.debug("completion received", extra={"raw": payload(bot_response), "filtered": payload(filtered_response)})
 
-        return ChatResponse(
+        return await remember_turn(session_id, chat_message.message, ChatResponse(
             response=filtered_response,
-            includes_lyric=include_lyric,
-            lyric_line=lyric_line
+            includes_lyric=prepared.include_lyric,
+            lyric_line=prepared.lyric_line
+        ))
+
+    except UpstreamUnavailable as e:
+        logger.warning("upstream unavailable, sending canned reply", extra={"model": e.model, "reason": e.reason})
+        trace.tag("path", "degraded")
+        trace.tag("degraded", e.reason)
+        return await remember_turn(session_id, chat_message.message, degraded_reply())
+    except Exception as e:
+        logger.error("chat error", extra={"error": str(e)})
+        trace.tag("error", type(e).__name__)
+        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+    finally:
+        trace.log()
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_chat_events(prepared, user_message, session_id, trace):
+    """Yield (event, data) for a prepared chat: text deltas, then a final metadata event"""
+    if isinstance(prepared, ChatResponse):
+        await remember_turn(session_id, user_message, prepared)
+        yield "delta", {"text": prepared.response}
+        yield "done", prepared.dict()
+        trace.log()
+        return
+
+    reply_filter = reply_sanitizer.stream()
+    parts = []
+    try:
+        logger.debug("streaming completion request", extra={"prompt_messages": len(prepared.messages_for_api)})
+        llm_started = time.perf_counter()
+        stream = await create_completion(
+            endpoint="chat-stream",
+            model="gpt-4o-mini",
+            messages=prepared.messages_for_api,
+            max_tokens=150,
+            temperature=0.9,
+            stream=True,
+            stream_options={"include_usage": True}
         )
-
+        async for chunk in stream:
+            if chunk.usage:
+                token_accounting.record("chat-stream", chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if "first_token" not in trace.stages:
+                trace.mark("first_token", llm_started)
+            text = reply_filter.feed(delta)
+            if text:
+                parts.append(text)
+                yield "delta", {"text": text}
+
+        text = reply_filter.flush()
+        if text:
+            parts.append(text)
+            yield "delta", {"text": text}
+
+        trace.mark("llm", llm_started)
+        final_response = "".join(parts)
+        logger.debug("streamed completion done", extra={"filtered": payload(final_response)})
+        reply = await remember_turn(session_id, user_message, ChatResponse(
+            response=final_response,
+            includes_lyric=prepared.include_lyric,
+            lyric_line=prepared.lyric_line
+        ))
+        yield "done", reply.dict()
+
+    except UpstreamUnavailable as e:
+        logger.warning("upstream unavailable, sending canned reply", extra={"model": e.model, "reason": e.reason})
+        trace.tag("path", "degraded")
+        trace.tag("degraded", e.reason)
+        reply = await remember_turn(session_id, user_message, degraded_reply())
+        yield "delta", {"text": reply.response}
+        yield "done", reply.dict()
+    except Exception as e:
+        logger.error("chat stream error", extra={"error": str(e)})
+        trace.tag("error", type(e).__name__)
+        yield "error", {"detail": f"Chat error: {str(e)}"}
+    finally:
+        trace.log()
+
+class TracedStreamingResponse(StreamingResponse):
+    """StreamingResponse that finishes its RequestTrace however the response ends.
+
+    The event generator logs the trace in its finally, but a generator that
+    is never iterated (the client left before the first chunk) never runs it,
+    and the in-flight gauge would stay up.
+    """
+
+    def __init__(self, content, trace, **kwargs):
+        super().__init__(content, **kwargs)
+        self.trace = trace
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if not self.trace.finished:
+                self.trace.tag("disconnected", True)
+                self.trace.log()
+
+@app.post("/chat/stream")
+async def chat_stream(chat_message: ChatMessage):
+    """Streaming variant of /chat that sends completion deltas as server-sent events"""
+    history, session_id = await resolve_session(chat_message)
+    trace = RequestTrace("/chat/stream")
+    try:
+        prepared = await prepare_chat(chat_message, history, session_id, trace)
     except Exception as e:
-        print(f"🎤 [ERROR] Chat error: {str(e)}")
+        logger.error("chat error", extra={"error": str(e)})
+        trace.tag("error", type(e).__name__)
+        trace.log()
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
 
-@app.post("/analyze-webpage")
-async def analyze_webpage(webpage: WebpageAnalysis):
-    try:
-        webpage_url = webpage.html_content  # URL passed in html_content field
-        print(f"🎤 [WEBPAGE] Analyzing webpage URL: {webpage_url}")
+    events = stream_chat_events(prepared, chat_message.message, session_id, trace)
+    return TracedStreamingResponse(
+        (sse_event(event, data) async for event, data in events),
+        trace,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        # Get a random lyric to start with
-        random_lyric = get_random_lyric()
-        print(f"🎤 [LYRIC] Starting with lyric: {random_lyric}")
-
-        # Extract domain and path for analysis
-        domain_analysis = "en webbsida"
-        if webpage_url:
-            if "youtube" in webpage_url.lower():
-                domain_analysis = "YouTube"
-            elif "spotify" in webpage_url.lower():
-                domain_analysis = "Spotify"
-            elif "soundcloud" in webpage_url.lower():
-                domain_analysis = "SoundCloud"
-            elif "github" in webpage_url.lower():
-                domain_analysis = "GitHub"
-            elif "google" in webpage_url.lower():
-                domain_analysis = "Google"
-            elif "facebook" in webpage_url.lower():
-                domain_analysis = "Facebook"
-            elif "instagram" in webpage_url.lower():
-                domain_analysis = "Instagram"
-            elif "twitter" in webpage_url.lower() or "x.com" in webpage_url.lower():
-                domain_analysis = "Twitter/X"
-            elif "reddit" in webpage_url.lower():
-                domain_analysis = "Reddit"
-            elif "chrome://" in webpage_url.lower():
-                if "extensions" in webpage_url.lower():
-                    domain_analysis = "Chrome Extensions-sidan"
-                elif "settings" in webpage_url.lower():
-                    domain_analysis = "Chrome Settings"
-                elif "newtab" in webpage_url.lower():
-                    domain_analysis = "en ny flik"
-                else:
-                    domain_analysis = "Chrome-sidan"
-            elif "tiktok" in webpage_url.lower():
-                domain_analysis = "TikTok"
-            else:
-                # Extract domain name
-                try:
-                    from urllib.parse import urlparse
-                    domain = urlparse(webpage_url).netloc
-                    domain_analysis = domain
-                except:
-                    domain_analysis = "den här webbsidan"
+# Labels for the page the popup opened on, from sites.txt
+site_classifier = SiteClassifier.load()
 
-        print(f"🎤 [ANALYSIS] Domain analysis: {domain_analysis}")
+# Sites with a fixed label get pre-generated greetings; anything else is
+# labelled by its hostname and generated live
+GREETING_POOL_DOMAINS = [*site_classifier.labels, DEFAULT_LABEL]
 
-        # Create AI prompt for analysis
-        ai_prompt = f"""Du ska skapa en initial hälsning som innehåller:
+async def generate_greeting(random_lyric, where):
+    """Generate a lyric-based greeting commenting on what the user is doing"""
+    # Create AI prompt for analysis
+    ai_prompt = f"""Du ska skapa en initial hälsning som innehåller:
 
 1. Först citera denna låtrad: "{random_lyric}"
-2. Sedan kommentera vad användaren gör på {domain_analysis} ({webpage_url}) med lite attitude
+2. Sedan kommentera vad användaren gör på {where} med lite attitude
 3. Ställ en rakt på sak-fråga om vad de håller på med
 
 Håll det kort, lite drygt och självsäkert. Max 2-3 meningar totalt. Ingen "skibidi" eller överdrivet goofy stuff."""
 
-        print(f"🎤 [GPT] Generating lyric-based greeting...")
-        greeting_response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": ai_prompt}
-            ],
-            max_tokens=150,
-            temperature=0.9
-        )
+    greeting_response = await create_completion(
+        endpoint="analyze-webpage",
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": ai_prompt}
+        ],
+        max_tokens=150,
+        temperature=0.9
+    )
+    return reply_sanitizer.clean(greeting_response.choices[0].message.content)
+
+async def generate_pooled_greeting(domain_analysis):
+    return await generate_greeting(get_random_lyric(), domain_analysis)
+
+greeting_pool = GreetingPool(
+    generate_pooled_greeting,
+    GREETING_POOL_DOMAINS,
+    size=settings.greeting_pool_size,
+    low_water=settings.greeting_pool_low_water,
+    max_uses=settings.greeting_max_uses,
+)
+
+greeting_coalescer = Coalescer()
+
+@app.on_event("startup")
+async def warm_greeting_pool():
+    if settings.greeting_pool_warm:
+        greeting_pool.warm()
+
+@app.post("/analyze-webpage")
+async def analyze_webpage(webpage: WebpageAnalysis):
+    trace = RequestTrace("/analyze-webpage")
+    try:
+        webpage_url = webpage.html_content  # URL passed in html_content field
+        logger.debug("analyzing webpage", extra={"url": payload(webpage_url)})
+
+        domain_analysis = site_classifier.classify(webpage_url)
+        logger.debug("domain analysis", extra={"domain": domain_analysis})
+
+        # Well-known sites are answered from the pre-generated pool
+        pooled_greeting = greeting_pool.take(domain_analysis)
+        if pooled_greeting:
+            logger.debug("pooled greeting served", extra={"domain": domain_analysis, "greeting": payload(pooled_greeting)})
+            trace.tag("path", "pooled")
+            return {"greeting": pooled_greeting}
+
+        # Get a random lyric to start with
+        random_lyric = get_random_lyric()
+        logger.debug("greeting lyric", extra={"lyric": random_lyric})
 
-        greeting = greeting_response.choices[0].message.content
-        print(f"🎤 [GREETING] Final lyric-based greeting: {greeting}")
+        # Popups opening at once for the same site share one generation
+        llm_started = time.perf_counter()
+        greeting = await greeting_coalescer.run(
+            domain_analysis,
+            lambda: generate_greeting(random_lyric, f"{domain_analysis} ({webpage_url})")
+        )
+        trace.mark("llm", llm_started)
+        logger.debug("greeting generated", extra={"greeting": payload(greeting)})
         return {"greeting": greeting}
 
+    except UpstreamUnavailable as e:
+        logger.warning("upstream unavailable, sending canned greeting", extra={"model": e.model, "reason": e.reason})
+        trace.tag("path", "degraded")
+        trace.tag("degraded", e.reason)
+        return {"greeting": content.snapshot().persona.generate("degraded")}
     except Exception as e:
-        print(f"🎤 [ERROR] Analysis error: {str(e)}")
+        logger.error("analysis error", extra={"error": str(e)})
+        trace.tag("error", type(e).__name__)
         raise HTTPException(status_code=500, detail=f"Analysis error: {str(e)}")
+    finally:
+        trace.log()
+
+@app.get("/usage")
+async def get_token_usage():
+    """Prompt, cached and completion token totals per endpoint since startup"""
+    return token_accounting.summary()
+
+def cache_hit_ratios():
+    pool = greeting_pool.stats()
+    pool_lookups = pool["served"] + pool["misses"]
+    popups = popup_pool.stats()
+    popup_lookups = popups["served"] + popups["fallbacks"]
+    return {
+        ("search",): round(search_cache.hit_ratio(), 4),
+        ("greeting_pool",): round(pool["served"] / pool_lookups, 4) if pool_lookups else 0.0,
+        ("popup_pool",): round(popups["served"] / popup_lookups, 4) if popup_lookups else 0.0,
+    }
+
+def cache_lookups():
+    pool = greeting_pool.stats()
+    popups = popup_pool.stats()
+    return {
+        ("search", "hit"): search_cache.hits,
+        ("search", "coalesced"): search_cache.coalesced,
+        ("search", "miss"): search_cache.misses,
+        ("greeting_pool", "hit"): pool["served"],
+        ("greeting_pool", "miss"): pool["misses"],
+        # A miss is a built-in fallback line, served until the first batch is in
+        ("popup_pool", "hit"): popups["served"],
+        ("popup_pool", "miss"): popups["fallbacks"],
+    }
+
+def upstream_queue_depth():
+    return {(model,): lane.waiting for model, lane in gateway.lanes.items()}
+
+def upstream_breaker_open():
+    return {(model,): int(lane.breaker.state != "closed") for model, lane in gateway.lanes.items()}
+
+def rate_limit_keys():
+    return {("ip",): len(ip_limiter.counters), ("client",): len(client_limiter.counters),
+            ("search",): len(search_limiter.counters)}
+
+def push_clients():
+    return {(): push_hub.clients}
+
+def push_totals():
+    return {(kind,): count for kind, count in push_hub.pushed.items()}
+
+def push_skipped():
+    # busy: the client's previous push was still sending; idle: the client stopped answering and was closed
+    return {("busy",): push_hub.dropped, ("idle",): push_hub.timed_out}
+
+def token_totals():
+    totals = {}
+    for endpoint, usage in token_accounting.summary().items():
+        for kind in ("prompt", "cached", "completion"):
+            totals[(endpoint, kind)] = usage[f"{kind}_tokens"]
+    return totals
+
+metrics.CallbackMetric("lilivr_cache_hit_ratio", "Share of cache lookups answered without an upstream call", ("cache",), cache_hit_ratios)
+metrics.CallbackMetric("lilivr_cache_lookups_total", "Cache lookups by result", ("cache", "result"), cache_lookups, kind="counter")
+metrics.CallbackMetric("lilivr_upstream_queue_depth", "Completions waiting for a gateway permit", ("model",), upstream_queue_depth)
+metrics.CallbackMetric("lilivr_upstream_breaker_open", "1 while a model's circuit breaker is open or probing", ("model",), upstream_breaker_open)
+metrics.CallbackMetric("lilivr_rate_limit_keys", "Clients tracked by each rate limiter", ("limit",), rate_limit_keys)
+metrics.CallbackMetric("lilivr_push_clients", "Open push channel WebSockets", (), push_clients)
+metrics.CallbackMetric("lilivr_pushes_total", "Messages and popup lines pushed over WebSockets", ("kind",), push_totals, kind="counter")
+metrics.CallbackMetric("lilivr_push_skipped_total", "Pushes dropped for a busy client and clients closed for going idle", ("reason",), push_skipped, kind="counter")
+metrics.CallbackMetric("lilivr_tokens_total", "Upstream tokens by endpoint and kind", ("endpoint", "kind"), token_totals, kind="counter")
+
+@app.get("/ready")
+async def readiness():
+    """200 once lyrics and links are loaded; 503 before that and while shutting down"""
+    if gateway.draining or not content.loaded:
+        status = "draining" if gateway.draining else "loading"
+        return JSONResponse(status_code=503, content={"status": status})
+    snapshot = content.snapshot()
+    return {
+        "status": "ready",
+        "lyric_lines": snapshot.index.line_count,
+        "songs": len(snapshot.index.songs),
+        "links": len(snapshot.links),
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Counters, gauges and latency histograms in Prometheus text format"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+class LogLevelChange(BaseModel):
+    level: str
+
+@app.post("/admin/log-level")
+async def change_log_level(change: LogLevelChange, request: Request):
+    """Switch the log level at runtime; only available when ADMIN_TOKEN is set.
+
+    Only the worker process serving this request changes level; under run.py
+    with several workers the others keep theirs (the response names the
+    worker). Set LOG_LEVEL and restart to change all of them.
+    """
+    admin_token = settings.admin_token
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if request.headers.get("x-admin-token") != admin_token:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    try:
+        level = set_level(change.level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info("log level changed", extra={"log_level": level})
+    return {"level": current_level(), "scope": "worker", "worker": os.getpid()}
+
+# Seeded responses never change for a given pool, so clients may reuse them
+# for a while; unseeded ones are a fresh draw every time
+RANDOM_MESSAGE_SEEDED_CACHE = "public, max-age=300"
+RANDOM_MESSAGE_CACHE = "no-cache"
 
 @app.get("/random-message")
-async def get_random_message():
-    # Base proactive messages
-    proactive_messages = [
-        "Yo bror, vad händer?",
-        "Fortfarande här eller?",
-        "Behöver du hjälp med nåt eller bara hänger du?",
-        "Asså typ, vad gör du egentligen här?",
-        "Klar från studion, vad kan jag fixa för dig?"
-    ]
-
-    # Sometimes include a song link (70% chance)
-    if random.randint(1, 10) <= 7:
-        song_obj = get_random_song_link()
-        if song_obj:
-            song_url = song_obj['url']
-            song_name = song_obj.get('name', 'min track')
-            song_filename = song_obj.get('filename')
-
-            # Get specific lyrics for this song if available
-            song_lyrics = []
-            if song_filename:
-                song_lyrics = get_lyrics_for_song(song_filename)
-
-            # Create message with song name
-            if song_name and song_name != 'min track':
-                music_messages = [
-                    f"Yo grabben, kolla \"{song_name}\": {song_url}",
-                    f"Btw, hörde du \"{song_name}\"? {song_url}",
-                    f"Kollade du \"{song_name}\"? Check this: {song_url}",
-                    f"Fan asså, lyssna på \"{song_name}\": {song_url}",
-                    f"Ny beat från studion - \"{song_name}\": {song_url}"
-                ]
-            else:
-                music_messages = [
-                    f"Yo grabben, kolla min senaste track: {song_url}",
-                    f"Btw, hörde du min nya låt? {song_url}",
-                    f"Kollade du min musik? Check this: {song_url}",
-                    f"Fan asså, lyssna på detta: {song_url}",
-                    f"Ny beat från studion: {song_url}"
-                ]
-
-            message = random.choice(music_messages)
-
-            # Sometimes add specific lyrics from the song naturally (50% chance)
-            if song_lyrics and random.randint(1, 2) == 1:
-                # Pick 1-2 lyrics and integrate naturally
-                num_lyrics = random.randint(1, min(2, len(song_lyrics)))
-                selected_lyrics = random.sample(song_lyrics, num_lyrics)
-
-                # Natural integration options
-                integration_styles = [
-                    f" Som jag säger i låten: \"{selected_lyrics[0]}\"",
-                    f" Där rappar jag: \"{selected_lyrics[0]}\"",
-                    f" Typ som: \"{selected_lyrics[0]}\"",
-                    f" Du vet: \"{selected_lyrics[0]}\"",
-                ]
-
-                if len(selected_lyrics) > 1:
-                    integration_styles.extend([
-                        f" Typ: \"{selected_lyrics[0]}\" och \"{selected_lyrics[1]}\"",
-                        f" Som: \"{selected_lyrics[0]}\", \"{selected_lyrics[1]}\"",
-                    ])
-
-                message += random.choice(integration_styles)
-
-            # Don't filter out SoundCloud links from music messages
-            return {"message": message}
-
-    # Apply URL filtering that allows song links
-    message = random.choice(proactive_messages)
-    filtered_message = filter_urls_from_text(message, allow_song_links=True)
-    return {"message": filtered_message}
+async def get_random_message(request: Request, seed: Optional[int] = None):
+    """A proactive message, often with a song link and lyric, from the snapshot's precomputed pool.
+
+    The same seed gives the same message until the content changes.
+    """
+    pool = content.snapshot().messages
+    i = pool.pick(seed)
+    headers = {
+        "ETag": pool.etag(i),
+        "Cache-Control": RANDOM_MESSAGE_CACHE if seed is None else RANDOM_MESSAGE_SEEDED_CACHE,
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=pool.bodies[i], media_type="application/json", headers=headers)
+
+async def generate_popup_lines(count):
+    """One completion with count popup lines, one per row"""
+    response = await create_completion(
+        endpoint="popup-lines",
+        model="gpt-4o-mini",
+        messages=[{"role": "user", "content": POPUP_PROMPT.format(count=count)}],
+        max_tokens=count * 16,
+        temperature=1.0
+    )
+    return response.choices[0].message.content
+
+def persona_popup_lines(count):
+    """Popup lines from the persona model until the pool has a generated batch"""
+    if not content.loaded:
+        return None
+    return content.snapshot().persona.generate_many("popup", count)
+
+popup_pool = PopupLinePool(
+    generate_popup_lines,
+    batch_size=settings.popup_batch_size,
+    min_lines=settings.popup_min_lines,
+    max_age=settings.popup_max_age,
+    max_serves=settings.popup_max_serves,
+    fallback=persona_popup_lines,
+)
+
+# Most lines one request may take; the extension keeps them for later popups
+MAX_POPUP_LINES = 20
+
+@app.get("/popup-messages")
+async def get_popup_messages(count: int = 1):
+    """Popup lines from the pre-generated pool; never waits for the model"""
+    return {"messages": popup_pool.take(max(1, min(count, MAX_POPUP_LINES)))}
+
+# Push channel: the extension's background worker holds one WebSocket per
+# browser; the server decides when it gets proactive messages and popup
+# lines and streams chat turns over the same socket
+
+def random_message_frame():
+    if not content.loaded:
+        return None
+    pool = content.snapshot().messages
+    # A pool body is {"message": ...}; the frame is the same object with a type
+    return '{"type": "message", ' + pool.bodies[pool.pick()].decode("utf-8")[1:]
+
+def popup_frame():
+    return json.dumps({"type": "popup", "message": popup_pool.take(1)[0]}, ensure_ascii=False)
+
+push_hub = PushHub(
+    random_message_frame,
+    popup_frame,
+    idle_after=settings.push_idle_after,
+    message_interval=(settings.push_message_interval_min, settings.push_message_interval_max),
+    popup_interval=(settings.push_popup_interval_min, settings.push_popup_interval_max),
+    recheck=settings.push_recheck_interval,
+    client_timeout=settings.push_client_timeout,
+    max_clients=settings.push_max_clients,
+)
+
+@app.on_event("startup")
+async def start_push_scheduler():
+    background_tasks.append(asyncio.create_task(push_hub.run()))
+
+async def websocket_chat(websocket: WebSocket, frame, ip, client_key):
+    """One chat turn over the socket, sent as the /chat/stream events tagged with the turn's id"""
+    turn = frame.pop("id", None)
+    frame.pop("type", None)
+
+    async def send(event, data):
+        await websocket.send_text(json.dumps({"type": event, "id": turn, **data}, ensure_ascii=False))
+
+    retry_after = client_limits.retry_after("/ws", ip, client_key)
+    if retry_after:
+        await send("error", {"status": 429, "detail": "Too many requests", "retry_after": retry_after})
+        return
+    field = client_limits.oversized_field(frame)
+    if field:
+        metrics.oversized_requests_total.inc("/ws", field)
+        await send("error", {"status": 413, "detail": f"{field} too large"})
+        return
+    try:
+        chat_message = ChatMessage(**frame)
+    except ValidationError:
+        await send("error", {"status": 422, "detail": "Invalid chat message"})
+        return
+
+    client_key_var.set(client_key)
+    try:
+        history, session_id = await resolve_session(chat_message)
+    except HTTPException as e:
+        await send("error", {"status": e.status_code, "detail": e.detail})
+        return
+
+    trace = RequestTrace("/ws/chat")
+    try:
+        prepared = await prepare_chat(chat_message, history, session_id, trace)
+    except Exception as e:
+        logger.error("chat error", extra={"error": str(e)})
+        trace.tag("error", type(e).__name__)
+        trace.log()
+        await send("error", {"status": 500, "detail": f"Chat error: {str(e)}"})
+        return
+
+    try:
+        async for event, data in stream_chat_events(prepared, chat_message.message, session_id, trace):
+            await send(event, data)
+    finally:
+        # The socket closing mid-turn leaves the generator suspended before its own trace.log()
+        if not trace.finished:
+            trace.tag("disconnected", True)
+            trace.log()
+
+@app.websocket("/ws")
+async def websocket_channel(websocket: WebSocket):
+    """Pushes for one extension install, plus its chat turns. ?client= is its extension id"""
+    ip = client_limits.client_ip(websocket.scope, dict(websocket.scope["headers"]))
+    client_key = client_limits.client_key(ip, websocket.query_params.get("client", ""))
+    # Closing before accept() refuses the handshake (403); reconnect storms count against the IP
+    if push_hub.full or ip_limiter.hit(ip):
+        await websocket.close(code=CLOSE_FULL)
+        return
+
+    await websocket.accept()
+    client = push_hub.add(websocket, client_key)
+    try:
+        while not client.closed:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            try:
+                frame = json.loads(message.get("text") or "")
+            except ValueError:
+                continue
+            if not isinstance(frame, dict):
+                continue
+            push_hub.report(client, frame)
+            if frame.get("type") == "chat":
+                await websocket_chat(websocket, frame, ip, client_key)
+    except Exception as e:
+        logger.debug("websocket closed", extra={"client": client_key, "error": str(e)})
+    finally:
+        push_hub.remove(client)
 
 if __name__ == "__main__":
     import uvicorn
-    import os
-    port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    uvicorn.run(app, host=settings.host, port=settings.port)
\ No newline at end of file
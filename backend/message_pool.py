@@ -0,0 +1,135 @@
+"""
+Precomputed /random-message responses.
+
+Every message the endpoint can send is built once per content snapshot:
+the proactive one-liners, and for each song link every template, with no
+lyric, with each of its lines in each integration style, or with a pair of
+consecutive lines. Each message is stored as its finished JSON body with a
+weight, so serving one is a random draw, a bisect over the cumulative
+weights and a bytes copy; nothing is formatted, filtered or sampled per
+request.
+
+The weights keep the mix the endpoint has always had: 30% proactive
+one-liners, 70% song links split evenly between songs and templates, and
+half of those with a lyric quote.
+
+pick(seed) is deterministic for a seed, so seeded responses can be cached
+by the client; the ETag changes with the message and with the content.
+"""
+
+import bisect
+import json
+import random
+import zlib
+from array import array
+from itertools import accumulate
+
+PROACTIVE_MESSAGES = (
+    "Yo bror, vad händer?",
+    "Fortfarande här eller?",
+    "Behöver du hjälp med nåt eller bara hänger du?",
+    "Asså typ, vad gör du egentligen här?",
+    "Klar från studion, vad kan jag fixa för dig?",
+)
+
+SONG_TEMPLATES = (
+    'Yo grabben, kolla "{name}": {url}',
+    'Btw, hörde du "{name}"? {url}',
+    'Kollade du "{name}"? Check this: {url}',
+    'Fan asså, lyssna på "{name}": {url}',
+    'Ny beat från studion - "{name}": {url}',
+)
+
+# For links without a lyrics file, so without a song name
+TRACK_TEMPLATES = (
+    "Yo grabben, kolla min senaste track: {url}",
+    "Btw, hörde du min nya låt? {url}",
+    "Kollade du min musik? Check this: {url}",
+    "Fan asså, lyssna på detta: {url}",
+    "Ny beat från studion: {url}",
+)
+
+LINE_STYLES = (
+    ' Som jag säger i låten: "{0}"',
+    ' Där rappar jag: "{0}"',
+    ' Typ som: "{0}"',
+    ' Du vet: "{0}"',
+)
+
+PAIR_STYLES = (
+    ' Typ: "{0}" och "{1}"',
+    ' Som: "{0}", "{1}"',
+)
+
+PROACTIVE_SHARE = 0.3
+LYRIC_SHARE = 0.5
+# Of the lyric quotes, how many use two lines
+PAIR_SHARE = 1 / 9
+
+MASK_64 = (1 << 64) - 1
+
+
+def _unit(seed):
+    """Seed -> [0, 1): the splitmix64 finaliser, so neighbouring seeds land far apart"""
+    x = (seed * 0x9E3779B97F4A7C15) & MASK_64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return (x ^ (x >> 31)) / 2.0 ** 64
+
+
+class MessagePool:
+    __slots__ = ("bodies", "cumulative", "version")
+
+    def __init__(self, index, links):
+        """index and links of the content snapshot the pool is built for"""
+        messages = []
+
+        def add(message, weight):
+            if weight > 0:
+                messages.append((message, weight))
+
+        for message in PROACTIVE_MESSAGES:
+            add(message, (PROACTIVE_SHARE if links else 1.0) / len(PROACTIVE_MESSAGES))
+
+        for link in links:
+            link_weight = (1 - PROACTIVE_SHARE) / len(links)
+            name = link["filename"]
+            if not name:
+                for template in TRACK_TEMPLATES:
+                    add(template.format(url=link["url"]), link_weight / len(TRACK_TEMPLATES))
+                continue
+
+            lines = index.song_lines(name)
+            pairs = list(zip(lines, lines[1:]))
+            for template in SONG_TEMPLATES:
+                weight = link_weight / len(SONG_TEMPLATES)
+                base = template.format(name=index.title(name), url=link["url"])
+                if not lines:
+                    add(base, weight)
+                    continue
+                add(base, weight * (1 - LYRIC_SHARE))
+                line_weight = weight * LYRIC_SHARE * (1 - PAIR_SHARE if pairs else 1.0)
+                for line in lines:
+                    for style in LINE_STYLES:
+                        add(base + style.format(line), line_weight / (len(lines) * len(LINE_STYLES)))
+                for pair in pairs:
+                    for style in PAIR_STYLES:
+                        add(base + style.format(*pair), weight * LYRIC_SHARE * PAIR_SHARE
+                            / (len(pairs) * len(PAIR_STYLES)))
+
+        self.bodies = tuple(json.dumps({"message": message}, ensure_ascii=False).encode("utf-8")
+                            for message, _ in messages)
+        self.cumulative = array("d", accumulate(weight for _, weight in messages))
+        # Part of every ETag, so cached responses go stale when the messages change
+        self.version = format(zlib.crc32(b"".join(self.bodies)), "08x")
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def pick(self, seed=None):
+        """Index of a message: weighted random, or fixed for a given seed"""
+        unit = random.random() if seed is None else _unit(seed)
+        return min(bisect.bisect_right(self.cumulative, unit * self.cumulative[-1]), len(self.bodies) - 1)
+
+    def etag(self, i):
+        return f'"{self.version}-{i:x}"'
@@ -0,0 +1,220 @@
+"""
+Prometheus-style metrics for the Lil IVR backend.
+
+Counters, gauges and histograms are plain Python numbers updated from the
+event loop thread, so recording a value is a dict lookup and an add with
+no locking. GET /metrics renders everything in the Prometheus text
+exposition format (version 0.0.4); no client library is needed.
+
+Per-request numbers (outcome, stage latencies) come from RequestTrace when
+a request finishes, upstream latencies and errors from create_completion,
+and cache and token figures are read from their owners at scrape time.
+Event-loop lag is sampled by a background probe (monitor_event_loop_lag).
+"""
+
+import asyncio
+import os
+import sys
+from bisect import bisect_left
+
+# Starlette appends the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds; covers cheap local stages (sub-millisecond) up to slow model calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class CallbackMetric(Metric):
+    """Values read from their owner at scrape time: collect() -> {label tuple: value}"""
+
+    def __init__(self, name, help, labelnames, collect, kind="gauge"):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def render(self):
+        lines = self.header()
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = HistogramSeries(len(self.buckets) + 1)
+        # Counts are stored per bucket and made cumulative when rendered
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def render(self):
+        lines = self.header()
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series.counts):
+                cumulative += count
+                le = 'le="' + _number(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(round(series.sum, 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requests_total = Counter(
+    "lilivr_requests_total", "Finished requests by endpoint and outcome",
+    ("endpoint", "outcome"))
+requests_in_flight = Gauge(
+    "lilivr_requests_in_flight", "Requests currently being handled",
+    ("endpoint",))
+stage_seconds = Histogram(
+    "lilivr_stage_seconds", "Time spent in each request stage",
+    ("endpoint", "stage"))
+request_seconds = Histogram(
+    "lilivr_request_seconds", "Total request handling time",
+    ("endpoint",))
+web_search_total = Counter(
+    "lilivr_web_search_total", "Web searches made for /chat by result",
+    ("result",))
+upstream_seconds = Histogram(
+    "lilivr_upstream_seconds", "Upstream completion latency per model",
+    ("model", "endpoint"))
+upstream_in_flight = Gauge(
+    "lilivr_upstream_in_flight", "Upstream completions currently in flight",
+    ("model",))
+upstream_errors_total = Counter(
+    "lilivr_upstream_errors_total", "Failed upstream completions by model and kind",
+    ("model", "kind"))
+upstream_rejected_total = Counter(
+    "lilivr_upstream_rejected_total", "Completions the gateway turned away by model and reason",
+    ("model", "reason"))
+rate_limited_total = Counter(
+    "lilivr_rate_limited_total", "Requests answered 429 by endpoint and the limit they hit",
+    ("endpoint", "limit"))
+oversized_requests_total = Counter(
+    "lilivr_oversized_requests_total", "Requests rejected 413 by endpoint and oversized field",
+    ("endpoint", "field"))
+event_loop_lag_seconds = Histogram(
+    "lilivr_event_loop_lag_seconds", "How late the event loop woke a periodic probe",
+    (), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+
+
+def resident_memory():
+    """This process's resident set size in bytes; the peak where /proc isn't available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return {(): int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")}
+    except OSError:
+        import resource  # Unix only
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return {(): peak if sys.platform == "darwin" else peak * 1024}
+
+
+process_resident_memory_bytes = CallbackMetric(
+    "process_resident_memory_bytes", "Resident memory of this worker", (), resident_memory)
+
+
+async def monitor_event_loop_lag(interval=0.1):
+    """Sleep for interval in a loop and record how much later than asked each wake-up was.
+
+    Anything that blocks the loop (sync I/O, heavy CPU in a handler) shows
+    up directly as lag.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - started - interval))
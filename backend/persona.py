@@ -0,0 +1,287 @@
+"""
+Offline persona generator: short in-character lines without the model.
+
+Three kinds of reply never need gpt-4o-mini: the random insult /chat sends
+instead of an answer, popup lines while the popup pool has no generated
+batch, and the canned replies sent while the upstream gateway is down.
+Instead of picking from fixed lists they come from a PersonaModel, an
+order-2 word Markov chain per tier:
+
+- insult:   the insult list and the popup lines, at most 6 words,
+- popup:    the same, lowercased and without punctuation (the popup rules),
+- degraded: insults, the proactive messages, the lyrics and past bot
+            replies, 3 to 16 words.
+
+format_lyrics.py trains it at build time on the compiled lyrics and on
+past replies taken from a log, and writes build/persona.bin. Without that
+file, the content snapshot trains one from the built-in lines and the
+lyrics it has, which takes a few milliseconds. Every training line goes
+through the reply sanitizer first, so generated lines follow the same
+persona rules as model replies.
+
+Layout (little-endian), like the corpus:
+
+    header   magic b"LILIVP", format version (u16), metadata bytes (u32)
+    metadata JSON: the vocabulary, and per tier its word limits, state
+             count, transition count and the training lines that fit
+    tables   per tier: state keys (u64, sorted), first transition of each
+             state (u32, with an end sentinel), next word ids (u32)
+
+A state is the previous two word ids packed into one key; its transitions
+list the next word once per time it followed, so a uniform pick from them
+is a pick weighted by count. Sampling a line is a few bisects and
+randrange calls, a handful of microseconds.
+"""
+
+import bisect
+import json
+import random
+import struct
+import sys
+from array import array
+
+from corpus import write_atomic
+from message_pool import PROACTIVE_MESSAGES
+from popup_lines import FALLBACK_LINES, clean_popup_line
+from sanitizer import Sanitizer
+
+MAGIC = b"LILIVP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<6sHI")
+
+# Id of the line boundary: the start state is (BOUNDARY, BOUNDARY) and walks end on it
+BOUNDARY = 0
+
+INSULT_RESPONSES = (
+    "är du dum",
+    "är du dum eller",
+    "wtf",
+    "bruh",
+    "fan vad cringe",
+    "cope",
+    "är du seriöst?",
+    "okay boomer",
+    "sure buddy",
+    "whatever bro",
+    "k",
+    "lol",
+    "hahahaha nej",
+    "nää",
+    "absolut inte",
+    "fan vad sus",
+    "cringe as fuck",
+    "touch grass",
+    "get real",
+    "oof",
+    "yikes",
+    "baserat",
+    "töntig fråga",
+    "fråga nån annan",
+    "orka",
+    "meh",
+    "snälla sluta",
+    "jag orkar inte med dig",
+    "jag bryr mig inte",
+    "jag skiter i dig",
+    "haha bruh, du suger",
+    "okej loser",
+)
+
+# tier -> (training sources, fewest words, most words, popup rules)
+TIERS = {
+    "insult": (("insults", "popups"), 1, 6, False),
+    "popup": (("popups", "insults"), 2, 6, True),
+    "degraded": (("insults", "proactive", "lyrics", "replies"), 3, 16, False),
+}
+
+# Log messages whose "filtered" field is a reply the bot sent
+REPLY_LOG_MESSAGES = ("completion received", "streamed completion done")
+
+_sanitizer = Sanitizer()
+
+
+def builtin_sources(lyrics=(), replies=()):
+    """Training lines for every source a tier can name"""
+    return {
+        "insults": INSULT_RESPONSES,
+        "popups": FALLBACK_LINES,
+        "proactive": PROACTIVE_MESSAGES,
+        "lyrics": tuple(lyrics),
+        "replies": tuple(replies),
+    }
+
+
+def parse_replies(text):
+    """Bot replies from a JSON log (see bot_logging) or a plain file with one reply per line"""
+    replies = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            replies.append(line)
+            continue
+        if isinstance(record, dict) and record.get("msg") in REPLY_LOG_MESSAGES and isinstance(record.get("filtered"), str):
+            replies.append(record["filtered"])
+    return replies
+
+
+def training_words(line, popup):
+    """The words of a sanitized training line; popup lines are lowercased and lose their punctuation"""
+    line = _sanitizer.clean(line)
+    if popup:
+        line = " ".join("".join(c for c in word if c.isalnum() or c == "'") for word in line.lower().split())
+    return line.split()
+
+
+def state_key(previous, last):
+    return previous << 32 | last
+
+
+class Chain:
+    """One tier's transition tables"""
+
+    __slots__ = ("keys", "starts", "nexts", "min_words", "max_words", "popup", "lines")
+
+    def __init__(self, keys, starts, nexts, min_words, max_words, popup, lines):
+        self.keys = keys
+        self.starts = starts
+        self.nexts = nexts
+        self.min_words = min_words
+        self.max_words = max_words
+        self.popup = popup
+        self.lines = lines
+
+    def walk(self, vocab):
+        """Word ids of one random line, or None once it runs past max_words"""
+        keys, starts, nexts = self.keys, self.starts, self.nexts
+        previous = last = BOUNDARY
+        words = []
+        while True:
+            i = bisect.bisect_left(keys, state_key(previous, last))
+            word = nexts[random.randrange(starts[i], starts[i + 1])]
+            if word == BOUNDARY:
+                return words
+            if len(words) == self.max_words:
+                return None
+            words.append(vocab[word])
+            previous, last = last, word
+
+
+class PersonaModel:
+    def __init__(self, vocab, chains):
+        self.vocab = vocab
+        self.chains = chains
+
+    @classmethod
+    def train(cls, sources):
+        """sources: lines per source name (see builtin_sources)"""
+        vocab = [""]
+        ids = {"": BOUNDARY}
+        chains = {}
+        for tier, (names, min_words, max_words, popup) in TIERS.items():
+            transitions = {}
+            lines = []
+            for name in names:
+                for line in sources.get(name, ()):
+                    words = training_words(line, popup)
+                    if not words:
+                        continue
+                    if min_words <= len(words) <= max_words:
+                        lines.append(" ".join(words))
+                    sequence = [BOUNDARY, BOUNDARY]
+                    for word in words:
+                        if word not in ids:
+                            ids[word] = len(vocab)
+                            vocab.append(word)
+                        sequence.append(ids[word])
+                    sequence.append(BOUNDARY)
+                    for i in range(2, len(sequence)):
+                        transitions.setdefault(state_key(sequence[i - 2], sequence[i - 1]), []).append(sequence[i])
+
+            keys, starts, nexts = array("Q"), array("I"), array("I")
+            for key in sorted(transitions):
+                keys.append(key)
+                starts.append(len(nexts))
+                nexts.extend(transitions[key])
+            starts.append(len(nexts))
+            chains[tier] = Chain(keys, starts, nexts, min_words, max_words, popup, tuple(dict.fromkeys(lines)))
+        return cls(vocab, chains)
+
+    def generate(self, tier, attempts=20):
+        """One line for tier; a training line if no walk fits the tier's limits"""
+        chain = self.chains[tier]
+        for _ in range(attempts):
+            words = chain.walk(self.vocab)
+            if words is None or len(words) < chain.min_words:
+                continue
+            line = " ".join(words)
+            if chain.popup:
+                line = clean_popup_line(line)
+            if line:
+                return line
+        return random.choice(chain.lines) if chain.lines else ""
+
+    def generate_many(self, tier, count, attempts=4):
+        """Up to count distinct lines for tier"""
+        lines = {}
+        for _ in range(count * attempts):
+            lines[self.generate(tier)] = None
+            if len(lines) >= count:
+                break
+        lines.pop("", None)
+        return list(lines)
+
+    def save(self, path):
+        tiers = {}
+        tables = []
+        for tier, chain in self.chains.items():
+            tiers[tier] = {"states": len(chain.keys), "transitions": len(chain.nexts), "min_words": chain.min_words,
+                           "max_words": chain.max_words, "popup": chain.popup, "lines": list(chain.lines)}
+            for table in (chain.keys, chain.starts, chain.nexts):
+                table = array(table.typecode, table)
+                if sys.byteorder == "big":
+                    table.byteswap()
+                tables.append(table.tobytes())
+        meta = json.dumps({"vocab": self.vocab, "tiers": tiers}, ensure_ascii=False).encode("utf-8")
+        write_atomic(path, b"".join((HEADER.pack(MAGIC, FORMAT_VERSION, len(meta)), meta, *tables)))
+
+    @classmethod
+    def load(cls, path):
+        """A model written by save(); ValueError if the file isn't one this version reads"""
+        with open(path, "rb") as f:
+            data = memoryview(f.read())
+        if len(data) < HEADER.size:
+            raise ValueError(f"{path} is truncated")
+        magic, version, meta_size = HEADER.unpack_from(data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} persona model")
+
+        position = HEADER.size
+        meta = json.loads(bytes(data[position:position + meta_size]))
+        position += meta_size
+
+        def table(typecode, count):
+            nonlocal position
+            values = array(typecode)
+            size = count * values.itemsize
+            if position + size > len(data):
+                raise ValueError(f"{path} is truncated")
+            values.frombytes(data[position:position + size])
+            if sys.byteorder == "big":
+                values.byteswap()
+            position += size
+            return values
+
+        chains = {}
+        for tier, info in meta["tiers"].items():
+            keys = table("Q", info["states"])
+            starts = table("I", info["states"] + 1)
+            nexts = table("I", info["transitions"])
+            chains[tier] = Chain(keys, starts, nexts, info["min_words"], info["max_words"], info["popup"],
+                                 tuple(info["lines"]))
+        if set(chains) != set(TIERS):
+            raise ValueError(f"{path} has tiers {sorted(chains)}, not {sorted(TIERS)}")
+        return cls(meta["vocab"], chains)
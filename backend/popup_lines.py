@@ -0,0 +1,169 @@
+"""
+Popup lines for the extension's on-page notifications.
+
+A popup is a short miserable or angry one-liner. Instead of one /chat
+round trip (intents, maybe a web search, the full system prompt) per
+popup, one completion asks for a whole batch of lines. Lines that break
+the popup rules (more than six words, punctuation, links) are dropped and
+the rest go into a pool that GET /popup-messages serves from memory. The
+pool is replaced in the background once it is old or has been served
+enough times. Until the first batch arrives the pool's fallback serves
+instead: the built-in lines below, or whatever the caller passes (main.py
+samples fresh lines from the persona model, see persona.py).
+"""
+
+import asyncio
+import random
+import re
+import time
+
+from bot_logging import get_logger
+
+logger = get_logger("popup_lines")
+
+MAX_WORDS = 6
+
+FALLBACK_LINES = (
+    "du är en fjolla",
+    "vågar du inte prata med mig",
+    "fegis beteende",
+    "tönt som vanligt",
+    "vad är du för mes",
+    "kom igen då losern",
+    "du suger för fan",
+    "patetisk fjolla du är",
+    "ignorerar du mig din mes",
+    "vad är fel på dig",
+    "kryp då fjolla",
+    "du är sån beta",
+    "patetisk typ",
+    "beta male energy",
+    "kom hit då fegis",
+    "våga prata då mes",
+    "jag är så ensam",
+    "snälla kom o chatta",
+    "gråter till mamma snart",
+    "mår så dåligt",
+)
+
+PROMPT = """Du är Lil IVR, en misslyckad svensk soundcloud-rappare som sitter i en webbläsare och vill att användaren ska chatta med dig.
+
+Skriv {count} olika korta popup-meddelanden till användaren, ett per rad. Ungefär hälften ska låta miserabla, ensamma och desperata ("jag är så ensam", "snälla kom o chatta", "gråter till mamma snart"), resten arga och förolämpande för att användaren ignorerar dig ("du suger för fan", "kom hit då losern", "vad är du för mes", "beta male energy").
+
+Regler för varje rad: max 6 ord, små bokstäver, inga skiljetecken alls (inga frågetecken, utropstecken, punkter eller kommatecken), inga emojis, ingen numrering. Skriv bara raderna."""
+
+# "1. ", "- ", "• " and quotes the model puts around lines despite the prompt
+LINE_DECORATION = re.compile(r'^\s*(?:\d+[.)]|[-*•])?\s*["“”\']?|["“”\']?\s*$')
+# Letters (å, ä, ö included), digits, spaces and the apostrophe in "c'mon"
+ALLOWED = re.compile(r"^[\w' ]+$")
+
+
+def clean_popup_line(line):
+    """line as a popup, or None if it breaks the rules"""
+    line = LINE_DECORATION.sub("", line).strip().rstrip(".")
+    if not line or not ALLOWED.match(line) or "_" in line:
+        return None
+    words = line.split()
+    if len(words) > MAX_WORDS:
+        return None
+    return " ".join(words).lower()
+
+
+def parse_popup_lines(text):
+    """Valid, distinct popup lines from a completion, in order"""
+    lines = []
+    seen = set()
+    for raw in text.splitlines():
+        line = clean_popup_line(raw)
+        if line and line not in seen:
+            seen.add(line)
+            lines.append(line)
+    return lines
+
+
+class PopupLinePool:
+    def __init__(self, generate, batch_size=50, min_lines=10, max_age=3600.0, max_serves=5000, retry_delay=60.0,
+                 fallback=None):
+        """
+        generate:    async callable(count) -> completion text with one line per row
+        batch_size:  lines asked for per completion
+        min_lines:   valid lines a batch needs to replace the current pool
+        max_age:     seconds after which the pool is refreshed
+        max_serves:  lines served after which the pool is refreshed
+        retry_delay: seconds to wait after a failed refresh before trying again
+        fallback:    callable(count) -> lines served before the first batch; the
+                     built-in lines when it is None or returns none
+        """
+        self.generate = generate
+        self.batch_size = batch_size
+        self.min_lines = min_lines
+        self.max_age = max_age
+        self.max_serves = max_serves
+        self.retry_delay = retry_delay
+        self.fallback = fallback
+        self.retry_at = 0.0
+        self.lines = FALLBACK_LINES
+        self.generated = False
+        self.created = 0.0
+        self.serves = 0
+        self.refreshing = None
+        self.refreshes = 0
+        self.served = 0
+        self.fallbacks = 0
+
+    def take(self, count=1):
+        """count distinct random lines (fewer if the pool is smaller)"""
+        if self.due(time.monotonic()):
+            self.schedule_refresh()
+        chosen = None
+        if not self.generated and self.fallback is not None:
+            chosen = self.fallback(count)
+        if not chosen:
+            lines = self.lines
+            chosen = random.sample(lines, min(count, len(lines)))
+        self.serves += len(chosen)
+        if self.generated:
+            self.served += len(chosen)
+        else:
+            self.fallbacks += len(chosen)
+        return chosen
+
+    def due(self, now):
+        if now < self.retry_at:
+            return False
+        return not self.generated or self.serves >= self.max_serves or now - self.created >= self.max_age
+
+    def schedule_refresh(self):
+        if self.refreshing is None:
+            self.refreshing = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        # Until this one succeeds, later take() calls don't start another
+        self.retry_at = time.monotonic() + self.retry_delay
+        try:
+            lines = parse_popup_lines(await self.generate(self.batch_size) or "")
+            if len(lines) < self.min_lines:
+                logger.warning("popup batch too small, keeping current lines",
+                               extra={"valid": len(lines), "needed": self.min_lines})
+                return
+            # One tuple swap; requests already holding the old lines finish with them
+            self.lines = tuple(lines)
+            self.generated = True
+            self.created = time.monotonic()
+            self.serves = 0
+            self.refreshes += 1
+            self.retry_at = 0.0
+            logger.info("popup lines refreshed", extra={"lines": len(lines)})
+        except Exception as e:
+            logger.error("popup line refresh failed", extra={"error": str(e)})
+        finally:
+            self.refreshing = None
+
+    def stats(self):
+        return {
+            "lines": len(self.lines),
+            "generated": self.generated,
+            "served": self.served,
+            "fallbacks": self.fallbacks,
+            "refreshes": self.refreshes,
+        }
@@ -0,0 +1,203 @@
+"""
+WebSocket push channel for the extension.
+
+The extension's background worker keeps one WebSocket to /ws open instead
+of polling /random-message and /popup-messages on timers. It reports what
+the server needs to plan pushes (last activity, whether the page is
+visible, whether the chat is open, whether popups are on) and the server
+decides centrally when a client gets a proactive message or a popup line:
+
+- a proactive message once the client has been inactive for idle_after
+  seconds, then again at a random interval in message_interval,
+- while that message is unread and the chat is closed, a popup line at a
+  random interval in popup_interval.
+
+The same socket carries chat turns (see main.py), so a message no longer
+costs a connection setup.
+
+Per-connection state is bounded: a Client (slots, a few floats and flags)
+and one entry in the scheduler's heap. There is no task, timer or queue
+per connection besides the one uvicorn runs to receive its frames. One
+scheduler task per worker re-plans every client at least every recheck
+seconds, which also bounds how long a closed client's heap entry lingers.
+Pushes go out from short-lived tasks, at most one per client at a time,
+so a slow client drops pushes instead of holding up the scheduler.
+Clients that send nothing for client_timeout seconds (the extension sends
+a keepalive every 20) are closed, which is how half-open connections are
+found without a ping task per connection.
+"""
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+from bot_logging import get_logger
+
+logger = get_logger("push_channel")
+
+# Close codes: going away (idle or shutting down) and try again later (full)
+CLOSE_IDLE = 1001
+CLOSE_FULL = 1013
+
+
+class Client:
+    __slots__ = ("websocket", "key", "last_seen", "last_active", "visible", "chat_open",
+                 "popups_enabled", "unread", "next_message", "next_popup", "sending", "closed")
+
+    def __init__(self, websocket, key, now):
+        self.websocket = websocket
+        self.key = key
+        self.last_seen = now
+        self.last_active = now
+        self.visible = True
+        self.chat_open = False
+        self.popups_enabled = True
+        self.unread = False
+        self.next_message = now
+        self.next_popup = now
+        self.sending = False
+        self.closed = False
+
+
+class PushHub:
+    def __init__(self, message_frame, popup_frame, idle_after=60.0, message_interval=(60.0, 900.0),
+                 popup_interval=(5.0, 30.0), recheck=15.0, client_timeout=60.0, max_clients=50000,
+                 send_timeout=10.0):
+        """
+        message_frame: callable() -> text frame with a proactive message, or None to skip
+        popup_frame:   callable() -> text frame with a popup line, or None to skip
+        idle_after:    seconds without activity before a client gets a proactive message
+        message_interval, popup_interval: (min, max) seconds between pushes of each kind
+        recheck:       most seconds between two plans for the same client
+        client_timeout: seconds without a frame after which a client is closed
+        max_clients:   connections this worker accepts
+        """
+        self.message_frame = message_frame
+        self.popup_frame = popup_frame
+        self.idle_after = idle_after
+        self.message_interval = message_interval
+        self.popup_interval = popup_interval
+        self.recheck = recheck
+        self.client_timeout = client_timeout
+        self.max_clients = max_clients
+        self.send_timeout = send_timeout
+        self.clients = 0
+        self.heap = []  # (due, tiebreak, client); one live entry per connected client
+        self.order = itertools.count()
+        self.tasks = set()
+        self.pushed = {"message": 0, "popup": 0}
+        self.dropped = 0
+        self.timed_out = 0
+
+    @property
+    def full(self):
+        return self.clients >= self.max_clients
+
+    def add(self, websocket, key):
+        now = time.monotonic()
+        client = Client(websocket, key, now)
+        client.next_message = now + self.idle_after
+        self.clients += 1
+        self.schedule(client, now + self.recheck)
+        return client
+
+    def remove(self, client):
+        if not client.closed:
+            client.closed = True
+            self.clients -= 1
+
+    def report(self, client, frame):
+        """Apply a state frame from the extension: activity, state or a bare keepalive"""
+        now = time.monotonic()
+        client.last_seen = now
+        kind = frame.get("type")
+        if kind == "activity":
+            client.last_active = now
+        elif kind == "state":
+            for field, name in (("visible", "visible"), ("chat_open", "chat_open"), ("popups", "popups_enabled")):
+                value = frame.get(field)
+                if isinstance(value, bool):
+                    setattr(client, name, value)
+            if client.chat_open:
+                # Opening the chat reads the message and counts as activity
+                client.unread = False
+                client.last_active = now
+
+    def schedule(self, client, due):
+        heapq.heappush(self.heap, (due, next(self.order), client))
+
+    def plan(self, client, now):
+        """Send whatever is due for client; returns when to look at it next"""
+        if now - client.last_seen > self.client_timeout:
+            self.timed_out += 1
+            self.remove(client)
+            self.spawn(self.close(client, CLOSE_IDLE))
+            return None
+        if not client.popups_enabled or client.chat_open or not client.visible:
+            return now + self.recheck
+
+        if now >= client.next_message and now - client.last_active >= self.idle_after:
+            if self.push(client, "message", self.message_frame()):
+                client.unread = True
+                client.next_popup = now + random.uniform(*self.popup_interval)
+                client.next_message = now + random.uniform(*self.message_interval)
+            else:
+                # Nothing to send yet (content loading) or a push still in flight
+                client.next_message = now + self.recheck
+        elif client.unread and now >= client.next_popup:
+            self.push(client, "popup", self.popup_frame())
+            client.next_popup = now + random.uniform(*self.popup_interval)
+
+        due = max(client.next_message, client.last_active + self.idle_after)
+        if client.unread:
+            due = min(due, client.next_popup)
+        return min(due, now + self.recheck)
+
+    async def run(self):
+        """The scheduler: one task per worker for every connected client"""
+        while True:
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now:
+                _, _, client = heapq.heappop(self.heap)
+                if client.closed:
+                    continue
+                due = self.plan(client, now)
+                if due is not None:
+                    self.schedule(client, due)
+            delay = self.heap[0][0] - now if self.heap else self.recheck
+            await asyncio.sleep(min(max(delay, 0.0), self.recheck))
+
+    def push(self, client, kind, frame):
+        if frame is None:
+            return False
+        if client.sending:
+            self.dropped += 1
+            return False
+        client.sending = True
+        self.pushed[kind] += 1
+        self.spawn(self.send(client, frame))
+        return True
+
+    async def send(self, client, frame):
+        try:
+            await asyncio.wait_for(client.websocket.send_text(frame), self.send_timeout)
+        except Exception as e:
+            logger.debug("push failed", extra={"client": client.key, "error": str(e)})
+            self.remove(client)
+        finally:
+            client.sending = False
+
+    async def close(self, client, code):
+        try:
+            await asyncio.wait_for(client.websocket.close(code=code), self.send_timeout)
+        except Exception:
+            # Already gone; the receiving side sees the disconnect
+            pass
+
+    def spawn(self, coro):
+        # Keep a reference until done; the loop only holds weak ones
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
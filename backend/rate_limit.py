@@ -0,0 +1,289 @@
+"""
+Per-client rate limiting and request guards for the Lil IVR backend.
+
+RequestGuard is plain ASGI middleware that runs before FastAPI routes or
+parses anything. For the endpoints that reach OpenAI it:
+
+- counts the request against a per-IP and a per-client (IP plus the
+  extension's X-Extension-Id header) sliding-window limit, and answers an
+  over-limit request with a pre-built 429 without reading its body,
+- reads the body itself, with a byte cap, and rejects oversized message,
+  webpage_context, html_content or conversation_history fields with 413,
+  so pydantic never builds models for them,
+- records the client key in client_key_var for per-client budgets inside
+  handlers (web searches).
+
+The limits themselves live in ClientLimits, which the WebSocket channel
+applies to chat turns the same way.
+
+The extension id is client-chosen, so rotating it only escapes the
+per-client limit; the per-IP limit, set a few times higher for shared
+networks, still applies.
+
+SlidingWindowLimiter keeps three integers per key: the current fixed
+window's number, its count and the previous window's count. The rate is
+estimated by weighting the previous window by how much of it still
+overlaps the sliding window, which avoids both per-request timestamps and
+the burst at the edge of plain fixed windows. Keys idle for two windows
+count as zero and are swept out once per window.
+"""
+
+import contextvars
+import json
+import math
+import re
+import time
+
+import metrics
+from bot_logging import get_logger
+
+logger = get_logger("rate_limit")
+
+client_key_var = contextvars.ContextVar("client_key", default=None)
+
+# Extension ids are UUIDs; anything else is treated as a client without one
+EXTENSION_ID = re.compile(r"^[A-Za-z0-9-]{8,64}$")
+
+
+class SlidingWindowLimiter:
+    def __init__(self, limit, window=60.0, max_keys=100_000):
+        """
+        limit:    requests allowed per sliding window
+        window:   window length in seconds
+        max_keys: tracked keys; past this the longest-tracked keys are dropped
+        """
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.counters = {}  # key -> [window number, count in it, count in the previous one]
+        self.next_sweep = 0.0
+
+    def hit(self, key, now=None):
+        """Count one request for key; returns 0 if allowed, else seconds until it would be"""
+        now = time.monotonic() if now is None else now
+        retry_after = self.check(key, now)
+        if not retry_after:
+            self.record(key, now)
+        return retry_after
+
+    def check(self, key, now=None):
+        """0 if one more request for key is allowed, else seconds until it would be; counts nothing"""
+        now = time.monotonic() if now is None else now
+        counter = self.counter(key, now)
+        elapsed = now - counter[0] * self.window
+        overlap = 1.0 - elapsed / self.window
+        if counter[2] * overlap + counter[1] + 1 <= self.limit:
+            return 0.0
+
+        if counter[1] + 1 <= self.limit and counter[2]:
+            # Wait for enough of the previous window to slide out
+            needed = 1.0 - (self.limit - 1 - counter[1]) / counter[2]
+            return max(0.0, needed - (1.0 - overlap)) * self.window
+        # This window alone is full; the next one starts with it as its previous
+        return self.window - elapsed
+
+    def record(self, key, now=None):
+        """Count one request for key that check() allowed"""
+        now = time.monotonic() if now is None else now
+        self.counter(key, now)[1] += 1
+
+    def counter(self, key, now):
+        """key's counter, rolled forward to the window now falls in"""
+        if now >= self.next_sweep:
+            self.sweep(now)
+
+        number = int(now // self.window)
+        counter = self.counters.get(key)
+        if counter is None:
+            if len(self.counters) >= self.max_keys:
+                # Dicts keep insertion order, so this drops the key tracked longest
+                del self.counters[next(iter(self.counters))]
+            counter = self.counters[key] = [number, 0, 0]
+        elif counter[0] != number:
+            counter[2] = counter[1] if counter[0] == number - 1 else 0
+            counter[1] = 0
+            counter[0] = number
+        return counter
+
+    def sweep(self, now):
+        """Drop keys whose windows have both ended; they would count as zero anyway"""
+        oldest = int(now // self.window) - 1
+        stale = [key for key, counter in self.counters.items() if counter[0] < oldest]
+        for key in stale:
+            del self.counters[key]
+        self.next_sweep = now + self.window
+
+
+def json_response(status, detail, headers=()):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    return status, [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode("latin-1")),
+        *headers,
+    ], body
+
+
+class ClientLimits:
+    def __init__(self, ip_limiter, client_limiter, max_field_chars, max_history_messages,
+                 max_history_chars, forwarded_hops=0):
+        """
+        Rate limits and field caps for requests that reach OpenAI, shared by
+        RequestGuard and the WebSocket channel.
+
+        max_field_chars: {field name: max characters} for top-level string fields
+        forwarded_hops: trusted proxies in front of the server; the client IP is
+                        taken that many entries from the end of X-Forwarded-For
+        """
+        self.ip_limiter = ip_limiter
+        self.client_limiter = client_limiter
+        self.max_field_chars = max_field_chars
+        self.max_history_messages = max_history_messages
+        self.max_history_chars = max_history_chars
+        self.forwarded_hops = forwarded_hops
+
+    def client_ip(self, scope, headers):
+        if self.forwarded_hops:
+            forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1").split(",")
+            if len(forwarded) >= self.forwarded_hops and forwarded[-self.forwarded_hops].strip():
+                return forwarded[-self.forwarded_hops].strip()
+        client = scope.get("client")
+        return client[0] if client else "-"
+
+    @staticmethod
+    def client_key(ip, extension_id):
+        if not EXTENSION_ID.match(extension_id or ""):
+            extension_id = "-"
+        return f"{ip}|{extension_id}"
+
+    def retry_after(self, endpoint, ip, client_key):
+        """Count one request; 0 if allowed, else whole seconds the client should wait
+
+        Both limits are checked before either is counted, so a request the
+        IP limit turns away doesn't also use up the client's own budget.
+        """
+        now = time.monotonic()
+        checks = (("client", self.client_limiter, client_key), ("ip", self.ip_limiter, ip))
+        # Client first, so one client hammering away is reported against its own limit
+        for limit, limiter, key in checks:
+            retry_after = limiter.check(key, now)
+            if retry_after:
+                metrics.rate_limited_total.inc(endpoint, limit)
+                logger.debug("rate limited", extra={"endpoint": endpoint, "limit": limit, "client": client_key})
+                return max(1, math.ceil(retry_after))
+        for _, limiter, key in checks:
+            limiter.record(key, now)
+        return 0
+
+    def oversized_field(self, data):
+        """Name of the first field of a parsed request over its limit, or None"""
+        if not isinstance(data, dict):
+            return None
+        for field, max_chars in self.max_field_chars.items():
+            value = data.get(field)
+            if isinstance(value, str) and len(value) > max_chars:
+                return field
+        history = data.get("conversation_history")
+        if isinstance(history, list):
+            if len(history) > self.max_history_messages:
+                return "conversation_history"
+            chars = sum(len(msg.get("content") or "") for msg in history
+                        if isinstance(msg, dict) and isinstance(msg.get("content"), str))
+            if chars > self.max_history_chars:
+                return "conversation_history"
+        return None
+
+
+class RequestGuard:
+    def __init__(self, app, limited_paths, limits, max_body_bytes):
+        """
+        limited_paths: paths that are rate limited and have their bodies checked
+        limits:        the ClientLimits to apply to them
+        """
+        self.app = app
+        self.limited_paths = frozenset(limited_paths)
+        self.limits = limits
+        self.max_body_bytes = max_body_bytes
+        self.too_large = json_response(413, "Request too large")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            await self.respond(send, *self.too_large)
+            return
+
+        path = scope["path"]
+        if path not in self.limited_paths or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        ip = self.limits.client_ip(scope, headers)
+        client_key = self.limits.client_key(ip, headers.get(b"x-extension-id", b"").decode("latin-1"))
+        retry_after = self.limits.retry_after(path, ip, client_key)
+        if retry_after:
+            seconds = str(retry_after).encode("latin-1")
+            await self.respond(send, *json_response(429, "Too many requests", [(b"retry-after", seconds)]))
+            return
+
+        body = await self.read_body(receive)
+        if body is None:
+            metrics.oversized_requests_total.inc(path, "body")
+            await self.respond(send, *self.too_large)
+            return
+
+        field = self.oversized_field(body)
+        if field:
+            metrics.oversized_requests_total.inc(path, field)
+            await self.respond(send, *json_response(413, f"{field} too large"))
+            return
+
+        client_key_var.set(client_key)
+        await self.app(scope, self.replay(body, receive), send)
+
+    async def read_body(self, receive):
+        """The whole request body, or None once it passes max_body_bytes (chunked uploads too)"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    def oversized_field(self, body):
+        """Name of the first field over its limit, or None; malformed JSON is left for FastAPI to reject"""
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        return self.limits.oversized_field(data)
+
+    @staticmethod
+    def replay(body, receive):
+        """receive() for the app: the body already read, then the real channel (disconnects)"""
+        sent = False
+
+        async def replayed():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replayed
+
+    @staticmethod
+    async def respond(send, status, headers, body):
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,90 @@
+"""
+Per-request trace for the Lil IVR backend.
+
+A RequestTrace gives each request an id (stamped on every log line it
+produces), collects stage timings and the path the request took through
+the chat pipeline (e.g. whether web search finished inside its latency
+budget), and logs them as one structured line when the request is done.
+The same numbers feed the /metrics counters and histograms.
+"""
+
+import contextvars
+import time
+import uuid
+
+import metrics
+from bot_logging import get_logger, start_request
+
+logger = get_logger("trace")
+
+# Set by MarkRequestReceived when a request arrives, so the time spent
+# reading and validating the body shows up as the "parse" stage
+request_received_var = contextvars.ContextVar("request_received", default=None)
+
+
+class MarkRequestReceived:
+    """Outermost ASGI middleware that sets request_received_var"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            request_received_var.set(time.perf_counter())
+        await self.app(scope, receive, send)
+
+
+class RequestTrace:
+    def __init__(self, endpoint):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.endpoint = endpoint
+        self.stages = {}
+        self.tags = {}
+        self.finished = False
+        start_request(self.request_id)
+        metrics.requests_in_flight.inc(endpoint)
+
+        received = request_received_var.get()
+        self.started = received if received is not None else time.perf_counter()
+        if received is not None:
+            self.mark("parse", received)
+
+    def mark(self, stage, started):
+        """Record how long a stage took, given its perf_counter() start time"""
+        self.stages[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+    def tag(self, key, value):
+        self.tags[key] = value
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def outcome(self):
+        if "error" in self.tags:
+            return "error"
+        if self.tags.get("path") == "degraded":
+            return "degraded"
+        if "search" in self.tags:
+            return "web-search"
+        return self.tags.get("path", "ok")
+
+    def log(self):
+        if self.finished:
+            return
+        self.finished = True
+        total_ms = self.elapsed_ms()
+
+        metrics.requests_in_flight.dec(self.endpoint)
+        metrics.requests_total.inc(self.endpoint, self.outcome())
+        metrics.request_seconds.observe(total_ms / 1000, self.endpoint)
+        for stage, ms in self.stages.items():
+            metrics.stage_seconds.observe(ms / 1000, self.endpoint, stage)
+        if "search" in self.tags:
+            metrics.web_search_total.inc(self.tags["search"])
+
+        logger.info("request", extra={
+            "endpoint": self.endpoint,
+            "total_ms": total_ms,
+            "stages": self.stages,
+            **self.tags,
+        })
@@ -2,45 +2,92 @@
 """
 Lil IVR Bot - Backend Startup Script
 
-Simple script to start the FastAPI backend server.
+Production entry point for the FastAPI backend:
+
+    python run.py                 # one worker per available CPU
+    python run.py --workers 2     # or WEB_CONCURRENCY=2
+    python run.py --dev           # single process with auto-reload
+
+Dependencies are installed separately (npm run install:backend), not on
+every start. uvloop and httptools are used when installed (they come with
+uvicorn[standard]). On SIGTERM or Ctrl+C each worker stops accepting
+connections, gives open requests and in-flight OpenAI calls up to
+GRACEFUL_SHUTDOWN_TIMEOUT seconds to finish, then exits. Load balancers
+should route to a worker once GET /ready answers 200, which is after the
+lyrics and links have loaded. Push channel WebSockets (/ws) are closed
+with 1012 on shutdown and the extension reconnects to another worker.
+
+Host, port and everything else come from settings.py.
 """
 
+import argparse
+import importlib.util
 import os
 import sys
-import subprocess
 
-def main():
-    print("🎤 Starting Lil IVR Bot Backend...")
+import uvicorn
 
-    # Check if .env file exists
-    env_file = os.path.join(os.path.dirname(__file__), "../.env")
-    if not os.path.exists(env_file):
-        print("❌ .env file not found! Please create .env with your OPENAI_API_KEY")
-        sys.exit(1)
+from settings import settings
 
-    # Install dependencies
-    print("📦 Installing Python dependencies...")
-    try:
-        subprocess.run([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"],
-                      check=True, cwd=os.path.dirname(__file__))
-    except subprocess.CalledProcessError:
-        print("❌ Failed to install dependencies. Please check requirements.txt")
-        sys.exit(1)
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
 
-    # Start the FastAPI server
-    print("🚀 Starting FastAPI server on http://localhost:8000")
-    print("💡 Press Ctrl+C to stop the server")
-    print("")
 
+def available_cpus():
     try:
-        subprocess.run([sys.executable, "-m", "uvicorn", "main:app",
-                       "--reload", "--host", "0.0.0.0", "--port", "8000"],
-                      cwd=os.path.dirname(__file__))
-    except KeyboardInterrupt:
-        print("\n👋 Backend stopped")
-    except Exception as e:
-        print(f"❌ Error starting server: {e}")
+        # Respects taskset/cgroup CPU pinning, unlike os.cpu_count()
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Lil IVR Bot backend")
+    parser.add_argument("--workers", type=int, default=settings.web_concurrency or available_cpus(),
+                        help="worker processes (default: WEB_CONCURRENCY or the CPU count)")
+    parser.add_argument("--host", default=settings.host)
+    parser.add_argument("--port", type=int, default=settings.port)
+    parser.add_argument("--dev", action="store_true", help="one process that reloads on code changes")
+    args = parser.parse_args()
+
+    if not settings.openai_api_key:
+        print("❌ OPENAI_API_KEY is not set. Put it in .env or the environment")
         sys.exit(1)
 
+    workers = 1 if args.dev else max(1, args.workers)
+    loop = "uvloop" if installed("uvloop") else "asyncio"
+    http = "httptools" if installed("httptools") else "h11"
+    print(f"🎤 Starting Lil IVR Bot Backend on http://{args.host}:{args.port} "
+          f"({workers} worker{'s' if workers != 1 else ''}, {loop}, {http}{', reload' if args.dev else ''})")
+
+    uvicorn.run(
+        "main:app",
+        app_dir=BACKEND_DIR,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        reload=args.dev,
+        reload_dirs=[BACKEND_DIR] if args.dev else None,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=int(settings.graceful_shutdown_timeout),
+        log_level=settings.log_level.lower(),
+        # Every request is already logged as one JSON line by RequestTrace
+        access_log=False,
+        # Push channel sockets are mostly idle: no per-connection deflate
+        # context, small receive buffers, and no ping task (the extension
+        # sends keepalives and the push hub closes silent sockets). The
+        # wsproto implementation would ignore the size and queue limits.
+        ws="websockets",
+        ws_max_size=settings.max_request_bytes,
+        ws_max_queue=4,
+        ws_ping_interval=None,
+        ws_per_message_deflate=False,
+    )
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
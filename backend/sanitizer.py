@@ -0,0 +1,210 @@
+"""
+Output sanitizer for model replies (and URL stripping for user messages).
+
+The persona rules the system prompt asks for (no links, no emojis, no
+dashes) are enforced here instead of trusting the model. One pattern is
+compiled per Sanitizer when it is built, with an alternative for each
+thing that gets rewritten:
+
+- URLs (any scheme://...) are dropped unless their host is on the
+  allowlist (SoundCloud for replies, so Lil IVR can still link his songs),
+- emoji runs are dropped,
+- dashes become a comma when they separate clauses ("yo - bror" ->
+  "yo, bror") and a space inside words ("LoL-rank" -> "LoL rank");
+  hyphens in front of digits (scores, ranges, negative numbers) stay,
+- whitespace runs collapse to one space.
+
+clean() makes one left-to-right scan over the text. The pattern starts
+with a lookahead on the characters an item can start with (":" of
+"://", emojis, dashes, whitespace other than a single space), so plain
+words are skipped inside the regex engine and only the matches go
+through Python. A removed item takes the whitespace in front of it
+along, which keeps the spacing right without a second whitespace pass.
+
+stream() gives an incremental sanitizer for streamed replies. Text is
+released up to the last point where a word ends and whitespace starts,
+since nothing matched can span that point: a URL, emoji or dash split
+across chunks is held back until it is complete. Most chunks are plain
+words and single spaces; when the held-back text has nothing a pattern
+item starts with, it is released as it is, without a scan. Everything
+returned by feed() and flush() joined together is the same text clean()
+gives for the whole reply.
+"""
+
+import re
+
+EMOJI = (
+    "\U0001F000-\U0001FAFF"  # pictographs, emoticons, transport, flags, skin tones
+    "\u2300-\u23FF"  # watches, hourglasses, media controls
+    "\u2600-\u27BF"  # misc symbols and dingbats
+    "\u2B00-\u2BFF"  # arrows, stars
+    "\uFE0E\uFE0F\u200D\u20E3"  # variation selectors, zero-width joiner, keycap
+    "\U000E0020-\U000E007F"  # tag sequences (subdivision flags)
+)
+
+DASHES = "\u2010-\u2015\u2212"  # hyphen, figure/en/em dashes, horizontal bar, minus
+
+# \s without the plain space: tabs, newlines and the Unicode spaces
+OTHER_SPACES = "\t\n\x0b\x0c\r\x1c-\x1f\x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000"
+
+# Where a dash after them needs no comma of its own
+CLAUSE_END = frozenset(",.;:!?(")
+
+
+class Sanitizer:
+    def __init__(self, allowed_hosts=(), emoji=True, dashes=True):
+        """
+        allowed_hosts: URL hosts (and their subdomains) that are kept
+        emoji:         drop emojis
+        dashes:        rewrite dashes and hyphens
+        """
+        items = [r"(?P<url>(?<=\w)://\S+)"]
+        heads = [r"\w+://\S"]
+        starts = ":"
+        if emoji:
+            items.append(f"(?P<emoji>[{EMOJI}]+)")
+            heads.append(f"[{EMOJI}]")
+            starts += EMOJI
+        if dashes:
+            items.append(f"(?P<dash>(?:[{DASHES}]|-(?!\\d))+)")
+            heads.append(f"[{DASHES}]|-(?!\\d)")
+            starts += DASHES + "-"
+        # A whitespace run in front of an item goes with the item (see scan)
+        items.append(rf"(?P<space>\s+(?!\s|{'|'.join(heads)}))")
+        # Only tried where something may need rewriting, so words and single spaces
+        # are skipped quickly; runs of plain spaces are rare enough to get their own pattern
+        items = "|".join(items)
+        self.pattern = re.compile(rf"(?=[{OTHER_SPACES}{starts}])(?:{items})")
+        self.spaced_pattern = re.compile(rf"(?=[\s{starts}])(?:{items})")
+        # Text without any of these, and without two spaces in a row, comes out of scan() unchanged
+        self.triggers = re.compile(rf"[{OTHER_SPACES}{starts}]")
+
+        # The host must be followed by a port, a path/query/fragment or the end, so
+        # userinfo ("soundcloud.com:x@evil.com") and longer hosts don't pass as allowed
+        hosts = "|".join(re.escape(host) for host in allowed_hosts)
+        self.allowed_url = (re.compile(rf"https?://(?:[\w-]+\.)*(?:{hosts})(?::\d+)?(?:[/?#]|$)", re.I)
+                            if hosts else None)
+
+    def clean(self, text):
+        return self.scan(text).strip()
+
+    def stream(self):
+        return SanitizerStream(self)
+
+    def scan(self, text, start=0):
+        """text[start:] rewritten; text[:start] is only context for the first match"""
+        pattern = self.spaced_pattern if "  " in text else self.pattern
+        first = pattern.search(text, start)
+        if not first:
+            return text[start:] if start else text
+        out = []
+        last = start
+        for match in pattern.finditer(text, first.start()):
+            begin = match.start()
+            kind = match.lastgroup
+            if kind == "url":
+                # The match starts at "://"; the scheme is the word in front of it
+                while begin > last and (text[begin - 1].isalnum() or text[begin - 1] == "_"):
+                    begin -= 1
+            item = begin
+            while begin > last and text[begin - 1].isspace():
+                begin -= 1
+            out.append(text[last:begin])
+            out.append(self.replace(match, text[item:match.end()], begin < item, begin))
+            last = match.end()
+        out.append(text[last:])
+        return "".join(out)
+
+    def replace(self, match, found, lead, begin):
+        """found is the matched item, lead whether whitespace came before it (from begin on)"""
+        kind = match.lastgroup
+        if kind == "space":
+            return " "
+
+        string = match.string
+        after = string[match.end()] if match.end() < len(string) else ""
+
+        if kind == "url":
+            if self.allowed_url and self.allowed_url.match(found):
+                return " " + found if lead else found
+        elif kind == "dash":
+            before = string[begin - 1] if begin else ""
+            if before and after and before not in CLAUSE_END:
+                # Spaced or typographic dashes separate clauses; a bare hyphen joins words
+                clause = lead or after.isspace() or found != "-" * len(found)
+                return ("," if clause else "") + ("" if after.isspace() else " ")
+            return "" if after.isspace() or not after else " "
+
+        # Dropped; keep one space if it sat between two words
+        return " " if lead and after and not after.isspace() else ""
+
+
+class SanitizerStream:
+    """Incremental Sanitizer.clean() for text that arrives in chunks"""
+
+    # Up to the last whitespace that directly follows a word character
+    BOUNDARY = re.compile(r".*\w(?=\s)", re.S)
+
+    def __init__(self, sanitizer):
+        self.sanitizer = sanitizer
+        self.pending = ""  # unreleased input, after one character of context once something was released
+        self.skip = 0  # 1 when pending starts with that context character
+        self.space = ""  # trailing output whitespace, sent only if more text follows
+        self.started = False
+        self.plain = True  # pending (after skip) has nothing scan() would rewrite
+        self.find_trigger = sanitizer.triggers.search
+
+    def feed(self, chunk):
+        pending = self.pending + chunk
+        # Only the new chunk is searched; what was pending before has been already
+        if self.plain and not self.find_trigger(chunk) and "  " not in pending:
+            # Plain words and single spaces: no item can end before the last space,
+            # so everything up to it is final as it is, and ends in a non-space
+            cut = pending.rfind(" ")
+            if cut <= self.skip:
+                self.pending = pending
+                return ""
+            text = pending[self.skip:cut]
+            self.pending = pending[cut - 1:]
+            self.skip = 1
+            if self.started:
+                text, self.space = self.space + text, ""
+            else:
+                text = text.lstrip()
+                self.started = True
+            return text
+        match = self.BOUNDARY.match(pending, self.skip)
+        if not match:
+            self.pending = pending
+            self.plain = False
+            return ""
+        cut = match.end()
+        text = self.emit(pending[:cut])
+        self.pending = pending[cut - 1:]
+        self.skip = 1
+        self.plain = not self.find_trigger(self.pending, 1)
+        return text
+
+    def flush(self):
+        text = self.emit(self.pending)
+        self.pending = ""
+        self.skip = 0
+        self.space = ""
+        self.plain = True
+        return text
+
+    def emit(self, ready):
+        return self.output(self.sanitizer.scan(ready, self.skip))
+
+    def output(self, text):
+        """Sanitized text as it goes out: no leading space, trailing space held until more follows"""
+        if not self.started:
+            text = text.lstrip()
+        stripped = text.rstrip()
+        if not stripped:
+            if self.started:
+                self.space += text
+            return ""
+        self.started = True
+        text, self.space = self.space + stripped, text[len(stripped):]
+        return text
@@ -0,0 +1,123 @@
+"""
+Cache for web search answers.
+
+search_web() is the most expensive upstream call per request (a gpt-4o round
+trip), and many users ask the same things ("vad är LiU", "vem är Föset").
+SearchCache sits in front of it with TTL expiry, LRU eviction, in-flight
+deduplication and hit/miss counters. A caller can pass admit(), asked only
+when a question would cost an upstream call, so a per-client search budget
+is spent on misses and not on cached or already running searches.
+
+Entries live in a CacheBackend. InProcessCache keeps them in this worker's
+memory; a shared backend (e.g. Redis) can implement the same two async
+methods so several uvicorn workers see each other's entries.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+def normalize_query(text):
+    """Cache key for a question: lowercase, collapsed whitespace, trailing punctuation dropped.
+
+    Swedish characters (å, ä, ö) are kept as-is so "vad är" and "vad ar"
+    stay different questions.
+    """
+    return " ".join(text.lower().split()).strip(" ?!.")
+
+
+class FetchRefused(Exception):
+    """admit() turned down the upstream fetch a cache miss needed"""
+
+
+class CacheBackend:
+    """Storage interface for SearchCache entries"""
+
+    async def get(self, key):
+        """Return the cached value for key, or None if missing or expired"""
+        raise NotImplementedError
+
+    async def set(self, key, value, ttl):
+        """Store value under key for ttl seconds"""
+        raise NotImplementedError
+
+
+class InProcessCache(CacheBackend):
+    """Bounded in-memory backend with per-entry TTL and LRU eviction"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl):
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class SearchCache:
+    """Read-through cache with in-flight deduplication.
+
+    Concurrent callers asking the same normalized question share one
+    upstream call. The shared fetch runs as its own task, so a caller that
+    gives up early (e.g. a pipelined search missing its latency budget)
+    does not cancel it, and the answer still lands in the cache.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_fetch(self, query, fetch, admit=None):
+        """The answer for query: cached, shared with a running fetch, or fetched.
+
+        admit: callable() -> bool, asked before starting a new fetch; when it
+               returns False, FetchRefused is raised instead
+        """
+        key = normalize_query(query)
+        cached = await self.backend.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            if admit is not None and not admit():
+                raise FetchRefused(query)
+            self.misses += 1
+            task = asyncio.create_task(self._fetch_and_store(key, query, fetch))
+            self.in_flight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, key, query, fetch):
+        try:
+            value = await fetch(query)
+            # Failed searches return None and are not cached
+            if value is not None:
+                await self.backend.set(key, value, self.ttl)
+            return value
+        finally:
+            self.in_flight.pop(key, None)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / lookups if lookups else 0.0
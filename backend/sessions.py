@@ -0,0 +1,173 @@
+"""
+Server-side chat sessions.
+
+In session mode the first /chat call returns a session_id and later calls
+send only the new message; the conversation is kept here instead of being
+sent, validated and thrown away on every turn.
+
+SessionStore is the interface. InMemorySessionStore keeps sessions in this
+worker with idle expiry, LRU eviction and a cap on total stored text.
+KeyValueSessionStore keeps them as Redis lists (redis.asyncio, or a local
+stand-in with the same list commands), so several workers can share
+sessions and turns appended concurrently by them all land.
+"""
+
+import json
+import secrets
+import time
+from collections import OrderedDict, namedtuple
+
+StoredMessage = namedtuple("StoredMessage", ["role", "content"])
+
+# Approximate bookkeeping cost of one stored message beyond its text
+MESSAGE_OVERHEAD_BYTES = 64
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+def message_bytes(message):
+    return len(message.content) + MESSAGE_OVERHEAD_BYTES
+
+
+class SessionStore:
+    """Storage interface for chat sessions"""
+
+    async def create(self, messages=()):
+        """Start a session, optionally seeded with messages; returns its id"""
+        raise NotImplementedError
+
+    async def load(self, session_id):
+        """Return the session's messages, or None if it is unknown or expired"""
+        raise NotImplementedError
+
+    async def append(self, session_id, messages):
+        """Add messages to the end of a session"""
+        raise NotImplementedError
+
+
+class Session:
+    __slots__ = ("messages", "last_used", "size")
+
+    def __init__(self):
+        self.messages = []
+        self.last_used = time.monotonic()
+        self.size = 0
+
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self, idle_ttl=1800, max_sessions=10000, max_bytes=64 * 1024 * 1024, max_messages=100):
+        """
+        idle_ttl:     seconds without a request before a session expires
+        max_sessions: sessions kept before the least recently used is evicted
+        max_bytes:    cap on stored text across all sessions
+        max_messages: messages kept per session (oldest dropped first)
+        """
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.sessions = OrderedDict()  # least recently used first
+        self.total_bytes = 0
+
+    async def create(self, messages=()):
+        self._expire_idle()
+        session_id = new_session_id()
+        self.sessions[session_id] = Session()
+        await self.append(session_id, messages)
+        return session_id
+
+    async def load(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.last_used > self.idle_ttl:
+            self._drop(session_id)
+            return None
+        session.last_used = time.monotonic()
+        self.sessions.move_to_end(session_id)
+        return list(session.messages)
+
+    async def append(self, session_id, messages):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return
+        for message in messages:
+            message = StoredMessage(message.role, message.content)
+            session.messages.append(message)
+            session.size += message_bytes(message)
+            self.total_bytes += message_bytes(message)
+        while len(session.messages) > self.max_messages:
+            dropped = session.messages.pop(0)
+            session.size -= message_bytes(dropped)
+            self.total_bytes -= message_bytes(dropped)
+        session.last_used = time.monotonic()
+        self.sessions.move_to_end(session_id)
+        self._evict()
+
+    def _expire_idle(self):
+        # Sessions are ordered by last use, so expired ones sit at the front
+        cutoff = time.monotonic() - self.idle_ttl
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.last_used > cutoff:
+                break
+            self._drop(session_id)
+
+    def _evict(self):
+        while self.sessions and (len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes):
+            session_id = next(iter(self.sessions))
+            self._drop(session_id)
+
+    def _drop(self, session_id):
+        session = self.sessions.pop(session_id)
+        self.total_bytes -= session.size
+
+
+class KeyValueSessionStore(SessionStore):
+    """Sessions as Redis lists with one JSON [role, content] entry per message.
+
+    client needs async lrange, and pipeline(transaction=True) with rpush,
+    rpushx, ltrim and expire. Appending is one RPUSHX + LTRIM + EXPIRE
+    transaction instead of read, extend, write back, so two turns appended
+    at once to the same session (/chat and a WebSocket turn) both keep
+    their messages. Expiry is left to the store, and every write refreshes
+    the idle TTL. The list starts with an empty entry so a session without
+    messages still exists; trimming drops it once the session is full.
+    """
+
+    def __init__(self, client, idle_ttl=1800, max_messages=100, prefix="lilivr:session-log:"):
+        self.client = client
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.prefix = prefix
+
+    async def create(self, messages=()):
+        session_id = new_session_id()
+        await self._push(session_id, messages, create=True)
+        return session_id
+
+    async def load(self, session_id):
+        entries = await self.client.lrange(self.prefix + session_id, 0, -1)
+        if not entries:
+            return None
+        return [StoredMessage(*json.loads(entry)) for entry in entries if entry]
+
+    async def append(self, session_id, messages):
+        await self._push(session_id, messages, create=False)
+
+    async def _push(self, session_id, messages, create):
+        entries = [json.dumps([m.role, m.content], ensure_ascii=False) for m in messages]
+        if not create and not entries:
+            return
+        key = self.prefix + session_id
+        async with self.client.pipeline(transaction=True) as pipe:
+            if create:
+                pipe.rpush(key, "", *entries)
+            else:
+                # RPUSHX: a session that expired in the meantime stays gone
+                pipe.rpushx(key, *entries)
+            pipe.ltrim(key, -self.max_messages, -1)
+            pipe.expire(key, int(self.idle_ttl))
+            await pipe.execute()
@@ -0,0 +1,185 @@
+"""
+Typed settings for the Lil IVR backend.
+
+Every tunable is a field of Settings, read once from the environment (and
+the repo's .env) when this module is imported and converted to the field's
+type. A bad value stops startup with the variable's name instead of
+failing at the first request that reads it. A field's variable is its
+name upper-cased: search_cache_ttl is SEARCH_CACHE_TTL.
+
+Per-model gateway limits (GPT_4O_RPM, GPT_4O_MINI_TPM, ...) can't be
+fields because the models aren't known up front; model_limit() looks them
+up among the overrides collected at load.
+
+With more than one worker, every worker has its own in-memory sessions,
+caches and rate-limit counters: use SESSION_STORE=redis so sessions follow
+the user, and read the rate limits as per worker.
+"""
+
+import dataclasses
+import os
+import typing
+from typing import Optional
+
+from dotenv import load_dotenv
+
+TRUE_VALUES = {"1", "true", "yes", "on"}
+FALSE_VALUES = {"0", "false", "no", "off", ""}
+
+MODEL_LIMIT_NAMES = ("MAX_CONCURRENCY", "RPM", "TPM")
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    # Server (run.py)
+    host: str = "0.0.0.0"
+    port: int = 8000
+    web_concurrency: int = 0  # worker processes; 0 sizes to the available CPUs
+    graceful_shutdown_timeout: float = 20.0  # seconds to drain requests and LLM calls
+
+    # Logging
+    log_level: str = "INFO"
+    log_payload_sample_rate: float = 0.1
+    log_payload_max_chars: int = 200
+
+    # OpenAI client and upstream gateway (see llm.py)
+    openai_api_key: Optional[str] = None
+    openai_base_url: Optional[str] = None
+    openai_max_connections: int = 100
+    openai_max_keepalive: int = 20
+    openai_max_concurrency: Optional[int] = None  # all models; None keeps each model's default
+    openai_rpm: Optional[float] = None
+    openai_tpm: Optional[float] = None
+    openai_timeout: float = 30.0
+    openai_search_timeout: float = 20.0
+    openai_max_retries: int = 1
+    upstream_max_queue: int = 200
+    upstream_queue_timeout: float = 5.0
+    upstream_breaker_failures: int = 5
+    upstream_breaker_cooldown: float = 15.0
+
+    # Web search. "pipelined" starts the search alongside lyric selection and
+    # prompt assembly and waits at most search_latency_budget seconds for it;
+    # "serial" waits for the search before doing anything else.
+    search_mode: str = "pipelined"
+    search_latency_budget: float = 6.0
+    search_cache_ttl: float = 3600.0
+    search_cache_size: int = 1024
+
+    # Conversation history prompt budget
+    history_max_tokens: int = 1500
+    history_keep_messages: int = 8
+    history_summary_tokens: int = 300
+
+    # Request size limits
+    max_request_bytes: int = 65536
+    max_history_messages: int = 100
+    max_history_chars: int = 40000
+    max_message_chars: int = 2000
+    max_webpage_context_chars: int = 5000
+    max_url_chars: int = 4096
+
+    # Per-client rate limits
+    rate_limit_window: float = 60.0
+    rate_limit_per_client: int = 30
+    rate_limit_per_ip: int = 120
+    rate_limit_searches: int = 6  # gpt-4o web searches per client
+    rate_limit_max_clients: int = 100000
+    forwarded_hops: int = 0  # proxies in front of the server that append to X-Forwarded-For (1 on Render)
+
+    # Server-side sessions
+    session_store: str = "memory"
+    redis_url: str = "redis://localhost:6379/0"
+    session_idle_ttl: float = 1800.0
+    session_max_sessions: int = 10000
+    session_max_bytes: int = 64 * 1024 * 1024
+
+    # Content
+    content_watch_interval: float = 2.0
+    lyric_retrieval_dims: int = 2048
+    lyric_sampler_sessions: int = 4096
+    lyric_context_messages: int = 4
+
+    # Greeting pool
+    greeting_pool_size: int = 6
+    greeting_pool_low_water: int = 2
+    greeting_max_uses: int = 3
+    greeting_pool_warm: bool = False
+
+    # Popup line pool
+    popup_batch_size: int = 50
+    popup_min_lines: int = 10
+    popup_max_age: float = 3600.0
+    popup_max_serves: int = 5000
+
+    # WebSocket push channel (push_channel.py); limits are per worker
+    push_idle_after: float = 60.0  # seconds without activity before a proactive message
+    push_message_interval_min: float = 60.0
+    push_message_interval_max: float = 900.0
+    push_popup_interval_min: float = 5.0
+    push_popup_interval_max: float = 30.0
+    push_recheck_interval: float = 15.0
+    push_client_timeout: float = 60.0  # silent sockets are closed; the extension sends a keepalive every 20s
+    push_max_clients: int = 50000
+
+    # Monitoring and admin
+    event_loop_lag_interval: float = 0.1
+    admin_token: Optional[str] = None
+
+    # <MODEL>_<LIMIT> variables, e.g. {"GPT_4O_RPM": "300"}
+    model_overrides: dict = dataclasses.field(default_factory=dict, metadata={"env": False})
+
+    def __post_init__(self):
+        if self.search_mode not in ("pipelined", "serial"):
+            raise ValueError(f"SEARCH_MODE must be pipelined or serial, not {self.search_mode!r}")
+        if self.session_store not in ("memory", "redis"):
+            raise ValueError(f"SESSION_STORE must be memory or redis, not {self.session_store!r}")
+
+    @classmethod
+    def from_env(cls, environ=None):
+        environ = os.environ if environ is None else environ
+        hints = typing.get_type_hints(cls)
+        values = {}
+        for field in dataclasses.fields(cls):
+            if not field.metadata.get("env", True):
+                continue
+            name = field.name.upper()
+            if name in environ:
+                values[field.name] = _convert(name, environ[name], hints[field.name])
+
+        limit_suffixes = tuple("_" + limit for limit in MODEL_LIMIT_NAMES)
+        values["model_overrides"] = {key: value for key, value in environ.items()
+                                     if key.endswith(limit_suffixes) and not key.startswith("OPENAI_") and value}
+        return cls(**values)
+
+    def model_limit(self, model, name, default):
+        """A gateway limit for model: <MODEL>_<NAME>, then OPENAI_<NAME>, then default"""
+        prefix = model.upper().replace("-", "_").replace(".", "_")
+        override = self.model_overrides.get(f"{prefix}_{name}")
+        if override is not None:
+            return _convert(f"{prefix}_{name}", override, float)
+        shared = getattr(self, f"openai_{name.lower()}")
+        return default if shared is None else shared
+
+
+def _convert(name, raw, kind):
+    if typing.get_origin(kind) is typing.Union:
+        # Optional[X]: an empty variable means unset
+        if raw == "":
+            return None
+        kind = next(arg for arg in typing.get_args(kind) if arg is not type(None))
+    try:
+        if kind is bool:
+            lowered = raw.strip().lower()
+            if lowered in TRUE_VALUES:
+                return True
+            if lowered in FALSE_VALUES:
+                return False
+            raise ValueError(raw)
+        return kind(raw)
+    except ValueError:
+        raise ValueError(f"{name}={raw!r} is not a valid {kind.__name__}") from None
+
+
+load_dotenv()
+settings = Settings.from_env()
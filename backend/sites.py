@@ -0,0 +1,87 @@
+"""
+Site labels for /analyze-webpage.
+
+The greeting mentions where the user is ("YouTube", "en ny flik", ...).
+Known sites and their labels live in sites.txt. A SiteClassifier parses
+the URL once and walks the host's labels from the right through a suffix
+trie, so "music.youtube.com" is YouTube while "netflix.com" is not
+Twitter/X and a "google" in the query string is not Google. chrome://
+pages have their own trie keyed by page name, with chrome:// alone as the
+label for any other Chrome page.
+
+Unknown sites are labelled by their hostname. Results are memoized per
+host in a bounded LRU, so repeated popups on the same site skip the walk.
+"""
+
+import os
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+SITES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sites.txt")
+
+# No URL at all, and a URL without a host to name
+DEFAULT_LABEL = "en webbsida"
+UNKNOWN_LABEL = "den här webbsidan"
+
+WEB_SCHEMES = ("http", "https")
+
+LABEL = ""  # trie key for the label of the host ending here; never a host label itself
+
+
+class SiteClassifier:
+    def __init__(self, sites, max_hosts=4096):
+        """
+        sites:     (site, label) pairs; a site is a host ("youtube.com") or a
+                   Chrome page ("chrome://settings", "chrome://" for all of them)
+        max_hosts: hosts whose label is memoized
+        """
+        self.tries = {}  # scheme -> trie of reversed host labels
+        self.labels = []
+        for site, label in sites:
+            scheme, _, host = site.rpartition("://")
+            for trie_scheme in (scheme,) if scheme else WEB_SCHEMES:
+                node = self.tries.setdefault(trie_scheme, {})
+                for part in reversed(host.split(".")) if host else ():
+                    node = node.setdefault(part, {})
+                node[LABEL] = label
+            if label not in self.labels:
+                self.labels.append(label)
+        self.lookup = lru_cache(maxsize=max_hosts)(self._lookup)
+
+    @classmethod
+    def load(cls, path=SITES_FILE, **kwargs):
+        """Read "<site> <label>" lines, skipping blank lines and # comments"""
+        sites = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    site, label = line.split(None, 1)
+                    sites.append((site.lower(), label))
+        return cls(sites, **kwargs)
+
+    def classify(self, url):
+        """The label for url: a known site's, else its hostname"""
+        if not url:
+            return DEFAULT_LABEL
+        try:
+            parts = urlsplit(url.strip())
+            if not parts.scheme and not parts.netloc:
+                # A bare host ("youtube.com/watch")
+                parts = urlsplit("//" + url.strip())
+            host = parts.hostname
+        except ValueError:
+            return UNKNOWN_LABEL
+        return self.lookup(parts.scheme.lower() or "https", (host or "").rstrip("."))
+
+    def _lookup(self, scheme, host):
+        node = self.tries.get(scheme)
+        if node is None:
+            return host or UNKNOWN_LABEL
+        label = node.get(LABEL)
+        for part in reversed(host.split(".")) if host else ():
+            node = node.get(part)
+            if node is None:
+                break
+            label = node.get(LABEL, label)
+        return label or host or UNKNOWN_LABEL
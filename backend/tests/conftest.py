@@ -0,0 +1,6 @@
+"""The backend modules import each other by bare name, as uvicorn runs them from backend/"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
@@ -0,0 +1,44 @@
+import os
+
+from content import ContentRegistry
+from format_lyrics import build
+
+
+def write(path, text, mtime_ns=None):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def all_lines(registry):
+    index = registry.snapshot().index
+    return [index.line(i) for i in range(index.line_count)]
+
+
+def test_source_edits_reload_even_with_a_built_corpus(tmp_path):
+    lyrics_dir = tmp_path / "lyrics"
+    lyrics_dir.mkdir()
+    song = lyrics_dir / "down.txt"
+    write(song, "Armen är du där, kommer ta dig bakifrån jag svär\n")
+    links_file = tmp_path / "song_links.txt"
+    write(links_file, "")
+    build_dir = tmp_path / "build"
+    summary = build(str(lyrics_dir), str(links_file), str(build_dir), workers=1)
+
+    registry = ContentRegistry(corpus_file=summary["corpus"], lyrics_dir=str(lyrics_dir), links_file=str(links_file),
+                               persona_file=summary["persona"])
+    assert all_lines(registry) == ["Armen är du där, kommer ta dig bakifrån jag svär"]
+    assert not registry.reload_if_changed()
+
+    # Edited after the build: served from the source until the corpus is rebuilt
+    later = os.stat(summary["corpus"]).st_mtime_ns + 10**9
+    write(song, "Helt ny rad som ingen har byggt än, bror\n", mtime_ns=later)
+    assert registry.reload_if_changed()
+    assert all_lines(registry) == ["Helt ny rad som ingen har byggt än, bror"]
+
+    build(str(lyrics_dir), str(links_file), str(build_dir), workers=1)
+    os.utime(summary["corpus"], ns=(later + 10**9, later + 10**9))
+    assert registry.reload_if_changed()
+    assert all_lines(registry) == ["Helt ny rad som ingen har byggt än, bror"]
+    assert not registry._sources_changed_since_build(registry.snapshot().signature)
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from corpus import build_index, parse_song_links, read_corpus
+from format_lyrics import build
+
+SONGS = {
+    "down.txt": "# aliases: du o jag\n[Vers 1]\nArmen är du där, där? Kommer ta dig bakifrån jag svär.\n"
+                "Du borde veta att dem där skinkorna är rätt så heta\nkort\nrad\n",
+    "watcha_say.txt": "# title: Watcha Say\n# aliases: vad har jag gjort\nVad har jag gjort, vad har jag sagt 🤷\n"
+                      "Jag sitter här i studion hela natten lång\n",
+    "edamame.txt": "Edamame på tallriken, soja i glaset, vi kör tills det är slut\n",
+}
+LINKS = 'https://soundcloud.com/lilivr/down "Down"\nhttps://soundcloud.com/lilivr/watcha-say Watcha Say\n'
+
+
+@pytest.fixture
+def sources(tmp_path):
+    lyrics_dir = tmp_path / "lyrics"
+    lyrics_dir.mkdir()
+    for name, text in SONGS.items():
+        (lyrics_dir / name).write_text(text, encoding="utf-8")
+    links_file = tmp_path / "song_links.txt"
+    links_file.write_text(LINKS, encoding="utf-8")
+    return str(lyrics_dir), str(links_file), str(tmp_path / "build")
+
+
+def test_built_corpus_loads_the_same_lines_songs_and_aliases(sources):
+    lyrics_dir, links_file, build_dir = sources
+    summary = build(lyrics_dir, links_file, build_dir, workers=1)
+    assert summary["compiled"]
+
+    index, links = read_corpus(summary["corpus"])
+
+    formatted_dir = os.path.join(build_dir, "lyrics")
+    songs = []
+    for name in sorted(SONGS):
+        with open(os.path.join(formatted_dir, name), encoding="utf-8") as f:
+            songs.append((name[:-len(".txt")], f.read()))
+    expected_links = parse_song_links(LINKS)
+    expected = build_index(songs, expected_links)
+
+    assert index.line_count == expected.line_count > 0
+    assert [index.line(i) for i in range(index.line_count)] == [expected.line(i) for i in range(expected.line_count)]
+    assert index.aliases == expected.aliases
+    assert "du o jag" in index.aliases and "vad har jag gjort" in index.aliases
+    assert [dict(link) for link in links] == [dict(link) for link in expected_links]
+    for name, song in expected.songs.items():
+        loaded = index.songs[name]
+        assert (loaded.title, loaded.first, loaded.end) == (song.title, song.first, song.end)
+        assert index.song_lines(name) == expected.song_lines(name)
+        assert (dict(loaded.link) if loaded.link else None) == (dict(song.link) if song.link else None)
+
+
+def test_truncated_corpus_is_rejected(sources):
+    lyrics_dir, links_file, build_dir = sources
+    path = build(lyrics_dir, links_file, build_dir, workers=1)["corpus"]
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:-10])
+    with pytest.raises(ValueError):
+        read_corpus(path)
@@ -0,0 +1,102 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from gateway import CircuitBreaker, ModelLane, UpstreamUnavailable
+
+
+def make_lane(max_concurrency=1, max_queue=1, breaker=None):
+    return ModelLane("gpt-4o-mini", max_concurrency, max_queue, rpm=600, tpm=600_000,
+                     breaker=breaker or CircuitBreaker(failure_threshold=2, cooldown=15.0))
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=15.0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    # Cooldown over: exactly one probe, the rest still turned away
+    breaker.opened_at -= breaker.cooldown
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    # A failed probe reopens at once, without counting up to the threshold again
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    breaker.opened_at -= breaker.cooldown
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow() and breaker.allow()
+
+
+def test_cancelled_probe_hands_the_probe_to_the_next_caller():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=15.0)
+    breaker.record_failure()
+    breaker.opened_at -= breaker.cooldown
+    assert breaker.allow()
+    breaker.cancel_probe()
+    assert breaker.allow()
+
+
+def test_open_breaker_turns_calls_away():
+    async def run():
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=15.0)
+        breaker.record_failure()
+        with pytest.raises(UpstreamUnavailable) as error:
+            await make_lane(breaker=breaker).acquire(10, time.monotonic() + 1)
+        assert error.value.reason == "circuit_open"
+
+    asyncio.run(run())
+
+
+def test_queued_calls_give_up_at_their_deadline():
+    async def run():
+        lane = make_lane(max_concurrency=1, max_queue=1)
+        await lane.acquire(10, time.monotonic() + 1)
+
+        waiter = asyncio.create_task(lane.acquire(10, time.monotonic() + 0.05))
+        await asyncio.sleep(0)
+        assert lane.waiting == 1
+        # The queue holds one; the next caller is turned away without waiting
+        with pytest.raises(UpstreamUnavailable) as error:
+            await lane.acquire(10, time.monotonic() + 1)
+        assert error.value.reason == "queue_full"
+
+        with pytest.raises(UpstreamUnavailable) as error:
+            await waiter
+        assert error.value.reason == "deadline"
+        assert lane.waiting == 0
+
+        # The slot is free again once the holder releases it
+        lane.release()
+        await lane.acquire(10, time.monotonic() + 1)
+        assert lane.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_chat_sends_a_canned_reply_when_upstream_is_unavailable(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    import main
+
+    attempts = []
+
+    async def unavailable(**kwargs):
+        attempts.append(kwargs["model"])
+        raise UpstreamUnavailable(kwargs["model"], "circuit_open")
+
+    monkeypatch.setattr(main, "create_completion", unavailable)
+    # Skip the random insult so the message reaches the model
+    monkeypatch.setattr(random, "randint", lambda low, high: high)
+
+    reply = asyncio.run(main.chat(main.ChatMessage(message="hej hur mår du")))
+    assert attempts == ["gpt-4o-mini"]
+    assert reply.response
+    assert not reply.includes_lyric
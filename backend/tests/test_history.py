@@ -0,0 +1,45 @@
+from history import HistoryManager
+from sessions import StoredMessage
+
+GREETING = StoredMessage("assistant", "Yo bror, vad händer?")
+
+
+def conversation(*turns):
+    history = [GREETING]
+    for user, reply in turns:
+        history += [StoredMessage("user", user), StoredMessage("assistant", reply)]
+    return history
+
+
+def summary_text(messages):
+    return messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+
+
+def test_conversations_with_the_same_opening_keep_separate_summaries():
+    manager = HistoryManager(keep_messages=2)
+    opening = ("hej", "tja")
+    alice = conversation(opening, ("mitt personnummer är 900101-1234", "okej"), ("vad gör du", "chillar"))
+    bob = conversation(opening, ("gillar du pizza", "nej"), ("varför inte", "för att"))
+
+    assert "900101-1234" in summary_text(manager.compact(alice))
+    bob_summary = summary_text(manager.compact(bob))
+    assert "pizza" in bob_summary
+    assert "900101-1234" not in bob_summary
+
+    # A later turn extends each conversation's own summary
+    alice_summary = summary_text(manager.compact(alice + conversation(("och sen", "inget"))[1:]))
+    assert "900101-1234" in alice_summary and "pizza" not in alice_summary
+
+
+def test_sessions_with_the_same_opening_keep_separate_summaries():
+    manager = HistoryManager(keep_messages=2)
+    alice = conversation(("hej", "tja"), ("min adress är storgatan 1", "okej"), ("vad gör du", "chillar"))
+    bob = conversation(("hej", "tja"), ("gillar du pizza", "nej"), ("varför inte", "för att"))
+
+    manager.compact(alice, session_key="alice")
+    bob_summary = summary_text(manager.compact(bob, session_key="bob"))
+    assert "storgatan" not in bob_summary
+
+    # A session whose history no longer matches its summary starts over
+    rewritten = summary_text(manager.compact(bob, session_key="alice"))
+    assert "storgatan" not in rewritten and "pizza" in rewritten
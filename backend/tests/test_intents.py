@@ -0,0 +1,31 @@
+from intents import IntentMatcher
+
+matcher = IntentMatcher({"down": "down.txt", "john": "john_henriksson.txt", "john henriksson": "john_henriksson.txt"})
+
+
+def test_song_names_only_match_whole_words():
+    assert matcher.match("spela down").songs == ["down.txt"]
+    assert matcher.match("down!").songs == ["down.txt"]
+    assert matcher.match("kan du download den").songs == []
+    assert matcher.match("sundown är nice").songs == []
+    assert matcher.match("johnny är här").songs == []
+
+
+def test_longest_song_alias_wins_and_songs_are_listed_once():
+    intents = matcher.match("John Henriksson och down, sen john igen")
+    assert intents.songs == ["john_henriksson.txt", "down.txt"]
+    assert intents.song == "john_henriksson.txt"
+
+
+def test_keywords_only_match_whole_words():
+    assert matcher.match("vad är LiU?").needs_web_search
+    assert not matcher.match("somewhere over the rainbow").needs_web_search
+    assert matcher.match("ge mig en rad från down").asking_for_lyrics
+    assert not matcher.match("radiohead är bäst").asking_for_lyrics
+
+
+def test_popup_commands_and_inflections():
+    intents = matcher.match("snälla stäng av popupsen")
+    assert intents.disable_popups and intents.popup_request
+    intents = matcher.match("säg nåt töntigt")
+    assert intents.popup_request and not intents.disable_popups
@@ -0,0 +1,72 @@
+import asyncio
+import json
+
+from starlette.requests import Request
+
+from message_pool import PROACTIVE_MESSAGES, MessagePool
+
+
+class FakeIndex:
+    songs = {"down.txt": ["första raden", "andra raden", "tredje raden"]}
+
+    def song_lines(self, name):
+        return self.songs.get(name, [])
+
+    def title(self, name):
+        return name.removesuffix(".txt").title()
+
+
+LINKS = [{"filename": "down.txt", "url": "https://soundcloud.com/lilivr/down"},
+         {"filename": None, "url": "https://soundcloud.com/lilivr/ny"}]
+
+
+def message(pool, i):
+    return json.loads(pool.bodies[i])["message"]
+
+
+def test_seeded_picks_are_deterministic_and_spread_out():
+    pool = MessagePool(FakeIndex(), LINKS)
+    again = MessagePool(FakeIndex(), LINKS)
+    picks = [pool.pick(seed) for seed in range(200)]
+    assert picks == [again.pick(seed) for seed in range(200)]
+    # Neighbouring seeds land on different messages
+    assert len(set(picks)) > 20
+    assert all(0 <= i < len(pool) for i in picks)
+
+
+def test_pool_holds_every_kind_of_message():
+    pool = MessagePool(FakeIndex(), LINKS)
+    messages = [message(pool, i) for i in range(len(pool))]
+    assert set(PROACTIVE_MESSAGES) <= set(messages)
+    assert any('"Down"' in m and "andra raden" in m for m in messages)
+    assert any("https://soundcloud.com/lilivr/ny" in m for m in messages)
+    # Without links only the proactive one-liners are left
+    assert len(MessagePool(FakeIndex(), [])) == len(PROACTIVE_MESSAGES)
+
+
+def test_etag_changes_with_the_message_and_the_content():
+    pool = MessagePool(FakeIndex(), LINKS)
+    assert pool.etag(0) != pool.etag(1)
+    assert pool.etag(0) == MessagePool(FakeIndex(), LINKS).etag(0)
+    assert pool.etag(0) != MessagePool(FakeIndex(), LINKS[:1]).etag(0)
+
+
+def test_seeded_random_message_answers_304_to_its_etag(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    import main
+
+    def get(headers=()):
+        request = Request({"type": "http", "method": "GET", "path": "/random-message", "headers": list(headers)})
+        return asyncio.run(main.get_random_message(request, seed=42))
+
+    first = get()
+    assert first.status_code == 200
+    assert first.headers["cache-control"] == main.RANDOM_MESSAGE_SEEDED_CACHE
+    assert get().body == first.body
+
+    etag = first.headers["etag"]
+    cached = get([(b"if-none-match", etag.encode())])
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+    assert not cached.body
+    assert get([(b"if-none-match", b'"stale-0"')]).status_code == 200
@@ -0,0 +1,30 @@
+from popup_lines import FALLBACK_LINES, MAX_WORDS, clean_popup_line, parse_popup_lines
+
+
+def test_lines_over_six_words_are_dropped():
+    assert clean_popup_line("vad fan är det för fel") == "vad fan är det för fel"
+    assert clean_popup_line("vad fan är det för fel på dig") is None
+    assert len("vad fan är det för fel".split()) == MAX_WORDS
+
+
+def test_lines_with_punctuation_links_or_emojis_are_dropped():
+    for line in ("är du dum?", "kom hit, loser", "sluta nu!", "kolla soundcloud.com/lilivr",
+                 "du suger 😂", "snake_case mes", "ja: nej"):
+        assert clean_popup_line(line) is None, line
+
+
+def test_decoration_is_stripped_and_lines_lowercased():
+    assert clean_popup_line("1. Du Suger") == "du suger"
+    assert clean_popup_line("- “jag är så ensam”") == "jag är så ensam"
+    assert clean_popup_line("• kom igen då losern.") == "kom igen då losern"
+    assert clean_popup_line("  c'mon   fegis  ") == "c'mon fegis"
+    assert clean_popup_line("   ") is None
+
+
+def test_completion_is_parsed_into_distinct_valid_lines():
+    text = "1. du suger\n2. Du suger\n\n3. vad är du för mes?\n4. mår så dåligt\n5. en rad som har alldeles för många ord"
+    assert parse_popup_lines(text) == ["du suger", "mår så dåligt"]
+
+
+def test_builtin_fallback_lines_follow_the_rules():
+    assert all(clean_popup_line(line) == line for line in FALLBACK_LINES)
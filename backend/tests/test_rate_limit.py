@@ -0,0 +1,99 @@
+import asyncio
+import json
+
+import pytest
+
+from rate_limit import ClientLimits, RequestGuard, SlidingWindowLimiter
+
+
+def make_limits(ip_limit, client_limit):
+    return ClientLimits(SlidingWindowLimiter(ip_limit), SlidingWindowLimiter(client_limit),
+                        max_field_chars={"message": 100}, max_history_messages=50, max_history_chars=10_000)
+
+
+def make_guard(limits):
+    """A RequestGuard in front of an app that records the bodies it receives"""
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append((await receive())["body"])
+        await RequestGuard.respond(send, 200, [], b"{}")
+
+    return RequestGuard(app, ["/chat"], limits, max_body_bytes=4000), calls
+
+
+async def post(guard, body):
+    """(status, headers, body) of one POST /chat through guard"""
+    scope = {"type": "http", "method": "POST", "path": "/chat", "client": ("10.0.0.1", 5000),
+             "headers": [(b"x-extension-id", b"extension-one")]}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await guard(scope, receive, send)
+    return sent[0]["status"], dict(sent[0]["headers"]), sent[1]["body"]
+
+
+def test_ip_rejection_does_not_spend_the_client_budget():
+    limits = make_limits(ip_limit=2, client_limit=3)
+    assert limits.retry_after("/chat", "10.0.0.1", "10.0.0.1|neighbour-one") == 0
+    assert limits.retry_after("/chat", "10.0.0.1", "10.0.0.1|neighbour-one") == 0
+    # The shared IP is full; this client's tries are turned away without being counted
+    for _ in range(5):
+        assert limits.retry_after("/chat", "10.0.0.1", "10.0.0.1|client-two") > 0
+    assert limits.client_limiter.counters["10.0.0.1|client-two"][1] == 0
+    assert limits.ip_limiter.counters["10.0.0.1"][1] == 2
+
+
+def test_sliding_window_weights_the_previous_window():
+    limiter = SlidingWindowLimiter(limit=4, window=60.0)
+    for second in range(4):
+        assert limiter.hit("client", now=60.0 + second) == 0
+    # This window alone is full: wait for the next one
+    assert limiter.hit("client", now=90.0) == pytest.approx(30.0)
+
+    # 15s into the next window three quarters of the previous 4 still count, leaving room for one
+    assert limiter.hit("client", now=135.0) == 0
+    assert limiter.hit("client", now=135.0) == pytest.approx(15.0)
+    # Once half of it has slid out, one more fits
+    assert limiter.hit("client", now=150.0) == 0
+    assert limiter.hit("client", now=150.0) > 0
+
+
+def test_keys_idle_for_two_windows_are_swept():
+    limiter = SlidingWindowLimiter(limit=1, window=60.0)
+    limiter.hit("old", now=0.0)
+    limiter.hit("new", now=150.0)
+    assert list(limiter.counters) == ["new"]
+
+
+def test_rejected_requests_get_retry_after_without_reaching_the_app():
+    limits = make_limits(ip_limit=10, client_limit=1)
+    guard, calls = make_guard(limits)
+    assert asyncio.run(post(guard, b'{"message": "hej"}'))[0] == 200
+    status, headers, _ = asyncio.run(post(guard, b'{"message": "hej"}'))
+    assert status == 429
+    assert 1 <= int(headers[b"retry-after"]) <= 60
+    assert calls == [b'{"message": "hej"}']
+
+
+def test_oversized_fields_are_rejected_before_the_app_parses_them():
+    limits = make_limits(ip_limit=10, client_limit=10)
+    guard, calls = make_guard(limits)
+
+    status, _, body = asyncio.run(post(guard, json.dumps({"message": "x" * 101}).encode()))
+    assert (status, json.loads(body)) == (413, {"detail": "message too large"})
+    history = [{"role": "user", "content": "hej"}] * 51
+    status, _, body = asyncio.run(post(guard, json.dumps({"message": "hej", "conversation_history": history}).encode()))
+    assert (status, json.loads(body)) == (413, {"detail": "conversation_history too large"})
+    status, _, _ = asyncio.run(post(guard, b"x" * 5000))
+    assert status == 413
+    assert calls == []
+
+    # Malformed JSON is left for FastAPI to reject
+    assert asyncio.run(post(guard, b"{not json"))[0] == 200
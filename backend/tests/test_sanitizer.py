@@ -0,0 +1,50 @@
+import random
+
+from sanitizer import Sanitizer
+
+SANITIZERS = [
+    Sanitizer(allowed_hosts=("soundcloud.com",)),
+    Sanitizer(emoji=False, dashes=False),
+]
+
+SAMPLES = [
+    "Yo bror 🔥🔥 kolla https://soundcloud.com/lilivr/down – den är sick!!",
+    "asså — jag vet inte   men kolla http://example.com/x?y=1 eller www.google.se\tnu 😂",
+    "ring 070-123 45 67 - eller inte, bror -- whatever 💀\n\nhttps://on.soundcloud.com/abc",
+    "  ledande mellanslag, ftp://host/fil och b://\t och en sista rad  ",
+]
+
+
+def stream_clean(sanitizer, chunks):
+    stream = sanitizer.stream()
+    return "".join(stream.feed(chunk) for chunk in chunks) + stream.flush()
+
+
+def test_streaming_matches_one_shot_at_every_split():
+    for sanitizer in SANITIZERS:
+        for text in SAMPLES:
+            expected = sanitizer.clean(text)
+            for i in range(len(text) + 1):
+                assert stream_clean(sanitizer, [text[:i], text[i:]]) == expected, (text, i)
+            assert stream_clean(sanitizer, list(text)) == expected, text
+
+
+def test_streaming_matches_one_shot_on_random_chunks():
+    rng = random.Random(1)
+    alphabet = "ab ://.-–—\t\n😂🔥soundcloud.comhttps"
+    for sanitizer in SANITIZERS:
+        for _ in range(300):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+            cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(1, 6))))
+            chunks = [text[a:b] for a, b in zip([0, *cuts], [*cuts, len(text)])]
+            assert stream_clean(sanitizer, chunks) == sanitizer.clean(text), (text, chunks)
+
+
+def test_only_allowlisted_hosts_keep_their_links():
+    sanitizer = SANITIZERS[0]
+    assert sanitizer.clean("lyssna https://soundcloud.com/lilivr/down nu") == "lyssna https://soundcloud.com/lilivr/down nu"
+    assert sanitizer.clean("lyssna https://on.soundcloud.com:443/abc") == "lyssna https://on.soundcloud.com:443/abc"
+    assert sanitizer.clean("kolla https://soundcloud.com:x@evil.com/a nu") == "kolla nu"
+    assert sanitizer.clean("kolla https://soundcloud.com@evil.com/a nu") == "kolla nu"
+    assert sanitizer.clean("kolla https://soundcloud.com.evil.com/a nu") == "kolla nu"
+    assert sanitizer.clean("kolla https://evilsoundcloud.com/a nu") == "kolla nu"
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+
+from search_cache import FetchRefused, InProcessCache, SearchCache, normalize_query
+
+
+def test_search_budget_is_only_spent_on_upstream_fetches():
+    async def run():
+        cache = SearchCache(InProcessCache(), ttl=60)
+        budget = [1]
+
+        def admit():
+            budget[0] -= 1
+            return budget[0] >= 0
+
+        async def fetch(query):
+            return f"svar: {query}"
+
+        assert await cache.get_or_fetch("vad är LiU?", fetch, admit) == "svar: vad är LiU?"
+        # Cached: free, even with the budget spent
+        for _ in range(3):
+            assert await cache.get_or_fetch("Vad är LiU", fetch, admit) == "svar: vad är LiU?"
+        assert budget == [0]
+        with pytest.raises(FetchRefused):
+            await cache.get_or_fetch("vem är Föset", fetch, admit)
+
+    asyncio.run(run())
+
+
+def test_questions_share_a_key_after_normalizing():
+    assert normalize_query("  Vad  är LiU?! ") == normalize_query("vad är liu")
+    assert normalize_query("vad är LiU") != normalize_query("vad ar LiU")
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    async def run():
+        now = [1000.0]
+        monkeypatch.setattr(time, "monotonic", lambda: now[0])
+        backend = InProcessCache()
+        await backend.set("liu", "ett universitet", ttl=60)
+        now[0] += 59
+        assert await backend.get("liu") == "ett universitet"
+        now[0] += 1
+        assert await backend.get("liu") is None
+        assert "liu" not in backend.entries
+
+    asyncio.run(run())
+
+
+def test_least_recently_used_entry_is_evicted():
+    async def run():
+        backend = InProcessCache(max_entries=2)
+        await backend.set("a", 1, ttl=60)
+        await backend.set("b", 2, ttl=60)
+        # Reading "a" makes "b" the least recently used
+        assert await backend.get("a") == 1
+        await backend.set("c", 3, ttl=60)
+        assert list(backend.entries) == ["a", "c"]
+        assert await backend.get("b") is None
+
+    asyncio.run(run())
+
+
+def test_concurrent_askers_share_one_fetch():
+    async def run():
+        cache = SearchCache(InProcessCache(), ttl=60)
+        calls = []
+        release = asyncio.Event()
+
+        async def fetch(query):
+            calls.append(query)
+            await release.wait()
+            return f"svar: {query}"
+
+        questions = ("Vem är Föset?", "vem är föset", "VEM ÄR FÖSET!")
+        askers = [asyncio.create_task(cache.get_or_fetch(question, fetch)) for question in questions]
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(*askers) == ["svar: Vem är Föset?"] * 3
+        assert calls == ["Vem är Föset?"]
+        assert (cache.misses, cache.coalesced, cache.hits) == (1, 2, 0)
+        assert not cache.in_flight
+
+        assert await cache.get_or_fetch("vem är föset", fetch) == "svar: Vem är Föset?"
+        assert cache.hits == 1
+        assert cache.hit_ratio() == 0.75
+
+    asyncio.run(run())
+
+
+def test_abandoned_fetch_still_fills_the_cache_and_failures_are_not_cached():
+    async def run():
+        cache = SearchCache(InProcessCache(), ttl=60)
+        answers = {"liu": "ett universitet", "trasig": None}
+
+        async def fetch(query):
+            await asyncio.sleep(0.01)
+            return answers[query]
+
+        # A pipelined search that misses its latency budget gives up on the answer, not the fetch
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(cache.get_or_fetch("liu", fetch), timeout=0.001)
+        await asyncio.sleep(0.02)
+        assert await cache.backend.get("liu") == "ett universitet"
+
+        assert await cache.get_or_fetch("trasig", fetch) is None
+        assert await cache.backend.get("trasig") is None
+
+    asyncio.run(run())
@@ -0,0 +1,81 @@
+import asyncio
+
+from sessions import KeyValueSessionStore, StoredMessage
+
+
+class FakeRedis:
+    """The list commands KeyValueSessionStore uses; every await yields, like a network round trip"""
+
+    def __init__(self):
+        self.lists = {}
+
+    async def lrange(self, key, start, end):
+        await asyncio.sleep(0)
+        values = self.lists.get(key, [])
+        return values[start:len(values) if end == -1 else end + 1]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def rpush(self, key, *values):
+        self.commands.append(lambda lists: lists.setdefault(key, []).extend(values))
+
+    def rpushx(self, key, *values):
+        self.commands.append(lambda lists: lists[key].extend(values) if key in lists else None)
+
+    def ltrim(self, key, start, end):
+        def trim(lists):
+            if key in lists:
+                lists[key] = lists[key][start:len(lists[key]) if end == -1 else end + 1]
+        self.commands.append(trim)
+
+    def expire(self, key, seconds):
+        pass
+
+    async def execute(self):
+        await asyncio.sleep(0)
+        # MULTI/EXEC: the queued commands apply together
+        for command in self.commands:
+            command(self.redis.lists)
+
+
+def test_concurrent_appends_keep_every_message():
+    async def run():
+        store = KeyValueSessionStore(FakeRedis())
+        session_id = await store.create([StoredMessage("assistant", "Yo bror")])
+        await asyncio.gather(
+            store.append(session_id, [StoredMessage("user", "från /chat"), StoredMessage("assistant", "a")]),
+            store.append(session_id, [StoredMessage("user", "från /ws"), StoredMessage("assistant", "b")]),
+        )
+        return await store.load(session_id)
+
+    contents = [message.content for message in asyncio.run(run())]
+    assert contents[0] == "Yo bror"
+    assert sorted(contents[1:]) == ["a", "b", "från /chat", "från /ws"]
+
+
+def test_sessions_keep_their_newest_messages_and_expired_ones_stay_gone():
+    async def run():
+        store = KeyValueSessionStore(FakeRedis(), max_messages=3)
+        empty = await store.create()
+        assert await store.load(empty) == []
+        for i in range(5):
+            await store.append(empty, [StoredMessage("user", str(i))])
+        await store.append("expired", [StoredMessage("user", "hej")])
+        return await store.load(empty), await store.load("expired")
+
+    kept, expired = asyncio.run(run())
+    assert [message.content for message in kept] == ["2", "3", "4"]
+    assert expired is None
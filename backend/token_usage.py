@@ -0,0 +1,64 @@
+"""
+Token accounting for upstream completions.
+
+Every completion reports prompt, cached and completion tokens in its
+`usage` block. TokenAccounting keeps running totals per endpoint so the
+effect of prompt-prefix caching can be read off directly: cached_ratio is
+the share of prompt tokens the provider served from its prefix cache.
+"""
+
+from bot_logging import get_logger
+
+logger = get_logger("tokens")
+
+
+class EndpointUsage:
+    __slots__ = ("calls", "prompt_tokens", "cached_tokens", "completion_tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+        }
+
+
+class TokenAccounting:
+    def __init__(self):
+        self.endpoints = {}
+
+    def record(self, endpoint, usage):
+        """Add one response's usage block to the totals for endpoint"""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+        totals = self.endpoints.get(endpoint)
+        if totals is None:
+            totals = self.endpoints[endpoint] = EndpointUsage()
+        totals.calls += 1
+        totals.prompt_tokens += usage.prompt_tokens or 0
+        totals.cached_tokens += cached
+        totals.completion_tokens += usage.completion_tokens or 0
+
+        logger.debug("token usage", extra={
+            "endpoint": endpoint,
+            "prompt_tokens": usage.prompt_tokens,
+            "cached_tokens": cached,
+            "completion_tokens": usage.completion_tokens,
+        })
+
+    def summary(self):
+        return {endpoint: totals.as_dict() for endpoint, totals in self.endpoints.items()}
+
+
+token_accounting = TokenAccounting()
@@ -1,136 +1,185 @@
 const API_BASE_URL = 'https://lil-ivr-bot.onrender.com';
 
+// One WebSocket to the backend replaces the /random-message polls: the server
+// decides from the state reported here when to push a proactive message or a
+// popup line, and chat turns from the popup (chat.js) go over it too
+const PUSH_CHANNEL_URL = `${API_BASE_URL.replace(/^http/, 'ws')}/ws`;
+const KEEPALIVE_MS = 20000; // the server closes silent sockets; traffic also keeps this worker alive
+const ACTIVITY_REPORT_MS = 10000;
+const MAX_RECONNECT_MS = 60000;
+
 let userState = {
   lastActiveTime: Date.now(),
-  lastNotificationTime: 0,
   isActive: true,
   popupOpen: false,
-  lastPopupPing: 0,
   hasUnreadNotification: false,
   notificationSent: false,
   isPageVisible: true,
-  lastPopupTime: Date.now(),
-  lastChatMessage: Date.now(),
-  nextPopupTime: Date.now() + getRandomPopupInterval(),
   lastChatOpened: Date.now(),
-  nextExclamationTime: Date.now() + getRandomExclamationInterval(),
   lastExclamationMessage: null,
   popupNotificationsEnabled: true
 };
 
-function getRandomPopupInterval() {
-  const minMs = 5000; // 5 seconds
-  const maxMs = 30000; // 30 seconds
-  return Math.floor(Math.random() * (maxMs - minMs + 1)) + minMs;
+let pushSocket = null;
+let pushConnecting = false;
+let keepaliveTimer = null;
+let reconnectTimer = null;
+let reconnectDelay = 1000;
+let lastActivityReport = 0;
+const chatTurns = new Map(); // turn id -> the chat port waiting for its events
+
+// Random id for this install, sent with requests so the backend can rate limit per client.
+// This is the only place it is made: chat.html asks for it through extension-id.js with { action: 'getExtensionId' }
+let extensionIdRequest = null; // one lookup, so callers racing the first install can't make two ids
+function getExtensionId() {
+  if (!extensionIdRequest) {
+    extensionIdRequest = (async () => {
+      const { lilIVRExtensionId } = await chrome.storage.local.get(['lilIVRExtensionId']);
+      if (lilIVRExtensionId) return lilIVRExtensionId;
+      const id = crypto.randomUUID();
+      await chrome.storage.local.set({ lilIVRExtensionId: id });
+      return id;
+    })().catch((error) => {
+      extensionIdRequest = null;
+      throw error;
+    });
+  }
+  return extensionIdRequest;
 }
 
-function getRandomExclamationInterval() {
-  const minMs = 60000; // 1 minute
-  const maxMs = 900000; // 15 minutes
-  return Math.floor(Math.random() * (maxMs - minMs + 1)) + minMs;
+async function connectPushChannel() {
+  if (pushSocket || pushConnecting) return;
+  pushConnecting = true;
+  try {
+    const socket = new WebSocket(`${PUSH_CHANNEL_URL}?client=${encodeURIComponent(await getExtensionId())}`);
+    pushSocket = socket;
+
+    socket.onopen = () => {
+      reconnectDelay = 1000;
+      sendPushState();
+      keepaliveTimer = setInterval(() => sendPushFrame({ type: 'ping' }), KEEPALIVE_MS);
+    };
+
+    socket.onmessage = (event) => {
+      try {
+        handlePushFrame(JSON.parse(event.data));
+      } catch (error) {
+      }
+    };
+
+    socket.onclose = () => {
+      clearInterval(keepaliveTimer);
+      pushSocket = null;
+      // Turns in flight won't finish; the popup shows its error reply
+      for (const [id, port] of chatTurns) {
+        try {
+          port.postMessage({ type: 'error', id, status: 503, detail: 'Connection lost' });
+        } catch (error) {
+        }
+      }
+      chatTurns.clear();
+      scheduleReconnect();
+    };
+  } finally {
+    pushConnecting = false;
+  }
 }
 
-const proactiveMessages = [
-  "Yo bror, vad händer? 🎤",
-  "Har du glömt bort mig eller? 😢",
-  "Skibidi vibes på denna sida, behöver du beats? 🔥",
-  "Asså typ, jag har nya bars att dela! 💯",
-  "Studio-time över, dags att hjälpa dig bror! 🎵",
-  "Heyyo, behöver du hjälp med något? Lil IVR is in the house! 🎤🔥"
-];
-
-function getRandomProactiveMessage() {
-  return proactiveMessages[Math.floor(Math.random() * proactiveMessages.length)];
+function scheduleReconnect() {
+  if (reconnectTimer) return;
+  // Backoff with jitter so a server restart doesn't get every client back at once
+  const delay = reconnectDelay * (0.5 + Math.random());
+  reconnectDelay = Math.min(reconnectDelay * 2, MAX_RECONNECT_MS);
+  reconnectTimer = setTimeout(() => {
+    reconnectTimer = null;
+    connectPushChannel();
+  }, delay);
 }
 
-chrome.tabs.onUpdated.addListener((tabId, changeInfo, tab) => {
-  if (changeInfo.status === 'complete') {
-    userState.lastActiveTime = Date.now();
-    userState.isActive = true;
+function sendPushFrame(frame) {
+  if (!pushSocket || pushSocket.readyState !== WebSocket.OPEN) {
+    return false;
   }
-});
-
-chrome.tabs.onActivated.addListener((activeInfo) => {
-  userState.lastActiveTime = Date.now();
-  userState.isActive = true;
-});
+  pushSocket.send(JSON.stringify(frame));
+  return true;
+}
 
-// Use alarms for reliable timing even when service worker sleeps
-chrome.alarms.create('popupCheck', { periodInMinutes: 0.25 }); // Check every 15 seconds
-chrome.alarms.create('exclamationCheck', { periodInMinutes: 2 }); // Check every 2 minutes
+function sendPushState() {
+  sendPushFrame({
+    type: 'state',
+    visible: userState.isPageVisible,
+    chat_open: userState.popupOpen,
+    popups: userState.popupNotificationsEnabled
+  });
+}
 
-chrome.alarms.onAlarm.addListener((alarm) => {
+function reportActivity() {
   const now = Date.now();
+  userState.lastActiveTime = now;
+  userState.isActive = true;
+  if (now - lastActivityReport >= ACTIVITY_REPORT_MS && sendPushFrame({ type: 'activity' })) {
+    lastActivityReport = now;
+  }
+}
 
-  if (alarm.name === 'popupCheck') {
-    // Check if popup should close
-    if (userState.popupOpen && (now - userState.lastPopupPing > 3000)) {
-      userState.popupOpen = false;
-      broadcastToAllTabs({ action: 'popupStatusChanged', isOpen: false });
+function handlePushFrame(frame) {
+  if (frame.type === 'message') {
+    showPushedMessage(frame.message);
+  } else if (frame.type === 'popup') {
+    if (userState.popupNotificationsEnabled && !userState.popupOpen) {
+      broadcastToAllTabs({ action: 'showNotification', message: frame.message });
     }
-
-    // Send popup notification if conditions are met AND notifications are enabled
-    if (userState.popupNotificationsEnabled && !userState.popupOpen && userState.isPageVisible && userState.hasUnreadNotification && (now >= userState.nextPopupTime)) {
-      const nextInterval = getRandomPopupInterval();
-      sendPopupNotification();
-      userState.lastPopupTime = now;
-      userState.nextPopupTime = now + nextInterval;
+  } else if (chatTurns.has(frame.id)) {
+    // delta, done or error for a chat turn
+    const port = chatTurns.get(frame.id);
+    if (frame.type !== 'delta') {
+      chatTurns.delete(frame.id);
     }
-  } else if (alarm.name === 'exclamationCheck') {
-    // Send exclamation message if conditions are met AND notifications are enabled
-    if (userState.popupNotificationsEnabled && !userState.popupOpen && userState.isPageVisible && (now >= userState.nextExclamationTime)) {
-      checkForNewLilIvrMessage();
-      userState.nextExclamationTime = now + getRandomExclamationInterval();
+    try {
+      port.postMessage(frame);
+    } catch (error) {
     }
   }
-});
+}
 
-async function sendPopupNotification() {
+async function showPushedMessage(message) {
   try {
-    const message = getRandomProactiveMessage();
-    await broadcastToAllTabs({
-      action: 'showNotification',
-      message: message
+    userState.lastExclamationMessage = message;
+    userState.hasUnreadNotification = true;
+    await chrome.storage.session.set({
+      'lilIVRNotification': {
+        message: message,
+        timestamp: Date.now()
+      }
     });
+    updateNotificationBadge();
+    // Tabs with the in-page chatbot show it there
+    broadcastToAllTabs({ action: 'showProactiveMessage', message: message });
   } catch (error) {
   }
 }
 
-async function sendChatMessage() {
-  try {
-    const response = await fetch(`${API_BASE_URL}/random-message`);
-    if (response.ok) {
-      const data = await response.json();
-      await chrome.storage.session.set({
-        'lilIVRNotification': {
-          message: data.message,
-          timestamp: Date.now()
-        }
-      });
-      userState.lastNotificationTime = Date.now();
-    }
-  } catch (error) {
+chrome.tabs.onUpdated.addListener((tabId, changeInfo, tab) => {
+  if (changeInfo.status === 'complete') {
+    reportActivity();
   }
-}
+});
 
-async function checkForNewLilIvrMessage() {
-  try {
-    const response = await fetch(`${API_BASE_URL}/random-message`);
-    if (response.ok) {
-      const data = await response.json();
-      userState.lastExclamationMessage = data.message;
-      userState.hasUnreadNotification = true;
-      await chrome.storage.session.set({
-        'lilIVRNotification': {
-          message: data.message,
-          timestamp: Date.now()
-        }
-      });
-      updateNotificationBadge();
-    }
-  } catch (error) {
+chrome.tabs.onActivated.addListener((activeInfo) => {
+  reportActivity();
+});
+
+// The service worker can be stopped while the socket is down; an alarm wakes
+// it up to reconnect
+chrome.alarms.create('pushChannel', { periodInMinutes: 0.5 });
+
+chrome.alarms.onAlarm.addListener((alarm) => {
+  if (alarm.name === 'pushChannel') {
+    connectPushChannel();
   }
-}
+});
+
+connectPushChannel();
 
 function updateNotificationBadge() {
   try {
@@ -144,14 +193,9 @@ function updateNotificationBadge() {
   }
 }
 
-async function sendProactiveMessage() {
-  // Keep old function for compatibility but not used in new system
-}
-
 // Handle extension icon click - open chat directly
 chrome.action.onClicked.addListener(async (tab) => {
-  userState.lastActiveTime = Date.now();
-  userState.isActive = true;
+  reportActivity();
 
   try {
     // Send message to content script to open chat
@@ -183,37 +227,62 @@ chrome.action.onClicked.addListener(async (tab) => {
 chrome.storage.local.get(['popupNotificationsEnabled'], (result) => {
   if (result.popupNotificationsEnabled !== undefined) {
     userState.popupNotificationsEnabled = result.popupNotificationsEnabled;
+    sendPushState();
   }
 });
 
+// The chat popup holds a port while it's open, so the port's lifetime is the
+// popup's open state, and its chat turns are relayed over the push channel
+chrome.runtime.onConnect.addListener((port) => {
+  if (port.name !== 'chat') return;
+
+  userState.popupOpen = true;
+  userState.notificationSent = false;
+  userState.hasUnreadNotification = false;
+  userState.lastChatOpened = Date.now();
+  reportActivity();
+  updateNotificationBadge();
+  sendPushState();
+  broadcastToAllTabs({ action: 'popupStatusChanged', isOpen: true });
+
+  port.onMessage.addListener((frame) => {
+    if (frame.type !== 'chat') return;
+    if (!sendPushFrame(frame)) {
+      // Status 0: not connected, the popup falls back to HTTP
+      port.postMessage({ type: 'error', id: frame.id, status: 0, detail: 'Push channel not connected' });
+      connectPushChannel();
+      return;
+    }
+    chatTurns.set(frame.id, port);
+  });
+
+  port.onDisconnect.addListener(() => {
+    for (const [id, turnPort] of chatTurns) {
+      if (turnPort === port) {
+        chatTurns.delete(id);
+      }
+    }
+    userState.popupOpen = false;
+    sendPushState();
+    broadcastToAllTabs({ action: 'popupStatusChanged', isOpen: false });
+  });
+});
+
 // Listen for messages from content scripts and popup
 chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
   if (request.action === 'updateActivity') {
-    userState.lastActiveTime = Date.now();
-    userState.isActive = true;
-  } else if (request.action === 'popupOpened') {
-    userState.popupOpen = true;
-    userState.lastPopupPing = Date.now();
-    // Reset notification state when popup opens
-    userState.lastActiveTime = Date.now();
-    userState.notificationSent = false;
-    userState.hasUnreadNotification = false;
-    userState.lastChatMessage = Date.now(); // Reset chat message timer
-    userState.lastChatOpened = Date.now(); // Reset chat opened timer
-    updateNotificationBadge();
-  } else if (request.action === 'popupClosed') {
-    userState.popupOpen = false;
-  } else if (request.action === 'popupPing') {
-    // Keep popup alive signal
-    userState.lastPopupPing = Date.now();
-    sendResponse({ status: 'ok' });
+    reportActivity();
   } else if (request.action === 'pageVisibilityChanged') {
     userState.isPageVisible = request.isVisible;
+    sendPushState();
   } else if (request.action === 'getNotificationState') {
     sendResponse({
       hasUnreadNotification: userState.hasUnreadNotification,
       notificationSent: userState.notificationSent
     });
+  } else if (request.action === 'getExtensionId') {
+    getExtensionId().then((id) => sendResponse({ id }));
+    return true; // answered asynchronously
   } else if (request.action === 'openExtensionPopup') {
     // Note: Cannot programmatically open extension popup in manifest v3
     // User needs to click the extension icon manually
@@ -221,6 +290,7 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
   } else if (request.action === 'updatePopupSettings') {
     // Update popup notification settings
     userState.popupNotificationsEnabled = request.enabled;
+    sendPushState();
 
     // Broadcast to all tabs so they update their state
     broadcastToAllTabs({
@@ -5,9 +5,13 @@ const API_BASE_URL = window.LIL_IVR_CONFIG?.API_BASE_URL || 'http://localhost:80
 class LilIVRChat {
   constructor() {
     this.messages = [];
+    this.sessionId = null; // server-side session, so only new messages are sent
+    this.sessionSynced = 0; // how many of this.messages the server session already has
     this.isTyping = false;
     this.isLoading = false;
     this.currentTab = null;
+    this.port = null; // to the background worker, open while the popup is
+    this.chatTurn = 0;
 
     this.messagesContainer = document.getElementById('messages');
     this.messageInput = document.getElementById('messageInput');
@@ -22,11 +26,12 @@ class LilIVRChat {
   }
 
   async init() {
-    // Notify background that popup is open
-    try {
-      await chrome.runtime.sendMessage({ action: 'popupOpened' });
-    } catch (error) {
-    }
+    // The background worker treats the popup as open while this port is
+    // connected, and relays chat turns over its WebSocket through it
+    this.port = chrome.runtime.connect({ name: 'chat' });
+    this.port.onDisconnect.addListener(() => {
+      this.port = null;
+    });
 
     // Check for pending notifications
     await this.checkForNotifications();
@@ -34,16 +39,6 @@ class LilIVRChat {
     // Load popup settings
     await this.loadPopupSettings();
 
-    // Start sending ping messages to keep popup status alive
-    this.pingInterval = setInterval(async () => {
-      try {
-        await chrome.runtime.sendMessage({ action: 'popupPing' });
-      } catch (error) {
-        // Popup was closed, clear interval
-        clearInterval(this.pingInterval);
-      }
-    }, 1000); // Ping every second
-
     // Load saved messages first
     await this.loadMessages();
 
@@ -131,6 +126,7 @@ class LilIVRChat {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'X-Extension-Id': await getExtensionId(),
         },
         body: JSON.stringify({
           html_content: webpageUrl
@@ -153,12 +149,6 @@ class LilIVRChat {
     const messageText = this.messageInput.value.trim();
     if (!messageText || this.isLoading) return;
 
-    // Prepare conversation history BEFORE adding current message
-    const conversationHistory = this.messages.map(msg => ({
-      role: msg.isBot ? 'assistant' : 'user',
-      content: msg.text
-    }));
-
     // Add user message
     this.addMessage(messageText, false);
     this.messageInput.value = '';
@@ -168,63 +158,218 @@ class LilIVRChat {
     this.setLoading(true);
 
     try {
-      // Send to backend with conversation history
-      const response = await fetch(`${API_BASE_URL}/chat`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          message: messageText,
-          webpage_context: this.currentTab?.url || null,
-          conversation_history: conversationHistory
-        })
-      });
+      // Stream the reply from the backend so tokens render as they arrive
+      let streamingBubble = null;
+      const onDelta = (text) => {
+        if (!streamingBubble) {
+          this.setTyping(false);
+          streamingBubble = this.createStreamingBubble();
+        }
+        streamingBubble.textContent += text;
+        this.scrollToBottom();
+      };
 
-      if (response.ok) {
-        const data = await response.json();
+      let data;
+      try {
+        data = await this.streamChat(this.buildChatPayload(messageText), onDelta);
+      } catch (error) {
+        if (error.status !== 409) throw error;
+        // Server session expired: start over with the full history
+        this.sessionId = null;
+        this.sessionSynced = 0;
+        data = await this.streamChat(this.buildChatPayload(messageText), onDelta);
+      }
+
+      // Check if user disabled popups
+      const disablePopupPhrases = [
+        "stäng av popup", "stoppa popup", "sluta popup", "stäng popup",
+        "disable popup", "turn off popup", "stop popup", "no popup"
+      ];
 
-        // Check if user disabled popups
-        const disablePopupPhrases = [
-          "stäng av popup", "stoppa popup", "sluta popup", "stäng popup",
-          "disable popup", "turn off popup", "stop popup", "no popup"
-        ];
-
-        const userDisabledPopups = disablePopupPhrases.some(phrase =>
-          messageText.toLowerCase().includes(phrase)
-        );
-
-        if (userDisabledPopups) {
-          // Send message to content script to disable popups
-          try {
-            const tabs = await chrome.tabs.query({ active: true, currentWindow: true });
-            if (tabs[0]) {
-              chrome.tabs.sendMessage(tabs[0].id, { action: 'disablePopups' });
-            }
-          } catch (error) {
-            // Ignore errors
+      const userDisabledPopups = disablePopupPhrases.some(phrase =>
+        messageText.toLowerCase().includes(phrase)
+      );
+
+      if (userDisabledPopups) {
+        // Send message to content script to disable popups
+        try {
+          const tabs = await chrome.tabs.query({ active: true, currentWindow: true });
+          if (tabs[0]) {
+            chrome.tabs.sendMessage(tabs[0].id, { action: 'disablePopups' });
           }
+        } catch (error) {
+          // Ignore errors
         }
+      }
 
-        // Simulate typing delay
-        setTimeout(() => {
-          this.addMessage(data.response, true, data.includes_lyric, data.lyric_line);
-          this.setTyping(false);
-          this.setLoading(false);
-          this.messageInput.focus();
-        }, 800 + Math.random() * 1200);
-      } else {
-        throw new Error(`Server error: ${response.status}`);
+      // Replace the streamed bubble with the final, fully rendered message
+      if (streamingBubble) {
+        streamingBubble.closest('.message').remove();
       }
+      this.addMessage(data.response, true, data.includes_lyric, data.lyric_line);
+      this.sessionId = data.session_id || null;
+      this.sessionSynced = this.sessionId ? this.messages.length : 0;
+      this.saveSession();
+      this.setTyping(false);
+      this.setLoading(false);
+      this.messageInput.focus();
     } catch (error) {
+      const partial = this.messagesContainer.querySelector('.streaming-message');
+      if (partial) {
+        partial.remove();
+      }
+      // 429: the backend's rate limit for this client
+      const reply = error.status === 429 ? "Lugna ner dig bror, ge mig en minut" : "Förlåt, jag lyssnade inte?";
       setTimeout(() => {
-        this.addMessage("Förlåt, jag lyssnade inte?", true);
+        this.addMessage(reply, true);
         this.setTyping(false);
         this.setLoading(false);
       }, 1000);
     }
   }
 
+  // With a session only messages the server hasn't seen are sent (e.g. greetings),
+  // otherwise the full history goes along and a new session is requested
+  buildChatPayload(messageText) {
+    const history = this.messages.slice(this.sessionId ? this.sessionSynced : 0, -1).map(msg => ({
+      role: msg.isBot ? 'assistant' : 'user',
+      content: msg.text
+    }));
+
+    const payload = {
+      message: messageText,
+      webpage_context: this.currentTab?.url || null,
+      conversation_history: history
+    };
+    if (this.sessionId) {
+      payload.session_id = this.sessionId;
+    } else {
+      payload.use_session = true;
+    }
+    return payload;
+  }
+
+  // Chat turns go over the background worker's WebSocket; while it isn't
+  // connected they fall back to POST /chat/stream
+  async streamChat(payload, onDelta) {
+    try {
+      return await this.streamChatOverChannel(payload, onDelta);
+    } catch (error) {
+      if (error.status !== 0) throw error;
+      return this.streamChatOverHttp(payload, onDelta);
+    }
+  }
+
+  // Send a turn through the port and collect its delta events until done or error
+  streamChatOverChannel(payload, onDelta) {
+    return new Promise((resolve, reject) => {
+      const port = this.port;
+      // Unique across popup openings, so a late event from a closed popup's turn can't match
+      const id = `${Date.now()}-${++this.chatTurn}`;
+
+      const finish = (frame) => {
+        port.onMessage.removeListener(onFrame);
+        port.onDisconnect.removeListener(onDisconnect);
+        if (frame.type === 'done') {
+          resolve(frame);
+          return;
+        }
+        const error = new Error(frame.detail || 'Chat error');
+        error.status = frame.status;
+        reject(error);
+      };
+      const onFrame = (frame) => {
+        if (frame.id !== id) return;
+        if (frame.type === 'delta') {
+          onDelta(frame.text);
+        } else {
+          finish(frame);
+        }
+      };
+      const onDisconnect = () => finish({ type: 'error', status: 503, detail: 'Background worker went away' });
+
+      if (!port) {
+        reject(Object.assign(new Error('No background port'), { status: 0 }));
+        return;
+      }
+      port.onMessage.addListener(onFrame);
+      port.onDisconnect.addListener(onDisconnect);
+      port.postMessage({ type: 'chat', id, ...payload });
+    });
+  }
+
+  // POST to /chat/stream and read server-sent events until the final metadata event
+  async streamChatOverHttp(payload, onDelta) {
+    const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-Extension-Id': await getExtensionId(),
+      },
+      body: JSON.stringify(payload)
+    });
+
+    if (!response.ok || !response.body) {
+      const error = new Error(`Server error: ${response.status}`);
+      error.status = response.status;
+      throw error;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let eventName = 'message';
+        let eventData = '';
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event: ')) {
+            eventName = line.slice(7);
+          } else if (line.startsWith('data: ')) {
+            eventData += line.slice(6);
+          }
+        }
+
+        const parsed = eventData ? JSON.parse(eventData) : {};
+        if (eventName === 'delta') {
+          onDelta(parsed.text);
+        } else if (eventName === 'done') {
+          result = parsed;
+        } else if (eventName === 'error') {
+          throw new Error(parsed.detail);
+        }
+      }
+    }
+
+    if (!result) {
+      throw new Error('Stream ended without a response');
+    }
+    return result;
+  }
+
+  createStreamingBubble() {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message bot streaming-message';
+    messageDiv.innerHTML = `
+      <div class="message-avatar bot-avatar">
+        <img src="assets/lilivr.jpg" alt="Lil IVR" style="width: 100%; height: 100%; border-radius: 50%; object-fit: cover;">
+      </div>
+      <div class="message-bubble"></div>
+    `;
+    this.messagesContainer.appendChild(messageDiv);
+    return messageDiv.querySelector('.message-bubble');
+  }
+
   addMessage(text, isBot, includesLyric = false, lyricLine = null) {
     const message = {
       id: Date.now() + Math.random(),
@@ -365,15 +510,28 @@ class LilIVRChat {
 
   async loadMessages() {
     try {
-      const result = await chrome.storage.session.get(['lilIVRMessages']);
+      const result = await chrome.storage.session.get(['lilIVRMessages', 'lilIVRSession']);
       if (result.lilIVRMessages && Array.isArray(result.lilIVRMessages)) {
         this.messages = result.lilIVRMessages;
       }
+      if (result.lilIVRSession) {
+        this.sessionId = result.lilIVRSession.id;
+        this.sessionSynced = result.lilIVRSession.synced;
+      }
     } catch (error) {
       this.messages = [];
     }
   }
 
+  async saveSession() {
+    try {
+      await chrome.storage.session.set({
+        'lilIVRSession': { id: this.sessionId, synced: this.sessionSynced }
+      });
+    } catch (error) {
+    }
+  }
+
   renderAllMessages() {
     // Clear the container first
     this.messagesContainer.innerHTML = '';
@@ -409,14 +567,17 @@ class LilIVRChat {
   // Method to clear chat history
   async clearMessages() {
     this.messages = [];
+    this.sessionId = null;
+    this.sessionSynced = 0;
     this.messagesContainer.innerHTML = '';
-    await chrome.storage.session.remove(['lilIVRMessages']);
+    await chrome.storage.session.remove(['lilIVRMessages', 'lilIVRSession']);
   }
 
   // Cleanup method
   cleanup() {
-    if (this.pingInterval) {
-      clearInterval(this.pingInterval);
+    if (this.port) {
+      this.port.disconnect();
+      this.port = null;
     }
   }
 
@@ -476,7 +637,6 @@ window.addEventListener('beforeunload', () => {
     if (window.lilIVRChat) {
       window.lilIVRChat.cleanup();
     }
-    chrome.runtime.sendMessage({ action: 'popupClosed' });
   } catch (error) {
   }
 });
@@ -488,7 +648,6 @@ document.addEventListener('visibilitychange', () => {
       if (window.lilIVRChat) {
         window.lilIVRChat.cleanup();
       }
-      chrome.runtime.sendMessage({ action: 'popupClosed' });
     } catch (error) {
     }
   }
@@ -225,30 +225,29 @@
     setLoading(true);
 
     try {
-
-      const response = await fetch(`${API_BASE_URL}/chat`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          message: messageText || "Hej!",
-          webpage_context: webpageContext,
-          conversation_history: conversationHistory
-        })
+      // Stream the reply so tokens render as they arrive
+      let streamingMessage = null;
+      const data = await streamChat({
+        message: messageText || "Hej!",
+        webpage_context: webpageContext,
+        conversation_history: conversationHistory
+      }, (text) => {
+        if (!streamingMessage) {
+          isTyping = false;
+          streamingMessage = { id: Date.now() + Math.random(), text: '', isBot: true, timestamp: new Date() };
+          messages.push(streamingMessage);
+        }
+        streamingMessage.text += text;
+        updateChatbotUI();
       });
 
-      if (response.ok) {
-        const data = await response.json();
-
-        setTimeout(() => {
-          addMessage(data.response, true, data.includes_lyric, data.lyric_line);
-          setTyping(false);
-          setLoading(false);
-        }, 1000 + Math.random() * 1000);
-      } else {
-        throw new Error('Server error');
+      // Swap the streamed text for the final response and its lyric metadata
+      if (streamingMessage) {
+        messages.splice(messages.indexOf(streamingMessage), 1);
       }
+      isTyping = false;
+      addMessage(data.response, true, data.includes_lyric, data.lyric_line);
+      setLoading(false);
     } catch (error) {
       setTimeout(() => {
         addMessage("Asså bror, något gick fel med servern! 😅 Kan du testa igen?", true);
@@ -258,6 +257,62 @@
     }
   }
 
+  // POST to /chat/stream and read server-sent events until the final metadata event
+  async function streamChat(payload, onDelta) {
+    const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify(payload)
+    });
+
+    if (!response.ok || !response.body) {
+      throw new Error('Server error');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let eventName = 'message';
+        let eventData = '';
+        for (const line of rawEvent.split('\n')) {
+          if (line.startsWith('event: ')) {
+            eventName = line.slice(7);
+          } else if (line.startsWith('data: ')) {
+            eventData += line.slice(6);
+          }
+        }
+
+        const parsed = eventData ? JSON.parse(eventData) : {};
+        if (eventName === 'delta') {
+          onDelta(parsed.text);
+        } else if (eventName === 'done') {
+          result = parsed;
+        } else if (eventName === 'error') {
+          throw new Error(parsed.detail);
+        }
+      }
+    }
+
+    if (!result) {
+      throw new Error('Stream ended without a response');
+    }
+    return result;
+  }
+
   function addMessage(text, isBot, includesLyric = false, lyricLine = null) {
     const message = {
       id: Date.now() + Math.random(),
@@ -325,7 +380,8 @@
     document.addEventListener('scroll', updateActivity);
     document.addEventListener('visibilitychange', handleVisibilityChange);
 
-    // Listen for proactive messages and direct open commands
+    // Listen for proactive messages (planned by the backend and pushed over the
+    // background worker's WebSocket) and direct open commands
     window.addEventListener('message', (event) => {
       if (event.data.type === 'LIL_IVR_PROACTIVE_MESSAGE') {
         addMessage(event.data.message, true);
@@ -335,62 +391,8 @@
       }
     });
 
-    // Check for inactivity and send notifications
-    const inactivityInterval = setInterval(() => {
-      const now = Date.now();
-      const inactiveTime = now - lastActiveTime;
-
-      // Send notification after 10 minutes of inactivity (only once per cycle)
-      if (inactiveTime > 10 * 60 * 1000 && !isVisible && isPageVisible && !notificationSent) {
-        showRandomMessage();
-        notificationSent = true;
-        hasUnreadNotification = true;
-        updateNotificationBadge();
-      }
-    }, 60000); // Check every minute
-
-    // Show popup messages at random intervals (30-90 seconds) if there's an unread notification
-    let popupTimer = null;
-
-    function scheduleNextPopup() {
-      if (popupTimer) {
-        clearTimeout(popupTimer);
-        popupTimer = null;
-      }
-
-      if (hasUnreadNotification && !isVisible && isPageVisible) {
-        const randomDelay = (30 + Math.random() * 60) * 1000; // 30-90 seconds
-
-        popupTimer = setTimeout(() => {
-          if (hasUnreadNotification && !isVisible && isPageVisible) {
-            showRandomMessage();
-            scheduleNextPopup(); // Schedule the next one
-          }
-        }, randomDelay);
-      }
-    }
-
-    // Start the popup cycle
-    scheduleNextPopup();
-
-    // Reschedule when conditions change
-    const popupInterval = setInterval(() => {
-      if (hasUnreadNotification && !isVisible && isPageVisible && !popupTimer) {
-        scheduleNextPopup();
-      } else if ((!hasUnreadNotification || isVisible || !isPageVisible) && popupTimer) {
-        clearTimeout(popupTimer);
-        popupTimer = null;
-      }
-    }, 5000); // Check every 5 seconds
-
     // Cleanup function for when chatbot is closed
     window.lilIvrCleanup = function() {
-      clearInterval(inactivityInterval);
-      clearInterval(popupInterval);
-      if (popupTimer) {
-        clearTimeout(popupTimer);
-        popupTimer = null;
-      }
       document.removeEventListener('click', updateActivity);
       document.removeEventListener('keypress', updateActivity);
       document.removeEventListener('scroll', updateActivity);
@@ -410,18 +412,6 @@
     }
   }
 
-  async function showRandomMessage() {
-    try {
-      const response = await fetch(`${API_BASE_URL}/random-message`);
-      if (response.ok) {
-        const data = await response.json();
-        addMessage(data.message, true);
-        setVisible(true);
-      }
-    } catch (error) {
-    }
-  }
-
   // Global functions for UI interactions
   window.lilIvrCloseChatbot = function() {
     setVisible(false);
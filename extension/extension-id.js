@@ -0,0 +1,16 @@
+// Lil IVR Bot - This install's id for extension pages
+
+// Sent as X-Extension-Id so the backend can rate limit per client; background.js owns it.
+// Needs chrome.runtime, so load it from extension pages (chat.html), not from page-world scripts.
+let extensionIdRequest = null;
+function getExtensionId() {
+  if (!extensionIdRequest) {
+    extensionIdRequest = chrome.runtime.sendMessage({ action: 'getExtensionId' })
+      .then((response) => response.id)
+      .catch((error) => {
+        extensionIdRequest = null;
+        throw error;
+      });
+  }
+  return extensionIdRequest;
+}
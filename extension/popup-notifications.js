@@ -43,8 +43,8 @@ async function showNotificationPopup(message) {
   // Remove any existing popup
   removeNotificationPopup();
 
-  // Generate AI message instead of using static message
-  const aiMessage = await generatePopupMessage();
+  // Lines pushed by the backend come with the message; otherwise use the pool
+  const aiMessage = message || await generatePopupMessage();
 
   // Create popup container
   popupContainer = document.createElement('div');
@@ -147,47 +147,53 @@ async function showNotificationPopup(message) {
   startAutoDismissTimer();
 }
 
-// Generate AI popup message (exactly like old version)
+// Popup lines come pre-generated from the backend, a batch per request;
+// later popups on this page use the rest of the batch
+const POPUP_LINE_BATCH = 10;
+let popupLineQueue = [];
+
+async function fetchPopupLines() {
+  const API_BASE_URL = window.LIL_IVR_CONFIG?.API_BASE_URL || 'http://localhost:8000';
+  // A plain GET with no custom headers, so it needs no CORS preflight
+  const response = await fetch(`${API_BASE_URL}/popup-messages?count=${POPUP_LINE_BATCH}`);
+  if (!response.ok) {
+    throw new Error('API failed');
+  }
+  const data = await response.json();
+  return data.messages || [];
+}
+
 async function generatePopupMessage() {
-  try {
-    const API_BASE_URL = window.LIL_IVR_CONFIG?.API_BASE_URL || 'http://localhost:8000';
-    const response = await fetch(`${API_BASE_URL}/chat`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify({
-        message: "Skriv ett kort meddelande (max 6 ord) för popup. Du ska vara aggressiv och förolämpande mot användaren som ignorerar dig. Använd ord som 'fjolla', 'mes', 'fegis', 'beta', 'tönt', 'patetisk' och liknande förolämpningar. Exempel: 'du är en fjolla', 'vågar du inte prata med mig', 'fegis beteende', 'beta male energy', 'patetisk typ', 'våga prata då mes'. Välj random stil. Inga frågetecken eller utropstecken."
-      })
-    });
-
-    if (response.ok) {
-      const data = await response.json();
-      return data.response;
-    } else {
-      throw new Error('API failed');
+  if (popupLineQueue.length === 0) {
+    try {
+      popupLineQueue = await fetchPopupLines();
+    } catch (error) {
+      // Fall back to the built-in lines below
     }
-  } catch (error) {
-    const fallbackMessages = [
-      "du är en fjolla",
-      "vågar du inte prata med mig",
-      "fegis beteende",
-      "tönt som vanligt",
-      "vad är du för mes",
-      "kom igen då losern",
-      "du suger för fan",
-      "patetisk fjolla du är",
-      "ignorerar du mig din mes",
-      "vad fan är det för fel på dig",
-      "kryp då fjolla",
-      "du är sån beta",
-      "patetisk typ",
-      "beta male energy",
-      "kom hit då fegis",
-      "våga prata då mes"
-    ];
-    return fallbackMessages[Math.floor(Math.random() * fallbackMessages.length)];
   }
+  if (popupLineQueue.length > 0) {
+    return popupLineQueue.shift();
+  }
+
+  const fallbackMessages = [
+    "du är en fjolla",
+    "vågar du inte prata med mig",
+    "fegis beteende",
+    "tönt som vanligt",
+    "vad är du för mes",
+    "kom igen då losern",
+    "du suger för fan",
+    "patetisk fjolla du är",
+    "ignorerar du mig din mes",
+    "vad är fel på dig",
+    "kryp då fjolla",
+    "du är sån beta",
+    "patetisk typ",
+    "beta male energy",
+    "kom hit då fegis",
+    "våga prata då mes"
+  ];
+  return fallbackMessages[Math.floor(Math.random() * fallbackMessages.length)];
 }
 
 function startAutoDismissTimer() {
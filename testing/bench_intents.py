@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: single-pass intent matcher vs the old per-request scans
+
+The legacy functions below are copies of what chat() did before the intent
+engine: rebuild each keyword list per call and run any(x in msg.lower())
+over it, and rebuild the song-name dict for every lookup.
+
+Usage: python3 bench_intents.py [--number 20000]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from content import ContentRegistry  # noqa: E402
+
+# Song aliases come from the lyrics catalogue, as in the server
+matcher = ContentRegistry().snapshot().intents
+
+MESSAGES = [
+    "yo läget bror",
+    "vad är LiU för nåt egentligen?",
+    "kan du ge mig en rad från hannes rumpa",
+    "stäng av popup tack",
+    "skriv nåt töntigt för popup",
+    "asså ge mig en text, jag laddar ner en download från johnny, show me " * 3,
+    "berätta om din låt down och vad har jag gjort, vilka lyrics är bäst?",
+]
+
+def legacy_find_requested_song(user_message):
+    user_lower = user_message.lower()
+    song_name_mappings = {
+        'vickep': 'vickep_nanana', 'vicke': 'vickep_nanana', 'nanana': 'vickep_nanana',
+        'vickep nanana': 'vickep_nanana', 'abbes mom': 'abbes_mom', 'abbe mom': 'abbes_mom',
+        'abbe': 'abbes_mom', 'abbes': 'abbes_mom', 'john henriksson': 'john_henriksson',
+        'john': 'john_henriksson', 'henriksson': 'john_henriksson', 'edamame': 'edamame',
+        'down': 'down', 'du o jag': 'down', 'hannes rumpa': 'hannes_rumpa',
+        'hannes': 'hannes_rumpa', 'rumpa': 'hannes_rumpa', 'watcha say': 'watcha_say',
+        'vad har jag gjort': 'watcha_say', 'watcha': 'watcha_say',
+    }
+    for song_name, filename in song_name_mappings.items():
+        if song_name in user_lower:
+            return filename
+    return None
+
+def legacy_match(filtered_message):
+    search_indicators = [
+        'vad är', 'vad e', 'vad betyder', 'vadå', 'va är',
+        'vem är', 'vem e', 'vilka är', 'vilka e',
+        'var är', 'var e', 'var ligger', 'var finns',
+        'när är', 'när e', 'när var', 'när hände',
+        'hur är', 'hur e', 'hur fungerar', 'hur gör', 'hur många',
+        'varför är', 'varför e', 'varför kan', 'varför ska',
+        'vilken är', 'vilken e', 'vilket är', 'vilket e',
+        'berätta om', 'förklara', 'kan du förklara',
+        'vet du', 'känner du till', 'har du hört',
+        'what is', 'who is', 'where is', 'when', 'how', 'why'
+    ]
+    needs_web_search = any(indicator in filtered_message.lower() for indicator in search_indicators)
+    asking_for_lyrics = any(word in filtered_message.lower() for word in
+                            ['quote', 'quotes', 'låt', 'låtar', 'text', 'rad', 'rader', 'lyric', 'lyrics'])
+    requested_song = legacy_find_requested_song(filtered_message) if asking_for_lyrics else None
+    disable_popup_requests = any(phrase in filtered_message.lower() for phrase in [
+        "stäng av popup", "stoppa popup", "sluta popup", "stäng popup",
+        "disable popup", "turn off popup", "stop popup", "no popup"
+    ])
+    is_popup_request = "töntigt" in filtered_message.lower() or "popup" in filtered_message.lower()
+    return needs_web_search, asking_for_lyrics, requested_song, disable_popup_requests, is_popup_request
+
+def engine_match(filtered_message):
+    intents = matcher.match(filtered_message)
+    requested_song = intents.song if intents.asking_for_lyrics else None
+    return (intents.needs_web_search, intents.asking_for_lyrics, requested_song,
+            intents.disable_popups, intents.popup_request)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="passes over the sample messages")
+    args = parser.parse_args()
+
+    print("📋 Results (legacy vs engine):")
+    for message in MESSAGES:
+        legacy, engine = legacy_match(message), engine_match(message)
+        marker = "  " if legacy == engine else "≠ "
+        print(f"   {marker}{message[:50]!r}\n       legacy={legacy}\n       engine={engine}")
+
+    legacy_time = timeit.timeit(lambda: [legacy_match(m) for m in MESSAGES], number=args.number)
+    engine_time = timeit.timeit(lambda: [engine_match(m) for m in MESSAGES], number=args.number)
+    calls = args.number * len(MESSAGES)
+
+    print(f"\n⏱️  legacy: {legacy_time / calls * 1e6:.2f} µs/message")
+    print(f"⏱️  engine: {engine_time / calls * 1e6:.2f} µs/message")
+    print(f"🚀 speedup: {legacy_time / engine_time:.2f}x")
+
+if __name__ == "__main__":
+    main()
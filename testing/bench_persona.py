@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: persona model sampling, loading and training
+
+Samples each tier of the persona model the server would load (the built
+build/persona.bin, else one trained from the loaded lyrics) and times a
+line per tier, reading the model file and training from scratch.
+
+Usage: python3 bench_persona.py [--number 20000] [--samples 5]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+from content import ContentRegistry  # noqa: E402
+from persona import TIERS, PersonaModel, builtin_sources  # noqa: E402
+
+registry = ContentRegistry()
+snapshot = registry.snapshot()
+model = snapshot.persona
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="lines generated per tier")
+    parser.add_argument("--samples", type=int, default=5, help="example lines printed per tier")
+    args = parser.parse_args()
+
+    print(f"📋 Model: {len(model.vocab)} words, "
+          + ", ".join(f"{tier} {len(chain.keys)} states" for tier, chain in model.chains.items()))
+    for tier in TIERS:
+        print(f"\n🎭 {tier}:")
+        for _ in range(args.samples):
+            print(f"   {model.generate(tier)!r}")
+
+    print()
+    for tier in TIERS:
+        elapsed = timeit.timeit(lambda: model.generate(tier), number=args.number)
+        print(f"⏱️  {tier}: {elapsed / args.number * 1e6:.2f} µs/line")
+
+    if os.path.exists(registry.persona_file):
+        elapsed = timeit.timeit(lambda: PersonaModel.load(registry.persona_file), number=100)
+        print(f"⏱️  load {os.path.basename(registry.persona_file)}: {elapsed / 100 * 1e3:.2f} ms")
+    lines = [snapshot.index.line(i) for i in range(snapshot.index.line_count)]
+    elapsed = timeit.timeit(lambda: PersonaModel.train(builtin_sources(lyrics=lines)), number=20)
+    print(f"⏱️  train from {len(lines)} lyric lines: {elapsed / 20 * 1e3:.2f} ms")
+
+if __name__ == "__main__":
+    main()
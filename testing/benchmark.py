@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Latency and throughput benchmark for the Lil IVR Bot backend
+
+Replays a realistic mix of traffic at a fixed request rate (open loop: a
+slow server does not slow the sender down) and reports p50/p95/p99
+latency per scenario, throughput, errors and the backend's event-loop
+lag (read from its /metrics). By default the stub OpenAI server and the
+backend are started locally; --url benchmarks an already running backend.
+The local backend runs with its rate limits raised out of the way; a run
+in which any request is rate limited (429) fails instead of reporting.
+
+Scenarios (weights can be changed with --mix):
+    chat-short      short small-talk /chat messages
+    chat-lyrics     asks for lyrics from a song
+    chat-search     factual questions that trigger web search
+    chat-history    short message with a long conversation history
+    analyze-webpage popup greeting for a visited page
+    random-message  proactive popup message
+
+Save a run with --json and compare a later run against it with --baseline
+to get before/after numbers for a change.
+
+Usage: python3 benchmark.py [--rps 20] [--duration 30] [--latency 1.0] [--jitter 0.3]
+                            [--error-rate 0.02] [--mix chat-short=5,chat-search=2]
+                            [--json after.json] [--baseline before.json]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import sys
+import time
+
+import httpx
+
+from harness import UNTHROTTLED_ENV, running_services, wait_until_up
+
+SHORT_MESSAGES = [
+    "yo läget", "haha du är sjuk", "vad gör du", "tjena bror", "jag är uttråkad",
+    "spela nåt", "du är rolig", "hallå?", "ok", "asså nej",
+]
+LYRIC_MESSAGES = [
+    "kan du rappa raden från edamame", "ge mig en quote från down", "vad är texten i vickep nanana",
+    "rappa nåt från abbes mom", "har du några låtar", "dina bästa lyrics",
+]
+SEARCH_MESSAGES = [
+    "vem är sveriges statsminister?", "vad är huvudstaden i norge?", "när hände månlandningen?",
+    "hur många bor i stockholm?", "vad betyder yolo?", "berätta om soundcloud rap",
+]
+WEBPAGES = [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ", "https://github.com/Ivargavve/lil-ivr-bot",
+    "chrome://newtab/", "https://www.reddit.com/r/sweden/", "https://open.spotify.com/",
+    "https://www.svt.se/nyheter/", "https://example.com/some/page",
+]
+
+def long_history(rng, turns=20):
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"{rng.choice(SHORT_MESSAGES)} ({i})"})
+        history.append({"role": "assistant", "content": "Yo grabben asså jag vet inte bror, " * 3})
+    return history
+
+SCENARIOS = {
+    "chat-short": lambda rng: ("POST", "/chat", {"message": rng.choice(SHORT_MESSAGES)}),
+    "chat-lyrics": lambda rng: ("POST", "/chat", {"message": rng.choice(LYRIC_MESSAGES)}),
+    "chat-search": lambda rng: ("POST", "/chat", {"message": rng.choice(SEARCH_MESSAGES)}),
+    "chat-history": lambda rng: ("POST", "/chat", {
+        "message": rng.choice(SHORT_MESSAGES), "conversation_history": long_history(rng)}),
+    "analyze-webpage": lambda rng: ("POST", "/analyze-webpage", {"html_content": rng.choice(WEBPAGES)}),
+    "random-message": lambda rng: ("GET", "/random-message", None),
+}
+
+DEFAULT_MIX = {
+    "chat-short": 5, "chat-lyrics": 2, "chat-search": 2, "chat-history": 1,
+    "analyze-webpage": 3, "random-message": 2,
+}
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+async def send(client, base_url, scenario, request, scheduled, results):
+    method, path, body = request
+    status = None
+    try:
+        response = await client.request(method, base_url + path, json=body)
+        status = response.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    # Measured from when the request was due, not when it was sent, so a
+    # backlog in the sender still counts against the server
+    results.append((scenario, time.perf_counter() - scheduled, status))
+
+async def measure_client_lag(stop, samples, interval=0.05):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+LAG_LINE = re.compile(r'^lilivr_event_loop_lag_seconds_(bucket|sum|count)(?:\{le="([^"]+)"\})? (\S+)$')
+
+async def scrape_loop_lag(client, base_url):
+    """Bucket counts, sum and count of the backend's event-loop lag histogram"""
+    try:
+        text = (await client.get(base_url + "/metrics")).text
+    except httpx.HTTPError:
+        return None
+    lag = {"buckets": {}, "sum": 0.0, "count": 0}
+    for line in text.splitlines():
+        match = LAG_LINE.match(line)
+        if not match:
+            continue
+        kind, le, value = match.groups()
+        if kind == "bucket":
+            lag["buckets"][le] = float(value)
+        elif kind == "sum":
+            lag["sum"] = float(value)
+        else:
+            lag["count"] = int(float(value))
+    return lag if lag["buckets"] else None
+
+def loop_lag_between(before, after):
+    """Mean and approximate p99 (bucket upper bound) of lag samples taken between two scrapes"""
+    if not before or not after:
+        return None
+    count = after["count"] - before["count"]
+    if count <= 0:
+        return None
+    p99 = None
+    for le, cumulative in after["buckets"].items():
+        if cumulative - before["buckets"].get(le, 0) >= 0.99 * count:
+            p99 = float(le)
+            break
+    return {"samples": count, "mean_ms": (after["sum"] - before["sum"]) / count * 1000,
+            "p99_ms": p99 * 1000 if p99 is not None else None}
+
+async def run_benchmark(base_url, rps, duration, mix, warmup, seed, timeout):
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    total = int(rps * duration)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=200)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        await wait_until_up(client, base_url + "/docs")
+        # Warm-up traffic is not counted: imports, pooled connections, caches
+        await asyncio.gather(*(send(client, base_url, name, SCENARIOS[name](rng), time.perf_counter(), [])
+                               for name in names for _ in range(warmup)))
+
+        lag_before = await scrape_loop_lag(client, base_url)
+        results, client_lag = [], []
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_client_lag(stop, client_lag))
+
+        tasks = []
+        started = time.perf_counter()
+        for i in range(total):
+            scheduled = started + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            name = rng.choices(names, weights)[0]
+            tasks.append(asyncio.create_task(send(client, base_url, name, SCENARIOS[name](rng), scheduled, results)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await lag_task
+        lag_after = await scrape_loop_lag(client, base_url)
+
+    return summarize(results, elapsed, rps, duration, loop_lag_between(lag_before, lag_after), client_lag)
+
+def summarize(results, elapsed, rps, duration, server_lag, client_lag):
+    def stats(rows):
+        latencies = sorted(latency for _, latency, status in rows if status == 200)
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for _, _, status in rows if status != 200),
+            "p50_ms": ms(percentile(latencies, 50)),
+            "p95_ms": ms(percentile(latencies, 95)),
+            "p99_ms": ms(percentile(latencies, 99)),
+            "max_ms": ms(latencies[-1] if latencies else None),
+        }
+
+    statuses = {}
+    for _, _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    client_lag.sort()
+    return {
+        "target_rps": rps,
+        "duration_s": duration,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(sum(1 for _, _, status in results if status == 200) / elapsed, 2),
+        "statuses": statuses,
+        "overall": stats(results),
+        "scenarios": {name: stats([row for row in results if row[0] == name])
+                      for name in sorted({row[0] for row in results})},
+        "server_loop_lag": server_lag,
+        "client_loop_lag_p99_ms": ms(percentile(client_lag, 99)),
+    }
+
+def ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+def fmt(value):
+    return "-" if value is None else f"{value:.0f}"
+
+def delta(now, before):
+    if now is None or not before:
+        return ""
+    return f" ({(now - before) / before * 100:+.0f}%)"
+
+def print_report(report, baseline=None):
+    base = baseline or {}
+    print(f"\n📊 {report['overall']['requests']} requests at {report['target_rps']} rps target "
+          f"over {report['elapsed_s']}s")
+    print(f"   throughput: {report['throughput_rps']} rps{delta(report['throughput_rps'], base.get('throughput_rps'))}"
+          f"   statuses: {report['statuses']}")
+
+    print(f"\n   {'scenario':<16} {'n':>5} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    rows = list(report["scenarios"].items()) + [("overall", report["overall"])]
+    for name, row in rows:
+        before = base.get("overall") if name == "overall" else base.get("scenarios", {}).get(name, {})
+        before = before or {}
+        print(f"   {name:<16} {row['requests']:>5} {row['errors']:>4} "
+              f"{fmt(row['p50_ms']):>8} {fmt(row['p95_ms']):>8} {fmt(row['p99_ms']):>8} {fmt(row['max_ms']):>8}"
+              + (f"   p50{delta(row['p50_ms'], before.get('p50_ms'))} p99{delta(row['p99_ms'], before.get('p99_ms'))}"
+                 if before else ""))
+
+    lag = report["server_loop_lag"]
+    if lag:
+        print(f"\n   server event-loop lag: mean {lag['mean_ms']:.2f}ms, p99 <= {fmt(lag['p99_ms'])}ms "
+              f"({lag['samples']} samples)")
+    else:
+        print("\n   server event-loop lag: not available (no lilivr_event_loop_lag_seconds in /metrics)")
+    client_p99 = report["client_loop_lag_p99_ms"]
+    print(f"   load generator loop lag p99: {fmt(client_p99)}ms")
+    if client_p99 is not None and client_p99 > 50:
+        print("⚠️  The load generator itself is lagging; lower --rps or the numbers are not trustworthy")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=20, help="target request rate")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured traffic")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests per scenario before the run")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="scenario weights, e.g. chat-short=5,chat-search=1")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the request mix (and the stub's injection)")
+    parser.add_argument("--timeout", type=float, default=60, help="client timeout per request in seconds")
+    parser.add_argument("--url", help="benchmark an already running backend instead of starting one")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="compare against a report saved earlier with --json")
+
+    stub = parser.add_argument_group("stub OpenAI server (ignored with --url)")
+    stub.add_argument("--latency", type=float, default=1.0)
+    stub.add_argument("--jitter", type=float, default=0.2)
+    stub.add_argument("--error-rate", type=float, default=0.0)
+    stub.add_argument("--ratelimit-rate", type=float, default=0.0)
+    stub.add_argument("--hang-rate", type=float, default=0.0)
+    stub.add_argument("--stub-port", type=int, default=9100)
+    stub.add_argument("--backend-port", type=int, default=8100)
+    args = parser.parse_args()
+
+    run = lambda url: asyncio.run(run_benchmark(url, args.rps, args.duration, args.mix,
+                                                args.warmup, args.seed, args.timeout))
+    if args.url:
+        report = run(args.url.rstrip("/"))
+    else:
+        stub_args = ["--latency", args.latency, "--jitter", args.jitter, "--error-rate", args.error_rate,
+                     "--ratelimit-rate", args.ratelimit_rate, "--hang-rate", args.hang_rate, "--seed", args.seed]
+        with running_services(args.stub_port, args.backend_port, stub_args, backend_env=UNTHROTTLED_ENV) as url:
+            report = run(url)
+
+    throttled = report["statuses"].get("429", 0)
+    if throttled:
+        # Latencies of a throttled run measure the rate limiter, not the backend
+        print(f"\n❌ {throttled} of {report['overall']['requests']} requests were rate limited (429), no report written.")
+        if args.url:
+            print("   Raise RATE_LIMIT_PER_CLIENT, RATE_LIMIT_PER_IP and RATE_LIMIT_SEARCHES on the benchmarked backend.")
+        sys.exit(1)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report written to {args.json}")
+
+    if report["overall"]["requests"] == 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
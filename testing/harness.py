@@ -0,0 +1,69 @@
+"""
+Process helpers shared by the Lil IVR Bot load tests and benchmarks
+
+Starts the stub OpenAI server and the backend (pointed at the stub through
+OPENAI_BASE_URL) as subprocesses and tears them down again.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import httpx
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(ROOT, "..", "backend")
+
+# Every simulated user sends from 127.0.0.1 without an X-Extension-Id, so the
+# backend's per-client, per-IP and web-search limits would answer most of a
+# load test with 429; tools that measure latency start the backend with these
+UNTHROTTLED_ENV = {
+    "RATE_LIMIT_PER_CLIENT": "1000000",
+    "RATE_LIMIT_PER_IP": "1000000",
+    "RATE_LIMIT_SEARCHES": "1000000",
+}
+
+class RateLimited(RuntimeError):
+    """The backend throttled the load generator, so its numbers measure the limiter"""
+
+async def wait_until_up(client, url, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+@contextmanager
+def running_services(stub_port, backend_port, stub_args=(), backend_env=None, runner=False):
+    """Run the stub and the backend for the duration of the with block; yields the backend URL
+
+    runner: start the backend through run.py (one worker) to get its production
+            server options instead of plain uvicorn defaults
+    """
+    env = dict(os.environ)
+    env["OPENAI_API_KEY"] = "stub"
+    env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{stub_port}/v1"
+    env.update(backend_env or {})
+
+    stub = subprocess.Popen([sys.executable, os.path.join(ROOT, "stub_llm_server.py"),
+                             "--port", str(stub_port), *map(str, stub_args)])
+    if runner:
+        env.setdefault("LOG_LEVEL", "WARNING")
+        command = [sys.executable, "run.py", "--workers", "1", "--host", "127.0.0.1", "--port", str(backend_port)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                   "--port", str(backend_port), "--log-level", "warning"]
+    backend = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    try:
+        yield f"http://127.0.0.1:{backend_port}"
+    finally:
+        backend.terminate()
+        stub.terminate()
+        backend.wait()
+        stub.wait()
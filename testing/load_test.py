@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Concurrency load test for the Lil IVR Bot backend
+
+Starts the stub OpenAI server and the backend (pointed at the stub through
+OPENAI_BASE_URL), fires a burst of overlapping /chat requests and compares
+the wall time of the burst with the latency of a single upstream call.
+With a non-blocking client the whole burst should finish in roughly the
+time of one completion.
+
+Usage: python3 load_test.py [--requests 50] [--latency 1.0]
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+import httpx
+
+from harness import UNTHROTTLED_ENV, RateLimited, running_services, wait_until_up
+
+async def timed_chat(client, base_url, i):
+    start = time.perf_counter()
+    response = await client.post(f"{base_url}/chat", json={"message": f"yo läget {i}"})
+    if response.status_code == 429:
+        raise RateLimited(f"/chat answered 429 ({response.text}); the backend is rate limiting the load test")
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+async def run_burst(base_url, count):
+    async with httpx.AsyncClient(timeout=120.0, limits=httpx.Limits(max_connections=count)) as client:
+        await wait_until_up(client, f"{base_url}/docs")
+        # Warm up imports and pooled connections so the burst measures steady state
+        await asyncio.gather(*(timed_chat(client, base_url, i) for i in range(4)))
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(timed_chat(client, base_url, i) for i in range(count)))
+        return time.perf_counter() - start, sorted(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50, help="overlapping /chat requests to send")
+    parser.add_argument("--latency", type=float, default=1.0, help="stub completion latency in seconds")
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--backend-port", type=int, default=8100)
+    args = parser.parse_args()
+
+    with running_services(args.stub_port, args.backend_port, ["--latency", args.latency],
+                          backend_env=UNTHROTTLED_ENV) as base_url:
+        wall, latencies = asyncio.run(run_burst(base_url, args.requests))
+
+    print(f"\n📊 {args.requests} overlapping /chat requests, stub latency {args.latency:.2f}s")
+    print(f"   wall time: {wall:.2f}s  (serial would be ~{args.requests * args.latency:.0f}s)")
+    print(f"   p50: {latencies[len(latencies) // 2]:.2f}s  max: {latencies[-1]:.2f}s")
+
+    if wall > args.latency * 3:
+        print("❌ Requests were serialized - the event loop is blocking on upstream calls")
+        sys.exit(1)
+    print("✅ Requests overlapped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Stub OpenAI server for Lil IVR Bot load tests
+
+Answers POST /v1/chat/completions with a canned completion after a
+configurable delay, so the backend can be exercised without an API key or
+network. Requests with "stream": true get the reply as server-sent chunks.
+
+Failure injection, each a share of requests between 0 and 1:
+    --error-rate     answer 500 with an OpenAI-style error body
+    --ratelimit-rate answer 429
+    --hang-rate      never answer within any sane client timeout
+
+Usage: python3 stub_llm_server.py [--port 9100] [--latency 1.0] [--jitter 0.2]
+                                  [--error-rate 0.05] [--ratelimit-rate 0.01] [--hang-rate 0.01]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPLY = "Yo grabben, kolla https://example.com/track asså vad händer?"
+
+app = FastAPI(title="Stub OpenAI")
+app.state.latency = 1.0
+app.state.jitter = 0.0
+app.state.error_rate = 0.0
+app.state.ratelimit_rate = 0.0
+app.state.hang_rate = 0.0
+
+HANG_SECONDS = 600
+
+USAGE = {
+    "prompt_tokens": 1200,
+    "completion_tokens": 10,
+    "total_tokens": 1210,
+    "prompt_tokens_details": {"cached_tokens": 1024},
+}
+
+def latency():
+    """Configured latency, spread uniformly by +-jitter"""
+    return max(0.0, app.state.latency + random.uniform(-app.state.jitter, app.state.jitter))
+
+def injected_failure():
+    """An error response for this request, or None to answer normally"""
+    roll = random.random()
+    if roll < app.state.error_rate:
+        return JSONResponse(status_code=500, content={
+            "error": {"message": "Injected server error", "type": "server_error", "code": None}})
+    roll -= app.state.error_rate
+    if roll < app.state.ratelimit_rate:
+        return JSONResponse(status_code=429, headers={"retry-after": "1"}, content={
+            "error": {"message": "Injected rate limit", "type": "requests", "code": "rate_limit_exceeded"}})
+    return None
+
+async def stream_reply(completion_id, model, include_usage):
+    # First token arrives after the configured latency, the rest trickle in
+    await asyncio.sleep(latency())
+    words = REPLY.split(" ")
+    for i, word in enumerate(words):
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        await asyncio.sleep(0.02)
+    if include_usage:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [],
+            "usage": USAGE,
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    model = body.get("model", "gpt-4o-mini")
+
+    if random.random() < app.state.hang_rate:
+        await asyncio.sleep(HANG_SECONDS)
+    failure = injected_failure()
+    if failure is not None:
+        await asyncio.sleep(latency() / 4)
+        return failure
+
+    if body.get("stream"):
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+        return StreamingResponse(stream_reply(completion_id, model, include_usage), media_type="text/event-stream")
+
+    await asyncio.sleep(latency())
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": REPLY},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": USAGE,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds to wait before answering")
+    parser.add_argument("--jitter", type=float, default=0.0, help="spread latency uniformly by +- this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--ratelimit-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="share of requests that never answer")
+    parser.add_argument("--seed", type=int, default=None, help="seed for jitter and failure injection")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    app.state.latency = args.latency
+    app.state.jitter = args.jitter
+    app.state.error_rate = args.error_rate
+    app.state.ratelimit_rate = args.ratelimit_rate
+    app.state.hang_rate = args.hang_rate
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Idle WebSocket soak test for the Lil IVR Bot push channel
+
+Starts the stub OpenAI server and the backend through run.py (one worker,
+with its production WebSocket options), opens many mostly idle /ws
+connections the way the extension's background worker does (a state
+frame, then a keepalive every 20 seconds), holds them, and reports the
+worker's resident memory per connection along with the pushes the
+clients received. PUSH_IDLE_AFTER is lowered so the scheduler actually
+pushes during the hold.
+
+The client side needs a file descriptor per connection too; raise
+ulimit -n above --connections first.
+
+Usage: python3 ws_soak.py [--connections 10000] [--hold 30] [--idle 5]
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+import time
+
+import httpx
+import websockets
+
+from harness import running_services, wait_until_up
+
+KEEPALIVE = 20.0
+
+async def resident_memory(client, base_url):
+    text = (await client.get(f"{base_url}/metrics")).text
+    match = re.search(r"^process_resident_memory_bytes (\d+)", text, re.M)
+    return int(match.group(1))
+
+async def idle_client(ws_url, i, opened, stop, received):
+    try:
+        async with opened:
+            ws = await websockets.connect(f"{ws_url}?client=soak-{i:08d}", ping_interval=None,
+                                          compression=None, open_timeout=60)
+    finally:
+        received["settled"] = received.get("settled", 0) + 1
+    try:
+        await ws.send(json.dumps({"type": "state", "visible": True, "chat_open": False, "popups": True}))
+        while not stop.is_set():
+            try:
+                frame = json.loads(await asyncio.wait_for(ws.recv(), KEEPALIVE))
+                received[frame["type"]] = received.get(frame["type"], 0) + 1
+            except asyncio.TimeoutError:
+                await ws.send('{"type": "ping"}')
+    finally:
+        await ws.close()
+
+async def soak(base_url, count, hold):
+    ws_url = base_url.replace("http://", "ws://") + "/ws"
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        await wait_until_up(client, f"{base_url}/ready")
+        # Let content load and settle before the baseline
+        await asyncio.sleep(2)
+        before = await resident_memory(client, base_url)
+
+        opened = asyncio.Semaphore(200)
+        stop = asyncio.Event()
+        received = {}
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(idle_client(ws_url, i, opened, stop, received)) for i in range(count)]
+        # Until every client has connected or failed
+        while received.get("settled", 0) < count:
+            await asyncio.sleep(0.1)
+        connect_time = time.perf_counter() - started
+        failed = sum(1 for t in tasks if t.done() and t.exception())
+
+        await asyncio.sleep(hold)
+        after = await resident_memory(client, base_url)
+        metrics = (await client.get(f"{base_url}/metrics")).text
+        open_sockets = int(re.search(r"^lilivr_push_clients (\d+)", metrics, re.M).group(1))
+
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        del received["settled"]
+        return before, after, open_sockets, failed, connect_time, received
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=10000, help="idle WebSockets to open")
+    parser.add_argument("--hold", type=float, default=30.0, help="seconds to hold them open")
+    parser.add_argument("--idle", type=float, default=5.0, help="PUSH_IDLE_AFTER for the backend")
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--backend-port", type=int, default=8100)
+    args = parser.parse_args()
+
+    backend_env = {
+        "PUSH_IDLE_AFTER": str(args.idle),
+        "PUSH_MAX_CLIENTS": str(args.connections + 100),
+        # Every socket comes from 127.0.0.1
+        "RATE_LIMIT_PER_IP": str(args.connections * 2),
+    }
+    with running_services(args.stub_port, args.backend_port, backend_env=backend_env, runner=True) as base_url:
+        before, after, open_sockets, failed, connect_time, received = asyncio.run(
+            soak(base_url, args.connections, args.hold))
+
+    per_connection = (after - before) / max(open_sockets, 1)
+    print(f"\n📊 {args.connections} idle WebSockets held {args.hold:.0f}s on one worker")
+    print(f"   open: {open_sockets}  failed: {failed}  connected in {connect_time:.1f}s")
+    print(f"   resident memory: {before / 2**20:.0f} MB -> {after / 2**20:.0f} MB  "
+          f"(~{per_connection / 1024:.1f} KB per connection)")
+    print(f"   pushes received: {received}")
+
+    if open_sockets < args.connections * 0.99:
+        print("❌ Connections were dropped")
+        sys.exit(1)
+    print("✅ Connections held")
+
+if __name__ == "__main__":
+    main()